@@ -0,0 +1,271 @@
+"""
+Libbnet benchmarks
+
+Times parsing, Gibbs sampling and exact inference on the sample networks
+and on generated networks of growing size and treewidth, and compact
+against dense CPTs, writes the results as JSON, and compares them with a
+stored baseline.
+"""
+
+import json
+import optparse
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy
+
+from bnet.BNet import Context
+from bnet.parsers import RaviParser, BNIFParser
+from bnet.generate import randomNet
+from bnet.writers import writeRavi, writeBIF
+from bnet.jtree import JunctionTree
+from bnet.sampling import GibbsSampler, diagnostics
+from bnet.forward import ForwardSampler
+from bnet import algos, cpts
+
+SAMPLES = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'samples' )
+
+def best( f, repeat ):
+    """Least time of repeat calls to f, and the result of the last one"""
+    times = []
+    for i in xrange( repeat ):
+        start = time.time()
+        result = f()
+        times.append( time.time() - start )
+    return min( times ), result
+
+def buffers( obj ):
+    """Sizes of the numpy buffers reachable from obj through containers and
+    attributes, by buffer, so views are counted with what they view"""
+    found = {}
+    seen = set()
+    stack = [ obj ]
+    while stack:
+        o = stack.pop()
+        if id( o ) in seen:
+            continue
+        seen.add( id( o ) )
+        if isinstance( o, numpy.ndarray ):
+            while isinstance( o.base, numpy.ndarray ):
+                o = o.base
+            found[ id( o ) ] = o.nbytes
+        elif isinstance( o, dict ):
+            stack.extend( o.keys() )
+            stack.extend( o.values() )
+        elif isinstance( o, ( list, tuple, set, frozenset ) ):
+            stack.extend( o )
+        elif hasattr( o, '__dict__' ) or hasattr( o, '__slots__' ):
+            stack.extend( [ getattr( o, k ) for k in getattr( o, '__slots__', () ) if hasattr( o, k ) ] )
+            stack.extend( getattr( o, '__dict__', {} ).values() )
+    return found
+
+def footprint( obj, net ):
+    """kB of the numpy buffers obj holds beyond those of the network"""
+    shared = buffers( net )
+    return sum( [ size for key, size in buffers( obj ).items() if key not in shared ] ) / 1024.0
+
+class Bench:
+    """Collects results as name -> { value, unit, better }"""
+
+    def __init__( self, repeat, verbose ):
+        self.repeat = repeat
+        self.verbose = verbose
+        self.results = {}
+
+    def record( self, name, value, unit, better='lower' ):
+        self.results[ name ] = { 'value' : value, 'unit' : unit, 'better' : better }
+        if self.verbose:
+            sys.stderr.write( "%-50s %12.6g %s\n"%( name, value, unit ) )
+
+    def networks( self, quick ):
+        """( name, net, ctx ) of every network benchmarked"""
+        nets = [
+            ( '1.ravi', RaviParser().parseFile( os.path.join( SAMPLES, '1.ravi' ) ) ),
+            ( 'alarm.bif', BNIFParser().parseFile( os.path.join( SAMPLES, 'alarm.bif' ) ) ),
+            ]
+        sizes = [ 100, 1000 ] if quick else [ 100, 1000, 5000 ]
+        for n in sizes:
+            nets.append( ( 'random-n%d-w5'%( n ), randomNet( n, maxParents=3, window=5, seed=n ) ) )
+        widths = [ 2, 4 ] if quick else [ 2, 4, 8, 12 ]
+        for w in widths:
+            nets.append( ( 'random-n200-w%d'%( w ), randomNet( 200, maxParents=w, window=w, seed=w ) ) )
+
+        for name, net in nets:
+            # Evidence on a few of the last variables, which are usually
+            # descendants of the rest
+            ctx = Context( net )
+            for id in net.topologicalOrder()[ -3: ]:
+                ctx.setVariable( id, net.get( id ).values[ 0 ] )
+            yield name, net, ctx
+
+    def parsing( self, quick ):
+        for name, parser in [ ( '1.ravi', RaviParser ), ( 'alarm.bif', BNIFParser ) ]:
+            fname = os.path.join( SAMPLES, name )
+            seconds, _ = best( lambda: parser().parseFile( fname ), self.repeat )
+            self.record( 'parse/%s'%( name ), seconds, 's' )
+
+        # Generated networks, written out in both formats
+        n = 2000 if quick else 20000
+        net = randomNet( n, maxParents=3, window=10, seed=n )
+        for ext, write, parser in [ ( 'ravi', writeRavi, RaviParser ), ( 'bif', writeBIF, BNIFParser ) ]:
+            fd, fname = tempfile.mkstemp( suffix='.' + ext )
+            f = os.fdopen( fd, 'w' )
+            try:
+                seconds, _ = best( lambda: write( net, f ), 1 )
+            finally:
+                f.close()
+            name = 'random-n%d.%s'%( n, ext )
+            self.record( 'write/%s'%( name ), seconds, 's' )
+            try:
+                seconds, _ = best( lambda: parser().parseFile( fname ), self.repeat )
+            finally:
+                os.remove( fname )
+            self.record( 'parse/%s'%( name ), seconds, 's' )
+
+    def exact( self, name, net, ctx ):
+        seconds, tree = best( lambda: JunctionTree( net ), self.repeat )
+        self.record( 'exact/%s/compile'%( name ), seconds, 's' )
+        self.record( 'exact/%s/width'%( name ), max( map( len, tree.cliques ) ) - 1, 'vars' )
+
+        def calibrate():
+            tree.messages.clear()
+            tree.beliefs.clear()
+            return tree.marginals( ctx )
+        seconds, marginals = best( calibrate, self.repeat )
+        self.record( 'exact/%s/calibrate'%( name ), seconds, 's' )
+        self.record( 'memory/%s/exact'%( name ), footprint( tree, net ), 'kB' )
+
+        if len( net.variables ) <= 100:
+            query = net.topologicalOrder()[ 0 ]
+            seconds, _ = best( lambda: algos.exactQuery( net, ctx, query ), self.repeat )
+            self.record( 'exact/%s/eliminate'%( name ), seconds, 's' )
+        return marginals
+
+    def gibbs( self, name, net, ctx, exact, lengths ):
+        if len( net.variables ) <= 100:
+            steps = 2000
+            seconds, _ = best( lambda: algos.gibbsSample( net, ctx, 0, steps, seed=1 ), 1 )
+            self.record( 'gibbs/%s/gibbsSample-rate'%( name ), steps / seconds, 'updates/s', 'higher' )
+
+        for chains in ( 1, 100 ):
+            sampler = GibbsSampler( net, ctx, chains, seed=1 )
+            sampler.run( 0, max( 1, 20000 / ( chains * len( sampler.free ) ) ) )
+            self.record( 'gibbs/%s/rate-chains%d'%( name, chains ), sampler.rate(), 'updates/s', 'higher' )
+            self.record( 'memory/%s/gibbs-chains%d'%( name, chains ), footprint( sampler, net ), 'kB' )
+
+        # Accuracy against chain length, and effective samples per second,
+        # one variable at a time and in blocks
+        for blocks in ( None, 'family', 'clique' ):
+            label = 'accuracy' if blocks is None else 'accuracy-%s'%( blocks )
+            for sweeps in lengths:
+                marginals = GibbsSampler( net, ctx, 1, seed=1, blocks=blocks ).run( sweeps / 10, sweeps )
+                error = max( [ abs( marginals[ id ][ v ] - p ) for id in exact for v, p in exact[ id ].items() ] )
+                self.record( '%s/%s/sweeps%d'%( label, name, sweeps ), error, 'max abs error' )
+            label = 'ess-rate' if blocks is None else 'ess-rate-%s'%( blocks )
+            self.record( 'gibbs/%s/%s'%( name, label ), self.essRate( net, ctx, blocks, min( lengths[ -1 ], 2000 ) ), 'samples/s', 'higher' )
+
+    def essRate( self, net, ctx, blocks, sweeps, batches=20, seed=1 ):
+        """
+        Effective samples per second of a chain, for its slowest mixing
+        variable: the smallest batch means ESS of a value of a free
+        variable, over the time taken to build the sampler, burn in and
+        run sweeps sweeps
+        """
+        batch = max( 1, sweeps / batches )
+        start = time.time()
+        sampler = GibbsSampler( net, ctx, 1, seed=seed, blocks=blocks )
+        sampler.run( sweeps / 10, 0 )
+        frequencies = []
+        for b in xrange( batches ):
+            counts = sampler.counts.copy()
+            sampler.run( 0, batch )
+            frequencies.append( ( sampler.counts - counts ) / batch )
+        seconds = time.time() - start
+        p, rhat, se, ess = diagnostics( numpy.array( [ frequencies ] ), batch )
+        spans = [ slice( sampler.statOffsets[ i ], sampler.statOffsets[ i ] + sampler.cards[ i ] ) for i in sampler.free ]
+        return min( [ ess[ span ].min() for span in spans ] ) / seconds
+
+    def compact( self, quick ):
+        """Noisy-OR nodes of many parents, with dense and compact CPTs"""
+        from bnet.BNet import BNet, BNode
+        random = numpy.random.RandomState( 1 )
+        parents = 12 if quick else 16
+        values = [ 'T', 'F' ]
+        for form in ( 'dense', 'compact' ):
+            net = BNet()
+            roots = [ 'r%d'%( i ) for i in range( 2 * parents ) ]
+            for id in roots:
+                p = random.rand()
+                net.add( BNode( id, (), ( id, ), values, cpt=[ p, 1 - p ] ) )
+            for i in range( 8 ):
+                cpt = cpts.NoisyMax.noisyOr( random.rand( parents ), 0.01 )
+                net.add( BNode( 'or%d'%( i ), roots[ i : i + parents ], (), values, parentValues=[ values ] * parents,
+                        cpt=cpt if form == 'compact' else numpy.asarray( cpt ) ) )
+            name = 'noisy-or-p%d-%s'%( parents, form )
+            self.record( 'memory/%s/cpt'%( name ), sum( [ n.cpt.nbytes for n in net.variables.values() ] ) / 1024.0, 'kB' )
+            sampler = ForwardSampler( net, seed=1 )
+            seconds, _ = best( lambda: sampler.sample( 20000 ), self.repeat )
+            self.record( 'forward/%s/rate'%( name ), 20000 / seconds, 'samples/s', 'higher' )
+            seconds, _ = best( lambda: GibbsSampler( net, Context( net ), 100, seed=1 ).run( 0, 20 ), self.repeat )
+            self.record( 'gibbs/%s/run'%( name ), seconds, 's' )
+
+    def run( self, quick ):
+        self.parsing( quick )
+        self.compact( quick )
+        lengths = [ 100, 1000 ] if quick else [ 100, 1000, 10000 ]
+        for name, net, ctx in self.networks( quick ):
+            self.record( 'memory/%s/cpt'%( name ), sum( [ n.cpt.nbytes for n in net.variables.values() ] ) / 1024.0, 'kB' )
+            exact = self.exact( name, net, ctx )
+            self.gibbs( name, net, ctx, exact, lengths if len( net.variables ) <= 1000 else lengths[ :1 ] )
+        return self.results
+
+def compare( results, baseline, tolerance ):
+    """Names and ratios of the results that are worse than the baseline by
+    more than the tolerance, as a fraction"""
+    regressions = []
+    for name, result in sorted( results.items() ):
+        if name not in baseline or result[ 'unit' ] == 'vars':
+            continue
+        old, new = baseline[ name ][ 'value' ], result[ 'value' ]
+        if old == new:
+            continue
+        worse, better = ( new, old ) if result[ 'better' ] == 'lower' else ( old, new )
+        ratio = worse / better if better > 0 else float( 'inf' )
+        if ratio > 1 + tolerance:
+            regressions.append( ( name, old, new, ratio ) )
+    return regressions
+
+def main():
+    opts = optparse.OptionParser( "Usage: %prog [options]" )
+    opts.add_option( "-o", "--output", default="bench.json", help="file the results are written to [%default]" )
+    opts.add_option( "-b", "--baseline", default=None, help="results to compare with" )
+    opts.add_option( "-t", "--tolerance", type="float", default=0.25,
+            help="fraction a result may be worse than the baseline by [%default]" )
+    opts.add_option( "-r", "--repeat", type="int", default=3, help="runs timed per measurement [%default]" )
+    opts.add_option( "-q", "--quick", action="store_true", default=False, help="smaller networks and shorter chains" )
+    opts.add_option( "-v", "--verbose", action="store_true", default=False, help="print results as they come" )
+    options, args = opts.parse_args()
+
+    bench = Bench( options.repeat, options.verbose )
+    results = bench.run( options.quick )
+
+    f = open( options.output, 'w' )
+    json.dump( { 'python' : platform.python_version(), 'machine' : platform.platform(),
+        'time' : time.time(), 'quick' : options.quick, 'results' : results }, f, indent=1, sort_keys=True )
+    f.close()
+
+    if options.baseline:
+        f = open( options.baseline )
+        baseline = json.load( f )[ 'results' ]
+        f.close()
+        regressions = compare( results, baseline, options.tolerance )
+        for name, old, new, ratio in regressions:
+            print "REGRESSION %s: %g -> %g (%.2fx worse)"%( name, old, new, ratio )
+        if regressions:
+            sys.exit( 1 )
+        print "No regressions against %s"%( options.baseline )
+
+if __name__ == "__main__": main()
@@ -4,38 +4,165 @@ BNet:
 """
 
 from exceptions import *
-import operator
-import copy
+from UserDict import DictMixin
+import hashlib
+import itertools
 
-class BNode:
+import numpy
+
+import instrument
+import cpts
+from graph import Graph
+
+# Value sets, each shared by every node and parent slot over the same
+# values. Keyed by the types as well so ( 0, 1 ) and ( False, True ) differ
+DOMAINS = {}
+
+def internValues( values ):
+    """Shared ( values, value -> index ) pair of a value set"""
+    values = tuple( values )
+    key = ( values, tuple( map( type, values ) ) )
+    found = DOMAINS.get( key )
+    if found is None:
+        found = DOMAINS[ key ] = ( values, dict( ( v, i ) for i, v in enumerate( values ) ) )
+    return found
+
+class TableView( DictMixin ):
+    """Dict view on the CPT of a node, keyed by tuples of parent values.
+    Reads and writes go straight through to the node's array"""
+
+    def __init__( self, node ):
+        self.node = node
+
+    def __getitem__( self, key ):
+        return tuple( self.node.row( key ) )
+
+    def __setitem__( self, key, value ):
+        self.node.expand()
+        self.node.cpt[ self.node.rowIndex( key ) ] = value
+
+    def __delitem__( self, key ):
+        raise TypeError( "CPT rows can not be removed" )
+
+    def __contains__( self, key ):
+        try:
+            self.node.rowIndex( key )
+            return True
+        except KeyError:
+            return False
+
+    def __iter__( self ):
+        return itertools.product( *self.node.parentValues )
+
+    def __len__( self ):
+        return int( numpy.prod( map( len, self.node.parentValues ) ) )
+
+    def keys( self ):
+        return list( self )
+
+class BNode( object ):
     """Variable in a bayesian network.
-    Has an associated list of parents, and a probability table"""
+    Has an associated list of parents, and a probability table stored as a
+    dense array with one axis per parent and a last axis for the variable,
+    or as a cpts.CompactCPT read the same way"""
+
+    __slots__ = ( 'id', 'attrs', 'cpt', 'pending', 'values', 'index', 'parents', 'parentValues', 'parentIndex' )
 
-    def __init__( self, id, parents=(), attrs = (), values=(), table=None ):
+    def __init__( self, id, parents=(), attrs = (), values=(), table=None, parentValues=None, cpt=None ):
         """
         @id - Node reference id
         @parents - list of parents
-        @table - Pr( X | parents )
+        @table - Pr( X | parents ), as a dict keyed by parent values
+        @parentValues - list of value sets of the parents; filled in by
+            the network when the node is added if not given
+        @cpt - Pr( X | parents ), as an array indexed by parent and value
+            indices, or a cpts.CompactCPT
         """
         self.id = id
-        self.parents = parents
         self.attrs = attrs
-        self.values = values
-        self.table = table
+        self.cpt = None
+        self.pending = None
+        self.setValues( values )
+        self.setParents( parents, parentValues )
+        if cpt is not None:
+            self.setCPT( cpt )
+        elif table is not None:
+            self.setTable( table )
+
+    def __getstate__( self ):
+        return dict( [ ( k, getattr( self, k ) ) for k in self.__slots__ ] )
+
+    def __setstate__( self, state ):
+        for k, v in state.items():
+            setattr( self, k, v )
 
     def setValues( self, values ):
-        self.values = values
-
-    def setTable( self, table ):
-        self.table = dict( table )
+        self.values, self.index = internValues( values )
 
-    def setParents( self, parents ):
+    def setParents( self, parents, parentValues=None ):
+        """Set the parents, and the value sets of the parents if known"""
         self.parents = tuple( parents )
+        if parentValues is None and not self.parents:
+            parentValues = ()
+        if parentValues is None:
+            self.parentValues = None
+            self.parentIndex = None
+        else:
+            domains = map( internValues, parentValues )
+            self.parentValues = tuple( [ values for values, index in domains ] )
+            self.parentIndex = tuple( [ index for values, index in domains ] )
+            if self.pending is not None:
+                self.setTable( self.pending )
+
+    def shape( self ):
+        """Shape of the CPT array"""
+        return tuple( map( len, self.parentValues ) ) + ( len( self.values ), )
+
+    def setCPT( self, cpt ):
+        if not cpts.isCompact( cpt ):
+            cpt = numpy.asarray( cpt, dtype=float )
+        if self.parentValues is not None and cpt.shape != self.shape():
+            raise ValueError( "CPT of %s has shape %s, expected %s"%( self.id, cpt.shape, self.shape() ) )
+        self.cpt = cpt
+        self.pending = None
+
+    def setTable( self, table ):
+        """Set the CPT from a dict of parent values to value probabilities.
+        If the parent value sets are not yet known, the table is kept
+        until they are"""
+        table = dict( table )
+        if self.parentValues is None:
+            self.pending = table
+            return
+        cpt = numpy.zeros( self.shape() )
+        for key, prs in table.items():
+            cpt[ self.rowIndex( key ) ] = prs
+        self.setCPT( cpt )
+
+    def getTable( self ):
+        if self.cpt is None:
+            return self.pending
+        return TableView( self )
+
+    table = property( getTable, setTable )
+
+    def rowIndex( self, parentValues ):
+        """Index into the CPT of the row for the given parent values"""
+        return tuple( [ idx[ v ] for idx, v in zip( self.parentIndex, parentValues ) ] )
+
+    def row( self, parentValues ):
+        """Pr( X | parents = parentValues ) as an array over self.values"""
+        return self.cpt[ self.rowIndex( parentValues ) ]
+
+    def expand( self ):
+        """Store the CPT as a dense array, so it can be written to"""
+        if cpts.isCompact( self.cpt ):
+            self.cpt = numpy.asarray( self.cpt )
 
     def setValue( self, value ):
-        prVector = tuple( [ int( value == val ) for val in self.values ] )
-        for k in self.table:
-            self.table[k] = prVector
+        self.expand()
+        self.cpt[...] = 0
+        self.cpt[..., self.index[ value ] ] = 1
 
     def __str__( self ):
         ret = "[Node %s %s]"%( str( self.id ), self.parents ) + '\n'
@@ -47,25 +174,63 @@ class BNode:
         return "[Node %s]"%( str( self.id ) )
 
 
-class BNet:
-    """Graph on Bayesian variables"""
+class BNet( object ):
+    """Graph on Bayesian variables. Nodes are looked up by id; the
+    structure is kept as a graph.Graph over dense indices, built when
+    first needed"""
 
     def __init__( self ):
         self.variables = {}
-        self.adjList = {}
+        self.ids = []
+        self.graph = None
+        self.digest = None
 
     def add( self, node ):
         """Add a variable node"""
 
-        self.variables[ node.id ] = node
-        self.adjList[ node.id ] = []
-
         for var in node.parents:
-            self.adjList[ var ].append( node.id )
+            if var not in self.variables:
+                raise KeyError( var )
+        if node.id not in self.variables:
+            self.ids.append( node.id )
+        self.variables[ node.id ] = node
+        self.graph = None
+        self.digest = None
+
+        if node.parentValues is None:
+            node.setParents( node.parents, [ self.get( p ).values for p in node.parents ] )
+
+    def setParents( self, id, parents ):
+        """Replace the parents of a variable node"""
+        node = self.get( id )
+        node.setParents( parents, [ self.get( p ).values for p in parents ] )
+        self.graph = None
+        self.digest = None
+
+    def structure( self ):
+        """The graph.Graph of the network, with ids indexed in the order
+        they were added"""
+        if self.graph is None:
+            index = dict( [ ( id, i ) for i, id in enumerate( self.ids ) ] )
+            self.graph = Graph( self.ids, [ [ index[ p ] for p in self.variables[ id ].parents ] for id in self.ids ] )
+        return self.graph
 
     def getChildren( self, id ):
         """Get children for the node"""
-        return self.adjList[ id ]
+        graph = self.structure()
+        ids = graph.ids
+        return [ ids[ i ] for i in graph.childrenOf( graph.index[ id ] ).tolist() ]
+
+    def getAdjList( self ):
+        """Children of every variable, as a dict of id to list of ids.
+        Made afresh from the structure, so changing it changes nothing"""
+        graph = self.structure()
+        ids = graph.ids
+        start = graph.childStart.tolist()
+        children = graph.children.tolist()
+        return dict( [ ( id, [ ids[ c ] for c in children[ start[ i ] : start[ i + 1 ] ] ] ) for i, id in enumerate( ids ) ] )
+
+    adjList = property( getAdjList )
 
     def getParents( self, id ):
         """Get parents for the node"""
@@ -76,16 +241,37 @@ class BNet:
         return self.variables[ id ]
 
     def getBlanket( self, id ):
-        """Get the Markov blanket for a variable"""
-
-        vars = [ id ]
-        vars += self.get( id ).parents
-        vars += self.getChildren( id )
-        
-        return vars
+        """Get the Markov blanket for a variable: itself, its parents, its
+        children and the other parents of its children"""
+        graph = self.structure()
+        ids = graph.ids
+        return [ ids[ i ] for i in graph.blanket( graph.index[ id ] ) ]
+
+    def topologicalOrder( self ):
+        """Ids of the variables, with every parent before its children"""
+        graph = self.structure()
+        ids = graph.ids
+        return [ ids[ i ] for i in graph.order.tolist() ]
+
+    def fingerprint( self ):
+        """Hash of the structure and CPTs. It is kept once taken, so CPTs
+        changed in place afterwards are not seen"""
+        if self.digest is None:
+            sha1 = hashlib.sha1()
+            for id in sorted( self.variables, key=repr ):
+                node = self.get( id )
+                sha1.update( repr( ( id, node.values, node.parents ) ) )
+                if cpts.isCompact( node.cpt ):
+                    sha1.update( node.cpt.tostring() )
+                else:
+                    sha1.update( numpy.ascontiguousarray( node.cpt, dtype=float ).tostring() )
+            self.digest = sha1.hexdigest()
+        return self.digest
 
     def applyContext( self, ctx ):
-        """Set the values defined in the context"""
+        """Set the values defined in the context, overwriting the CPTs of the
+        variables. The inference code reads the context alongside the
+        network instead, and never calls this"""
         for k,v in ctx.getVariables().items():
             self.variables[ k ].setValue( v )
 
@@ -107,42 +293,77 @@ class BNet:
     def __str__( self ):
         return "[Net %s]"%( str( self.variables ) )
 
-class Context:
-    """Bayesian context"""
+class Context( object ):
+    """Bayesian context; the evidence on a network, kept apart from the
+    network itself. A context made from another shares its evidence until
+    either of them changes it. chains holds the sampling.WarmChains last
+    run in it, if any"""
 
     def __init__( self, net, context=None ):
+        self.net = net
+        self.parent = context
+        self.chains = None
         if context:
             assert net == context.net
-            self = copy.copy( context )
+            self.evidence = context.evidence
+            self.indices = context.indices
+            context.shared = True
+            self.shared = True
         else:
-            self.net = net
-            self.variables = {}
-            for key in net.variables:
-                self.variables[key] = None
+            self.evidence = {}
+            self.indices = {}
+            self.shared = False
 
     def __str__( self ):
-        return str( self.variables )
+        return str( self.evidence )
 
     def __repr__( self ):
-        return str( self.variables )
+        return str( self.evidence )
 
     def getVariables( self ):
-        return dict( filter( lambda (k,v): v != None, self.variables.items() ) )
+        """Values of the variables with evidence"""
+        return dict( self.evidence )
 
-    def get( self, id ):
-        return self.variables[ id ]
+    def getIndices( self ):
+        """Value indices of the variables with evidence"""
+        return dict( self.indices )
+
+    def getVariable( self, id ):
+        return self.evidence.get( id )
+
+    get = getVariable
+
+    def getAll( self ):
+        """Values of every variable, None where there is no evidence"""
+        return dict( [ ( id, self.evidence.get( id ) ) for id in self.net.variables ] )
+
+    variables = property( getAll )
+
+    def unshare( self ):
+        """Take a private copy of the evidence before changing it"""
+        if self.shared:
+            self.evidence = dict( self.evidence )
+            self.indices = dict( self.indices )
+            self.shared = False
 
     def setVariable( self, id, value ):
-        if value not in self.net.variables[id].values:
+        index = self.net.variables[id].index
+        if value not in index:
             raise ValueError
-        self.variables[id] = value
+        self.unshare()
+        self.evidence[id] = value
+        self.indices[id] = index[ value ]
 
     def unsetVariable( self, id ):
-        self.variables[id] = None
+        if id in self.evidence:
+            self.unshare()
+            del self.evidence[id]
+            del self.indices[id]
 
     def prVector( self, id ):
+        if instrument.enabled:
+            instrument.count( 'cpt lookups' )
         node = self.net.get( id )
-        pr = tuple( map( self.get, node.parents ) )
-        values = node.table[pr]
+        values = node.row( map( self.get, node.parents ) )
         return dict( zip( node.values, values ) )
 
@@ -2,10 +2,15 @@
 Algorithms for Bayesian Networks
 """
 
-import copy
 import random
 
+import numpy
+
 import BNet
+import instrument
+from rng import streamOf
+from prune import prune
+from factors import Factor, productOf
 
 def cdf( pdf ):
     """Make a choice from a value set in correspondence with attached probabilities"""
@@ -21,6 +26,8 @@ def binsearch(items, val, key=lambda x: x):
     """
     Returns the item in items whose bucket contains val - assumes items is (item, bottom of bucket)
     """
+    if instrument.enabled:
+        instrument.count( 'binsearch' )
     low, high = 0, len(items)-1
     while ((high - low) > 0):
         if val < key(items[(low+high)/2]):
@@ -52,46 +59,23 @@ def cross(*args):
         ans = [x+[y] for x in ans for y in arg]
     return ans
 
-def selectAttr( attrs, values, attr ):
-    return filter( lambda x: x[0] == attr, zip( attrs, values ) )[1]
-
-def selectAttrs( attrs, values, attrList ):
-    return map( lambda x: x[1], filter( lambda x: x[0] in attrList, zip( attrs, values ) ) )
-
-def joinTable( net, *tables ):
-    """
-    Join the n probability tables
-    """
-    parentIds = ( reduce( lambda state, n : state.union(n.parents), tables, set([]) ) )
-    parents = map( net.get, parentIds )
-    attrs = ( reduce( lambda state, n : state + n.attrs, tables, () ) )
-    values = ( reduce( lambda state, n : state.append( n.values ) or state, tables, [] ) )
-
-    pVals = ( reduce( lambda state, p : state.append( p.values ) or state, parents, [] ) )
-    pVals = cross( *pVals )
-
-    table = {}
-    for pVal in pVals:
-        for value in cross( *values ):
-            valueArr = ()
-            p = 1
-            for node in tables:
-                parent_ = selectAttrs( parentIds, pVal, node.parents )
-                value_ = selectAttrs( attrs, value, node.attrs )
-                p *= selectAttr( node.table[ tuple( parent_ ) ], node.values, value_ )
-                valueArr += value_
-            print pVal, valueArr
-
-def gibbsSample( net, ctx, burnIn=100, samples=1000 ):
+def gibbsSample( net, ctx, burnIn=100, samples=1000, seed=None, estimator='counts' ):
     """
     Apply gibbs sampling to infer a new Network
+    @seed - seed, or rng.RandomStream, the chain draws from
+    @estimator - 'counts' to count the value taken at each step against
+        its parents' values, and return a network with the normalized
+        counts as CPTs; 'rao-blackwell' to add up the conditional of the
+        variable resampled at each step instead, and return the marginals
+        as a dict of id to distribution
     """
-    def gibbsChoice( net, ctx, node ):
-        # Get the nodes for the Markov Blanket
-        children = map( net.get, net.getChildren( node.id ) )
-        parents = map( net.get , net.getParents( node.id ) )
+    if estimator not in ( 'counts', 'rao-blackwell' ):
+        raise ValueError( "Unknown estimator %s"%( estimator ) )
+    stream = streamOf( seed )
 
-        Pr = []
+    def gibbsChoice( net, ctx, node ):
+        values = []
+        weights = []
         # Get P( V | p)
         prVector = ctx.prVector( node.id )
         for val, prP in prVector.items():
@@ -101,151 +85,178 @@ def gibbsSample( net, ctx, burnIn=100, samples=1000 ):
             for child in net.getChildren( node.id ):
                 prVector_ = ctx.prVector( child )
                 pr *= prVector_[ ctx.get( child ) ]
-            Pr.append( (val, pr ) )
-        total = sum( [ pr for v, pr in Pr ] )
-        Pr = [ (v,pr/total) for v,pr in Pr ] 
-
-        val = select( cdf( Pr ), key = lambda vPr: vPr[1] )
-        return val[0]
-    def removeParent( node, ctx_variables ):
-        parents_ = filter( lambda k: k not in ctx_variables.keys(), node.parents )
-        # Join with parents list to get key
-        table_ = {}
-        for key,value in node.table.items() :
-            key_ = zip( node.parents, node.table[key] )
-            key_ = tuple( [ kV[1] for kV in key_ if kV[0] in parents_ ] )
-            table_[key_] = value
-
-        node.parents = parents_
-        node.table = table_
-
-    # Create a deep copy of the net to modify
-    net = copy.deepcopy( net )
-    ctx = copy.deepcopy( ctx )
-
-    # Set the variables present in the context to be equal to the value in the
-    # context
-    net.applyContext( ctx )
-
-    # List of variables whose value is to be modified
-    variables = net.variables.keys()
-    ctx_variables = ctx.getVariables()
-    for k,v in ctx_variables.items():
-        variables.remove( k )
-
-    # Choose a random initial value for all variables 
-    for var in variables:
-        ctx.setVariable( var, random.choice( net.get( var ).values ) )
+            values.append( val )
+            weights.append( pr )
+
+        # Unnormalized; the stream scales its uniform by the total
+        return values[ stream.select( numpy.cumsum( weights ) ) ], values, weights
+    def removeParent( node, cpt, ctx_variables ):
+        # Keep only the rows consistent with the evidence on the parents
+        rows = tuple( [ pIdx[ ctx_variables[ p ] ] if p in ctx_variables else slice( None )
+                for p, pIdx in zip( node.parents, node.parentIndex ) ] )
+        parents_ = [ ( p, pVals ) for p, pVals in zip( node.parents, node.parentValues ) if p not in ctx_variables ]
+
+        return BNet.BNode( node.id, [ p for p, _ in parents_ ], node.attrs, node.values,
+                parentValues=[ pVals for _, pVals in parents_ ], cpt=cpt[ rows ] )
+
+    with instrument.phase( 'evidence' ):
+        # Work in a context of our own; it shares the evidence of ctx, and
+        # neither ctx nor the network are changed
+        ctx_variables = ctx.getVariables()
+        ctx = BNet.Context( net, ctx )
+
+        # List of variables whose value is to be modified
+        variables = [ var for var in net.variables if var not in ctx_variables ]
+
+        # Choose a random initial value for all variables 
+        for var in variables:
+            ctx.setVariable( var, stream.choice( net.get( var ).values ) )
 
     # Just follow the MC
-    for i in xrange( burnIn ):
-        # Choose one variable, a randomly 
-        var = random.choice( variables )
-        node = net.get( var )
-        val = gibbsChoice( net, ctx, node )
-        ctx.setVariable( node.id, val )
-
-    # Initialise the stats table
+    with instrument.phase( 'burn-in' ):
+        for i in xrange( burnIn ):
+            # Choose one variable, a randomly 
+            var = stream.choice( variables )
+            node = net.get( var )
+            val = gibbsChoice( net, ctx, node )[ 0 ]
+            ctx.setVariable( node.id, val )
+
+    # Initialise the stats table; a count for every entry of the CPT, or
+    # the summed conditionals of every value for the Rao-Blackwell estimator
     stats = {}
     for var in net.variables.values():
-        stat = {}
-        for parentValues in var.table.keys():
-            stat_ = {}
-            for value in var.values:
-                stat_[value] = 0
-            stat[parentValues] = stat_
-        stats[var.id] = stat
+        stats[var.id] = numpy.zeros( var.cpt.shape if estimator == 'counts' else len( var.values ) )
 
     # Now for samples duration, compute statistics
-    for i in xrange( samples ):
-        var = random.choice( variables )
-        node = net.get( var )
-        val = gibbsChoice( net, ctx, node )
-        ctx.setVariable( node.id, val )
+    with instrument.phase( 'sampling' ):
+        for i in xrange( samples ):
+            var = stream.choice( variables )
+            node = net.get( var )
+            val, values, weights = gibbsChoice( net, ctx, node )
+            ctx.setVariable( node.id, val )
 
-        # set statistics using the variable and it's parents
-        stats[node.id][ tuple( map( ctx.get, node.parents ) ) ][ val ] += 1
+            if estimator == 'counts':
+                # set statistics using the variable and it's parents
+                stats[node.id][ node.rowIndex( map( ctx.get, node.parents ) ) + ( node.index[ val ], ) ] += 1
+            else:
+                # The conditional the value was drawn from
+                total = sum( weights )
+                if total > 0:
+                    for v, w in zip( values, weights ):
+                        stats[node.id][ node.index[ v ] ] += w / total
+    instrument.count( 'sampler steps', burnIn + samples )
+
+    if estimator == 'rao-blackwell':
+        with instrument.phase( 'normalize' ):
+            result = {}
+            for id, stat in stats.items():
+                node = net.get( id )
+                if id in ctx_variables:
+                    stat = numpy.array( [ float( value == ctx_variables[ id ] ) for value in node.values ] )
+                total = stat.sum()
+                result[ id ] = dict( zip( node.values, stat / total if total > 0 else stat ) )
+        return result
 
     # Compute distribution
-    # Update the original network, and remove any dependence on our key variable
-    for node, stat in stats.items():
-        node = net.get( node )
-        
-        if node.id in ctx_variables.keys():
-            node.parents = []
-            node.table = { (): tuple([ int( value == ctx_variables[ node.id ]) for value in node.values]) }
-            continue
-
-        for parentValue, stat_ in stat.items():
-            total = sum( stat_.values() )
-            if total > 0:
-                for key in stat_.keys():
-                    stat_[key] = float(stat_[key])/total
-        node.table = dict( zip( map( tuple, stat.keys() ),  [ tuple([ stat_[val] for val in node.values ]) for stat_ in stat.values() ]  ) )
-        node = removeParent( node, ctx_variables )
-
-    return net
-
-def exactQuery( net, ctx, query ):
+    # Build a new network from the statistics, and remove any dependence
+    # on our key variable
+    with instrument.phase( 'normalize' ):
+        result = BNet.BNet()
+        for id in net.topologicalOrder():
+            node = net.get( id )
+            stat = stats[ id ]
+
+            if id in ctx_variables:
+                cpt = [ int( value == ctx_variables[ id ] ) for value in node.values ]
+                result.add( BNet.BNode( id, (), node.attrs, node.values, cpt=cpt ) )
+                continue
+
+            total = stat.sum( axis=-1 )[..., numpy.newaxis]
+            stat = stat / numpy.where( total > 0, total, 1 )
+            result.add( removeParent( node, stat, ctx_variables ) )
+
+    return result
+
+def interactionGraph( scopes ):
+    """Undirected graph connecting variables that share a scope"""
+    graph = {}
+    for scope in scopes:
+        for var in scope:
+            graph.setdefault( var, set() ).update( scope )
+    for var, nbrs in graph.items():
+        nbrs.discard( var )
+    return graph
+
+def fillIn( graph, var ):
+    """Number of edges added among the neighbours of var when eliminating it"""
+    nbrs = list( graph[ var ] )
+    fill = 0
+    for i, u in enumerate( nbrs ):
+        for w in nbrs[ i+1: ]:
+            if w not in graph[ u ]:
+                fill += 1
+    return fill
+
+def eliminate( graph, var ):
+    """Take var out of an undirected graph, connecting its neighbours.
+    Returns the neighbours"""
+    nbrs = graph.pop( var )
+    for u in nbrs:
+        graph[ u ].update( nbrs )
+        graph[ u ].discard( u )
+        graph[ u ].discard( var )
+    return nbrs
+
+HEURISTICS = {
+    'minfill' : fillIn,
+    'mindegree' : lambda graph, var: len( graph[ var ] ),
+    }
+
+def eliminationOrder( graph, variables, heuristic='minfill' ):
     """
-    Query the probability distribution of a variable given evidence
+    Greedy elimination ordering of variables in an undirected graph
+    @graph - dict of variable to set of neighbours; left unchanged
+    @variables - variables to eliminate
+    @heuristic - 'minfill' or 'mindegree'
     """
-    
-    # Create a deep copy of the net to modify
-    net = copy.deepcopy( net )
-    ctx = copy.deepcopy( ctx )
-
-    variables = net.variables
-    ctx_variables = ctx.getVariables()
+    cost = HEURISTICS[ heuristic ]
+    graph = dict( [ ( var, set( nbrs ) ) for var, nbrs in graph.items() ] )
+    remaining = list( variables )
+    order = []
+    while remaining:
+        var = min( remaining, key=lambda v: cost( graph, v ) )
+        remaining.remove( var )
+        order.append( var )
+
+        # Connect the neighbours, and take var out of the graph
+        eliminate( graph, var )
+    return order
+
+def exactQuery( net, ctx, query, heuristic='minfill' ):
+    """
+    Query the probability distribution of a variable given evidence, by
+    variable elimination
+    @heuristic - elimination ordering heuristic, 'minfill' or 'mindegree'
+    Returns a dict of value to probability
+    """
+    node = net.get( query )
+    evidence = ctx.getIndices()
+    if query in evidence:
+        return dict( [ ( v, float( v == ctx.get( query ) ) ) for v in node.values ] )
 
-    # Create a variable ordering
-    ordering = net.variables.keys()
-    ordering.remove( query )
+    # Only the part of the network relevant to the query
+    net, ctx = prune( net, ctx, query )
+    evidence = ctx.getIndices()
 
-    max_id = max( ordering )
+    factors = [ Factor.fromNode( var, evidence ) for var in net.variables.values() ]
+    hidden = [ var for var in net.variables if var != query and var not in evidence ]
+    order = eliminationOrder( interactionGraph( [ f.variables for f in factors ] ), hidden, heuristic )
 
     # Process functions bucket by bucket
-    for bVar in ordering:
-        # Get all variables which involve var
-        bucket = [ var_ for var_ in variables.values() if bVar in var_.parents ]
-
-        # Create a new node whose value is sum_{ var } ( pi( bucket ) )
-
-        # Get consolidated list of parents
-        parents = set([])
-        attrs = []
-        for var in bucket: 
-            parents = parents.union( set( var.parents ) )
-        parents = map( net.get, list( parents ) )
-        if not parents:
-            continue
-        parents.remove( net.get( bVar ) )
-        print parents
-        print bucket
-        print attrs
-
-
-        # Iterate over all possible values
-        table = {}
-        index  = [ bVar ]
-        index += [ p.id for p in parents]
-
-        for var in cross( *( [ p.values for p in parents ] ) ):
-            P = [ 0 for i in attrs ]
-            for val in net.get( bVar ).values:
-                value = [ val ]
-                value += var
-
-                p = (1,1)
-                attr_ = []
-                for node in bucket:
-                    value_ = tuple( map( lambda x: x[1], filter( lambda x: x[0] in node.parents, zip(index, value) ) ) )
-                    p = ( p[0] * node.table[ value_ ][0], p[1] * node.table[ value_ ][1] )
-                P = (P[0]+p[0], P[1]+p[1])
-            table[ tuple( var ) ] = P
-            print var, (P)
-        max_id += 1
-        variables[ max_id ] = BNet.BNode( max_id, [ p.id for p in parents ], (True,False), table )
-
-    return variables
+    for var in order:
+        bucket = [ f for f in factors if var in f.variables ]
+        factors = [ f for f in factors if var not in f.variables ]
+        factors.append( productOf( bucket ).marginalize( var ) )
 
+    result = productOf( factors ).normalize()
+    return dict( zip( node.values, result.table ) )
@@ -0,0 +1,122 @@
+"""
+Batch:
+    Runs the queries of a file without the shell, one inference pass per
+    evidence setting, and writes the answers as JSON lines
+"""
+
+import json
+import sys
+import time
+
+import BNet
+
+def failure( e ):
+    """Message for a query that raised e"""
+    if isinstance( e, KeyError ):
+        return "No variable %s"%( e.args[ 0 ] )
+    if isinstance( e, ZeroDivisionError ):
+        return "The evidence is impossible"
+    return str( e )
+
+class BatchRunner( object ):
+    """
+    Answers ( evidence, queries ) batches on a network. Every query under
+    one evidence setting is answered from the same inference pass
+    """
+
+    def __init__( self, engine='exact', out=sys.stdout, burnIn=100, sweeps=1000, chains=1, seed=None, blocks='family', samples=100000, estimator='counts' ):
+        """
+        @engine - 'exact' for a junction tree, 'gibbs' for GibbsSampler,
+            'lw' for likelihood weighting with ForwardSampler
+        @out - stream the results are written to
+        @burnIn, @sweeps, @chains, @seed, @blocks, @estimator - sampler
+            settings for 'gibbs'
+        @samples - samples drawn by 'lw'; it uses the seed too
+        """
+        self.engine = engine
+        self.out = out
+        self.burnIn = burnIn
+        self.sweeps = sweeps
+        self.chains = chains
+        self.seed = seed
+        self.blocks = blocks
+        self.samples = samples
+        self.estimator = estimator
+
+    def inference( self, net ):
+        """Function from a context and the variables queried under it to a
+        function giving the marginal of a variable under that context"""
+        if self.engine == 'exact':
+            from jtree import JunctionTree
+            tree = JunctionTree( net )
+            def exact( ctx, variables ):
+                tree.calibrate( ctx )
+                return tree.marginal
+            return exact
+        elif self.engine == 'gibbs':
+            from sampling import GibbsSampler
+            from prune import prune
+            def gibbs( ctx, variables ):
+                # Sample only the part of the network the queries need
+                sub, subctx = prune( net, ctx, variables )
+                marginals = GibbsSampler( sub, subctx, self.chains, self.seed, self.blocks, estimator=self.estimator ).run( self.burnIn, self.sweeps )
+                return marginals.get
+            return gibbs
+        elif self.engine == 'lw':
+            from forward import ForwardSampler
+            from prune import prune
+            def lw( ctx, variables ):
+                sub, subctx = prune( net, ctx, variables )
+                return ForwardSampler( sub, subctx, self.seed ).marginals( self.samples ).get
+            return lw
+        else:
+            raise ValueError( "Unknown engine %s"%( self.engine ) )
+
+    def run( self, net, queries, name=None ):
+        """
+        Answer every query in a batch, writing one line per query. A query
+        that fails, through an unknown variable or value or impossible
+        evidence, gets a line with its 'error' instead, and the rest go on
+        @queries - list of ( evidence, [ query variables ] )
+        @name - label of the network in the output
+        """
+        start = time.time()
+        inference = self.inference( net )
+        self.write( { 'network' : name, 'compileTime' : time.time() - start } )
+
+        for evidence, variables in queries:
+            try:
+                ctx = BNet.Context( net )
+                for k, v in evidence.items():
+                    try:
+                        ctx.setVariable( k, v )
+                    except ValueError:
+                        raise ValueError( "%s is not a value of %s"%( v, k ) )
+
+                start = time.time()
+                marginal = inference( ctx, variables )
+                passTime = time.time() - start
+            except ( KeyError, ValueError, ZeroDivisionError ), e:
+                for var in variables:
+                    self.write( { 'network' : name, 'evidence' : evidence, 'query' : var, 'error' : failure( e ) } )
+                continue
+
+            for var in variables:
+                start = time.time()
+                try:
+                    distribution = marginal( var )
+                except ( KeyError, ZeroDivisionError ), e:
+                    self.write( { 'network' : name, 'evidence' : evidence, 'query' : var, 'error' : failure( e ) } )
+                    continue
+                self.write( {
+                    'network' : name,
+                    'evidence' : evidence,
+                    'query' : var,
+                    'distribution' : distribution,
+                    'time' : time.time() - start,
+                    'passTime' : passTime,
+                    } )
+
+    def write( self, result ):
+        self.out.write( json.dumps( result ) + '\n' )
+        self.out.flush()
@@ -0,0 +1,406 @@
+"""
+CPTs:
+    Compact conditional probability tables, whose size grows with their
+    number of parameters rather than with the product of the parent
+    cardinalities: noisy-MAX (and noisy-OR) tables, deterministic
+    functions, and decision trees over the parents for tables with
+    context-specific independence
+
+    They are read like the dense arrays they stand for. Indexing with one
+    integer or integer array per parent gives rows, one more for the value
+    gives probabilities, integers and full slices fix some parents and
+    give a smaller table, and numpy.asarray() expands them. They can not
+    be written to
+"""
+
+import itertools
+
+import numpy
+
+class CompactCPT( object ):
+    """
+    Base of the compact tables. Subclasses set self.shape, the shape of
+    the dense array, and provide rows() and fix()
+    """
+
+    dtype = numpy.dtype( float )
+
+    @property
+    def ndim( self ):
+        return len( self.shape )
+
+    @property
+    def size( self ):
+        return int( numpy.prod( self.shape ) )
+
+    def __len__( self ):
+        return self.shape[ 0 ]
+
+    def rows( self, parents ):
+        """
+        Pr( X | parents ) for many parent values at once
+        @parents - one integer or integer array of value indices per
+            parent, broadcast together
+        Returns an array of the broadcast shape, with a last axis over the
+        values of X
+        """
+        raise NotImplementedError
+
+    def fix( self, fixed ):
+        """Table with the parents in fixed, a dict of axis to value index,
+        set to those values and dropped"""
+        raise NotImplementedError
+
+    def parameters( self ):
+        """The arrays holding the table"""
+        raise NotImplementedError
+
+    @property
+    def nbytes( self ):
+        return sum( [ a.nbytes for a in self.parameters() ] )
+
+    def tostring( self ):
+        """Bytes identifying the table, for fingerprints"""
+        return type( self ).__name__ + repr( self.shape ) + ''.join( [ numpy.ascontiguousarray( a ).tostring() for a in self.parameters() ] )
+
+    def dense( self ):
+        return self.rows( tuple( numpy.indices( self.shape[ :-1 ] ) ) )
+
+    def __array__( self, dtype=None ):
+        table = self.dense()
+        return table if dtype is None else table.astype( dtype )
+
+    def ravel( self ):
+        return self.dense().ravel()
+
+    def __getitem__( self, key ):
+        if not isinstance( key, tuple ):
+            key = ( key, )
+        parents = self.ndim - 1
+        scalar = lambda k: isinstance( k, ( int, long, numpy.integer ) )
+        if len( key ) <= parents and [ k for k in key if isinstance( k, slice ) or scalar( k ) ] == list( key ):
+            if [ k for k in key if isinstance( k, slice ) and k != slice( None ) ]:
+                return self.dense()[ key ]
+            fixed = dict( [ ( axis, int( k ) ) for axis, k in enumerate( key ) if scalar( k ) ] )
+            if len( fixed ) == parents:
+                return self.rows( tuple( [ fixed[ a ] for a in range( parents ) ] ) )
+            return self.fix( fixed ) if fixed else self
+        if [ k for k in key if k is None or k is Ellipsis or isinstance( k, slice ) ]:
+            return self.dense()[ key ]
+        if len( key ) == parents:
+            return self.rows( key )
+        if len( key ) == parents + 1:
+            rows = self.rows( key[ :-1 ] )
+            shape = shapeOf( [ rows[ ..., 0 ], key[ -1 ] ] )
+            rows = numpy.broadcast_to( rows, shape + rows.shape[ -1: ] )
+            return pick( rows, numpy.broadcast_to( key[ -1 ], shape ) )
+        return self.dense()[ key ]
+
+    def __repr__( self ):
+        return "[%s %s, %d parameters]"%( type( self ).__name__, self.shape, sum( [ a.size for a in self.parameters() ] ) )
+
+def pick( rows, values ):
+    """rows[ ..., values ] taken elementwise"""
+    index = numpy.ix_( *[ numpy.arange( n ) for n in values.shape ] )
+    return rows[ tuple( index ) + ( values, ) ]
+
+def shapeOf( arrays ):
+    """Shape the arrays broadcast to"""
+    shape = ()
+    for a in arrays:
+        a = numpy.shape( a )
+        if len( a ) > len( shape ):
+            shape = ( 1, ) * ( len( a ) - len( shape ) ) + shape
+        a = ( 1, ) * ( len( shape ) - len( a ) ) + a
+        shape = tuple( [ max( x, y ) if min( x, y ) == 1 else x for x, y in zip( shape, a ) ] )
+    return shape
+
+def broadcast( parents ):
+    """Parent value indices as a ( parents, n ) array, and their shape"""
+    shape = shapeOf( parents )
+    index = numpy.empty( ( len( parents ), ) + shape, dtype=int )
+    for i, p in enumerate( parents ):
+        index[ i ] = p
+    return index.reshape( len( parents ), -1 ), shape
+
+class NoisyMax( CompactCPT ):
+    """
+    Noisy-MAX table: with the values of X in some order, X is the largest
+    of a leak and of one value caused by each parent independently, so
+        Pr( X <= x | parents ) = leak( x ) * prod_i cdf_i[ parent_i ]( x )
+    Each parent has an off value, whose cdf is 1, at which it has no
+    effect. Noisy-OR is the binary case
+    """
+
+    def __init__( self, leak, cdfs, order=None ):
+        """
+        @leak - Pr( X <= x ) with every parent off, over the ordered values
+        @cdfs - for each parent, a ( parent values, values ) array of the
+            factor each of its values multiplies the leak by
+        @order - value index of X at each position of the order; the
+            identity if None
+        """
+        self.leak = numpy.asarray( leak, dtype=float )
+        self.cdfs = [ numpy.asarray( c, dtype=float ) for c in cdfs ]
+        k = len( self.leak )
+        self.order = numpy.arange( k ) if order is None else numpy.asarray( order, dtype=int )
+        self.shape = tuple( [ len( c ) for c in self.cdfs ] ) + ( k, )
+
+    @staticmethod
+    def noisyOr( probabilities, leak=0.0, on=0 ):
+        """
+        Noisy-OR of binary parents
+        @probabilities - Pr( X on | only parent i on ) for each parent,
+            without the leak
+        @leak - Pr( X on | every parent off )
+        @on - index of the on value, of X and of every parent
+        """
+        off = 1 - on
+        cdfs = []
+        for p in probabilities:
+            cdf = numpy.ones( ( 2, 2 ) )
+            cdf[ on, 0 ] = 1 - p
+            cdfs.append( cdf )
+        return NoisyMax( [ 1 - leak, 1.0 ], cdfs, [ off, on ] )
+
+    def parameters( self ):
+        return [ self.leak, self.order ] + self.cdfs
+
+    def rows( self, parents ):
+        # The parents broadcast as the factors multiply
+        cdf = self.leak
+        for c, values in zip( self.cdfs, parents ):
+            cdf = cdf * c[ values ]
+        result = numpy.empty( cdf.shape )
+        result[ ..., self.order ] = numpy.concatenate( ( cdf[ ..., :1 ], numpy.diff( cdf, axis=-1 ) ), axis=-1 )
+        return result
+
+    def fix( self, fixed ):
+        leak = self.leak.copy()
+        for axis, v in fixed.items():
+            leak *= self.cdfs[ axis ][ v ]
+        return NoisyMax( leak, [ c for a, c in enumerate( self.cdfs ) if a not in fixed ], self.order )
+
+    @staticmethod
+    def detect( table, tolerance=1e-9 ):
+        """Noisy-MAX form of a dense table, if it has one, in the value
+        order of the table or its reverse; otherwise None"""
+        parents = table.ndim - 1
+        if not parents:
+            return None
+        k = table.shape[ -1 ]
+        for order in ( numpy.arange( k ), numpy.arange( k )[ ::-1 ] ):
+            cdf = table[ ..., order ].cumsum( axis=-1 )
+
+            # A parent's off value leaves the cdf highest everywhere
+            off = []
+            for axis in range( parents ):
+                rest = tuple( [ a for a in range( table.ndim ) if a != axis ] )
+                off.append( int( cdf.sum( axis=rest ).argmax() ) )
+            leak = cdf[ tuple( off ) ]
+            safe = numpy.where( leak > 0, leak, 1 )
+            cdfs = []
+            for axis in range( parents ):
+                index = list( off )
+                index[ axis ] = slice( None )
+                c = cdf[ tuple( index ) ] / safe
+                c[ :, leak <= 0 ] = 1
+                cdfs.append( c )
+
+            found = NoisyMax( leak, cdfs, order )
+            if numpy.allclose( found.dense(), table, rtol=0, atol=tolerance ):
+                return found
+        return None
+
+class Deterministic( CompactCPT ):
+    """Table of a variable that is a function of its parents, stored as
+    the value index the function takes for each parent value"""
+
+    def __init__( self, function, k ):
+        """
+        @function - array over the parent values of the value index of X
+        @k - number of values of X
+        """
+        function = numpy.asarray( function )
+        self.function = function.astype( numpy.int8 if k <= 127 else numpy.int32 )
+        self.shape = function.shape + ( k, )
+
+    @staticmethod
+    def fromFunction( cards, k, f ):
+        """
+        Table of X = f( parent value indices )
+        @cards - number of values of each parent
+        @k - number of values of X
+        """
+        function = numpy.zeros( cards, dtype=int )
+        for index in itertools.product( *map( range, cards ) ):
+            function[ index ] = f( *index )
+        return Deterministic( function, k )
+
+    def parameters( self ):
+        return [ self.function ]
+
+    def rows( self, parents ):
+        return numpy.eye( self.shape[ -1 ] )[ self.function[ tuple( parents ) ] ]
+
+    def fix( self, fixed ):
+        index = tuple( [ fixed.get( a, slice( None ) ) for a in range( self.ndim - 1 ) ] )
+        return Deterministic( self.function[ index ], self.shape[ -1 ] )
+
+    @staticmethod
+    def detect( table, tolerance=1e-9 ):
+        """Deterministic form of a dense table whose every row puts all of
+        its mass on one value, or None"""
+        if table.ndim < 2:
+            return None
+        function = table.argmax( axis=-1 )
+        onehot = numpy.eye( table.shape[ -1 ] )[ function ]
+        if not numpy.allclose( onehot, table, rtol=0, atol=tolerance ):
+            return None
+        return Deterministic( function, table.shape[ -1 ] )
+
+class TreeCPT( CompactCPT ):
+    """
+    Table with context-specific independence, as a decision tree over the
+    parents. Node m splits on parent split[ m ], and its children are the
+    nodes first[ m ] + v for each value v of that parent; a leaf, whose
+    split is -1, has its row at leaves[ first[ m ] ]. Node 0 is the root
+    """
+
+    def __init__( self, split, first, leaves, shape ):
+        self.split = numpy.asarray( split, dtype=numpy.int32 )
+        self.first = numpy.asarray( first, dtype=numpy.int32 )
+        self.leaves = numpy.asarray( leaves, dtype=float )
+        self.shape = tuple( shape )
+
+    @staticmethod
+    def fromNested( tree, shape ):
+        """
+        Table of a nested tree, where a leaf is a row of probabilities and
+        an internal node is ( parent axis, [ child per value ] )
+        """
+        split, first, leaves = [ -1 ], [ 0 ], []
+        queue = [ ( 0, tree ) ]
+        while queue:
+            m, node = queue.pop( 0 )
+            if isinstance( node, tuple ):
+                axis, children = node
+                split[ m ] = axis
+                first[ m ] = len( split )
+                for child in children:
+                    queue.append( ( len( split ), child ) )
+                    split.append( -1 )
+                    first.append( 0 )
+            else:
+                first[ m ] = len( leaves )
+                leaves.append( node )
+        return TreeCPT( split, first, leaves, shape )
+
+    def nested( self, m=0, fixed={} ):
+        """The tree as fromNested takes it, with the parents in fixed set
+        to their values and taken out"""
+        if self.split[ m ] < 0:
+            return self.leaves[ self.first[ m ] ]
+        axis = self.split[ m ]
+        if axis in fixed:
+            return self.nested( self.first[ m ] + fixed[ axis ], fixed )
+        children = [ self.nested( self.first[ m ] + v, fixed ) for v in range( self.shape[ axis ] ) ]
+        return ( axis - len( [ a for a in fixed if a < axis ] ), children )
+
+    def parameters( self ):
+        return [ self.split, self.first, self.leaves ]
+
+    def rows( self, parents ):
+        index, shape = broadcast( parents )
+        n = index.shape[ 1 ]
+        node = numpy.zeros( n, dtype=int )
+        active = numpy.arange( n )
+        while len( active ):
+            axis = self.split[ node[ active ] ]
+            inner = axis >= 0
+            active = active[ inner ]
+            node[ active ] = self.first[ node[ active ] ] + index[ axis[ inner ], active ]
+        return self.leaves[ self.first[ node ] ].reshape( shape + ( self.shape[ -1 ], ) )
+
+    def fix( self, fixed ):
+        shape = [ c for a, c in enumerate( self.shape[ :-1 ] ) if a not in fixed ] + [ self.shape[ -1 ] ]
+        return TreeCPT.fromNested( self.nested( 0, fixed ), shape )
+
+    @staticmethod
+    def detect( table, tolerance=1e-9, maxLeaves=None ):
+        """
+        Decision tree of a dense table, grown greedily by splitting on the
+        parent that settles the most rows at once, or None if it would
+        need more than maxLeaves leaves
+        """
+        if table.ndim < 2:
+            return None
+        k = table.shape[ -1 ]
+        if maxLeaves is None:
+            maxLeaves = table.size / k
+        count = [ 0 ]
+
+        def constant( sub ):
+            flat = sub.reshape( -1, k )
+            return ( flat.max( axis=0 ) - flat.min( axis=0 ) <= tolerance ).all()
+
+        def grow( sub, axes ):
+            # sub has one axis for each parent in axes, then the values
+            if constant( sub ):
+                count[ 0 ] += 1
+                if count[ 0 ] > maxLeaves:
+                    raise StopIteration
+                return sub.reshape( -1, k )[ 0 ].copy()
+            best, bestSettled = None, -1
+            for i in range( len( axes ) ):
+                slices = [ numpy.take( sub, v, axis=i ) for v in range( sub.shape[ i ] ) ]
+                if not [ s for s in slices[ 1: ] if not numpy.allclose( s, slices[ 0 ], rtol=0, atol=tolerance ) ]:
+                    # X does not depend on this parent here
+                    continue
+                settled = len( [ s for s in slices if constant( s ) ] )
+                if settled > bestSettled:
+                    best, bestSettled = i, settled
+            if best is None:
+                count[ 0 ] += 1
+                if count[ 0 ] > maxLeaves:
+                    raise StopIteration
+                return sub.reshape( -1, k )[ 0 ].copy()
+            rest = axes[ :best ] + axes[ best + 1: ]
+            return ( axes[ best ], [ grow( numpy.take( sub, v, axis=best ), rest ) for v in range( sub.shape[ best ] ) ] )
+
+        # A tree has at least a leaf for every distinct row
+        if len( numpy.unique( table.reshape( -1, k ), axis=0 ) ) > maxLeaves:
+            return None
+        try:
+            tree = grow( table, range( table.ndim - 1 ) )
+        except StopIteration:
+            return None
+        return TreeCPT.fromNested( tree, table.shape )
+
+def isCompact( cpt ):
+    return isinstance( cpt, CompactCPT )
+
+def compress( table, tolerance=1e-9, minSize=64 ):
+    """
+    Smallest of the compact forms that reproduce a dense table to within
+    tolerance, if it is at most half the size of the table; otherwise the
+    table itself
+    @minSize - entries below which tables are left dense
+    """
+    table = numpy.asarray( table, dtype=float )
+    if table.ndim < 2 or table.size < minSize:
+        return table
+    budget = table.nbytes / 2
+    found = []
+    for detect in ( Deterministic.detect, NoisyMax.detect ):
+        cpt = detect( table, tolerance )
+        if cpt is not None and cpt.nbytes <= budget:
+            found.append( cpt )
+    # Leaves cost a row of floats each, besides the nodes above them
+    k = table.shape[ -1 ]
+    cpt = TreeCPT.detect( table, tolerance, budget / ( 8 * k + 8 ) )
+    if cpt is not None and cpt.nbytes <= budget:
+        found.append( cpt )
+    if not found:
+        return table
+    return min( found, key=lambda cpt: cpt.nbytes )
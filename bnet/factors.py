@@ -0,0 +1,82 @@
+"""
+Factors:
+    Tables over sets of discrete variables, and the operations on them
+    used by exact inference
+"""
+
+import numpy
+
+class Factor( object ):
+    """Function over a set of discrete variables, stored as an array with
+    one axis per variable"""
+
+    def __init__( self, variables, table ):
+        """
+        @variables - ids of the variables, in axis order
+        @table - array of values, indexed by value indices
+        """
+        self.variables = tuple( variables )
+        self.table = numpy.asarray( table, dtype=float )
+
+    @staticmethod
+    def fromNode( node, evidence=None ):
+        """
+        Factor Pr( X | parents ) of a network node
+        @evidence - if given, a dict of variable to value index the factor
+            is reduced by. Parents with evidence are fixed before the table
+            is expanded, so compact CPTs only expand the part needed
+        """
+        if not evidence:
+            return Factor( node.parents + ( node.id, ), node.cpt )
+        index = tuple( [ evidence.get( p, slice( None ) ) for p in node.parents ] )
+        rest = [ p for p in node.parents if p not in evidence ]
+        return Factor( rest + [ node.id ], node.cpt[ index ] ).reduce( evidence )
+
+    def cards( self ):
+        """Number of values of each variable"""
+        return dict( zip( self.variables, self.table.shape ) )
+
+    def expand( self, variables ):
+        """View of the table with axes ordered as in variables, and
+        length 1 axes for the variables not in this factor"""
+        axes = [ self.variables.index( v ) for v in variables if v in self.variables ]
+        cards = self.cards()
+        shape = [ cards.get( v, 1 ) for v in variables ]
+        return self.table.transpose( axes ).reshape( shape )
+
+    def product( self, other ):
+        """Pointwise product over the union of the variables"""
+        variables = self.variables + tuple( [ v for v in other.variables if v not in self.variables ] )
+        return Factor( variables, self.expand( variables ) * other.expand( variables ) )
+
+    __mul__ = product
+
+    def marginalize( self, *variables ):
+        """Sum out the given variables"""
+        axes = tuple( [ self.variables.index( v ) for v in variables ] )
+        rest = [ v for v in self.variables if v not in variables ]
+        return Factor( rest, self.table.sum( axis=axes ) )
+
+    def reduce( self, evidence ):
+        """Restrict to the given evidence, a dict of variable to value index.
+        The evidence variables are dropped from the factor"""
+        index = tuple( [ evidence.get( v, slice( None ) ) for v in self.variables ] )
+        rest = [ v for v in self.variables if v not in evidence ]
+        return Factor( rest, self.table[ index ] )
+
+    def normalize( self ):
+        """Scale the table to sum to 1"""
+        total = self.table.sum()
+        if total == 0:
+            raise ZeroDivisionError( "Factor over %s has no mass"%( str( self.variables ) ) )
+        return Factor( self.variables, self.table / total )
+
+    def __str__( self ):
+        return "[Factor %s]"%( str( self.variables ) ) + '\n' + str( self.table )
+
+    def __repr__( self ):
+        return "[Factor %s]"%( str( self.variables ) )
+
+def productOf( factors ):
+    """Product of a list of factors"""
+    return reduce( Factor.product, factors, Factor( (), 1.0 ) )
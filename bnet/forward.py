@@ -0,0 +1,130 @@
+"""
+Forward:
+    Ancestral sampling of complete joint samples, many at a time, with
+    likelihood weighting under evidence, and bulk dataset generation
+"""
+
+import numpy
+
+import instrument
+from rng import streamOf, Alias
+
+class ForwardSampler( object ):
+    """
+    Draws batches of samples from the joint distribution of a network by
+    sampling the variables in topological order, each with one gather
+    from its CPT and one comparison for the whole batch. Variables with
+    evidence are set to their value instead, and every sample is weighted
+    by the likelihood of the evidence given its parents. Variables that
+    always draw from the same row, as roots do, draw through an alias
+    table of it
+    """
+
+    def __init__( self, net, ctx=None, seed=None ):
+        """
+        @net - network to sample; read only
+        @ctx - context holding the evidence, if any
+        @seed - seed, or rng.RandomStream, the samples draw from
+        """
+        self.net = net
+        self.ids = net.topologicalOrder()
+        self.pos = dict( [ ( id, i ) for i, id in enumerate( self.ids ) ] )
+        self.random = streamOf( seed )
+        self.evidence = ctx.getIndices() if ctx is not None else {}
+        self.parents = [ [ self.pos[ p ] for p in net.get( id ).parents ] for id in self.ids ]
+        self.cpts = [ net.get( id ).cpt for id in self.ids ]
+        cards = [ cpt.shape[ -1 ] for cpt in self.cpts ]
+        self.dtype = numpy.int8 if max( cards + [ 0 ] ) <= 127 else numpy.int32
+
+        # Free variables whose parents all have evidence
+        self.alias = {}
+        for i, id in enumerate( self.ids ):
+            parents = net.get( id ).parents
+            if id not in self.evidence and not [ p for p in parents if p not in self.evidence ]:
+                row = numpy.asarray( self.cpts[ i ][ tuple( [ self.evidence[ p ] for p in parents ] ) ], dtype=float )
+                if row.sum() > 0:
+                    self.alias[ i ] = Alias( row )
+
+    def sample( self, n ):
+        """
+        Draw n samples
+        Returns a ( n, variables ) array of value indices, columns in the
+        order of self.ids, and the weight of every sample; the weights are
+        None without evidence
+        """
+        data = numpy.empty( ( n, len( self.ids ) ), dtype=self.dtype )
+        weights = numpy.ones( n ) if self.evidence else None
+        for i, id in enumerate( self.ids ):
+            if i in self.alias:
+                data[ :, i ] = self.alias[ i ].sample( self.random, n )
+                continue
+            cpt = self.cpts[ i ]
+            if self.parents[ i ]:
+                rows = cpt[ tuple( [ data[ :, p ] for p in self.parents[ i ] ] ) ]
+            else:
+                rows = cpt[ numpy.newaxis ]
+            if id in self.evidence:
+                v = self.evidence[ id ]
+                data[ :, i ] = v
+                weights *= rows[ :, v ]
+            else:
+                cdf = rows.cumsum( axis=1 )
+                data[ :, i ] = ( cdf <= ( self.random.random_sample( n ) * cdf[ :, -1 ] )[ :, numpy.newaxis ] ).sum( axis=1 )
+        instrument.count( 'forward samples', n )
+        return data, weights
+
+    def chunks( self, n, chunk=100000 ):
+        """Draw n samples in chunks, as ( data, weights ) pairs"""
+        for start in xrange( 0, n, chunk ):
+            yield self.sample( min( chunk, n - start ) )
+
+    def marginals( self, n=100000, chunk=100000 ):
+        """Posterior of every variable estimated from n weighted samples,
+        as a dict of id to distribution"""
+        counts = [ numpy.zeros( cpt.shape[ -1 ] ) for cpt in self.cpts ]
+        with instrument.phase( 'sampling' ):
+            for data, weights in self.chunks( n, chunk ):
+                for i in range( len( self.ids ) ):
+                    counts[ i ] += numpy.bincount( data[ :, i ], weights=weights, minlength=len( counts[ i ] ) )
+        result = {}
+        for i, id in enumerate( self.ids ):
+            total = counts[ i ].sum()
+            if total == 0:
+                raise ZeroDivisionError( "No sample is consistent with the evidence" )
+            result[ id ] = dict( zip( self.net.get( id ).values, counts[ i ] / total ) )
+        return result
+
+    def write( self, fname, n, chunk=100000 ):
+        """
+        Write n samples to fname a chunk at a time, as .npy of value
+        indices with columns in the order of self.ids, or otherwise as CSV
+        of values with a header of ids. Under evidence the weights go to
+        a 'weight' column of the CSV, or to fname with .weights.npy in
+        place of .npy
+        """
+        if fname.endswith( '.npy' ):
+            out = numpy.lib.format.open_memmap( fname, mode='w+', dtype=self.dtype, shape=( n, len( self.ids ) ) )
+            weightsOut = None
+            if self.evidence:
+                weightsOut = numpy.lib.format.open_memmap( fname[ :-4 ] + '.weights.npy', mode='w+', dtype=float, shape=( n, ) )
+            at = 0
+            for data, weights in self.chunks( n, chunk ):
+                out[ at : at + len( data ) ] = data
+                if weightsOut is not None:
+                    weightsOut[ at : at + len( data ) ] = weights
+                at += len( data )
+            out.flush()
+            del out, weightsOut
+            return
+
+        names = [ numpy.array( map( str, self.net.get( id ).values ), dtype=object ) for id in self.ids ]
+        f = open( fname, 'w' )
+        try:
+            f.write( ','.join( map( str, self.ids ) + ( [ 'weight' ] if self.evidence else [] ) ) + '\n' )
+            for data, weights in self.chunks( n, chunk ):
+                columns = [ names[ i ][ data[ :, i ] ] for i in range( len( self.ids ) ) ]
+                if weights is not None:
+                    columns.append( map( repr, weights.tolist() ) )
+                f.write( '\n'.join( [ ','.join( row ) for row in zip( *columns ) ] ) + '\n' )
+        finally:
+            f.close()
@@ -0,0 +1,66 @@
+"""
+Generate:
+    Random networks for testing and benchmarks
+"""
+
+import numpy
+
+from BNet import BNet, BNode
+
+def domain( arity ):
+    """Values of a generated variable; binary ones are ( True, False ) as in
+    the Ravi format"""
+    if arity == 2:
+        return ( True, False )
+    return tuple( [ 'v%d'%( i ) for i in range( arity ) ] )
+
+def randomCPT( random, shape, sparsity=0.0 ):
+    """
+    CPT with rows drawn uniformly from the simplex
+    @sparsity - chance of each entry being zero; the largest entry of every
+        row is kept, so rows stay distributions
+    """
+    cpt = random.dirichlet( numpy.ones( shape[-1] ), size=shape[:-1] or None ).reshape( shape )
+    if sparsity > 0:
+        mask = random.random_sample( shape ) < sparsity
+        largest = cpt.argmax( axis=-1 )[..., numpy.newaxis]
+        numpy.put_along_axis( mask, largest, False, axis=-1 )
+        cpt[ mask ] = 0
+        cpt /= cpt.sum( axis=-1 )[..., numpy.newaxis]
+    return cpt
+
+def randomNet( n, maxParents=2, arity=2, window=None, sparsity=0.0, seed=None ):
+    """
+    Random network on variables 1..n, each with up to maxParents parents
+    drawn from the variables before it, so 1..n is a topological order
+    @arity - number of values of every variable, or a ( low, high ) range
+        to draw each variable's from
+    @window - if given, parents come from the window variables just before
+        a node, which keeps the treewidth at most about window
+    @sparsity - chance of each CPT entry being zero
+    @seed - seed for the random number generator
+    """
+    random = numpy.random.RandomState( seed )
+    if isinstance( arity, tuple ):
+        arities = random.randint( arity[0], arity[1] + 1, size=n+1 )
+    else:
+        arities = numpy.repeat( arity, n+1 )
+    domains = dict( [ ( a, domain( a ) ) for a in set( arities.tolist() ) ] )
+
+    net = BNet()
+    for id in xrange( 1, n+1 ):
+        low = 1 if window is None else max( 1, id - window )
+        candidates = id - low
+        k = random.randint( 0, min( maxParents, candidates ) + 1 )
+
+        # Distinct parents, without an O( candidates ) permutation
+        parents = set()
+        while len( parents ) < k:
+            parents.add( low + random.randint( candidates ) )
+        parents = sorted( parents )
+
+        values = domains[ arities[ id ] ]
+        parentValues = [ domains[ arities[ p ] ] for p in parents ]
+        shape = tuple( map( len, parentValues ) ) + ( len( values ), )
+        net.add( BNode( id, parents, ( id, ), values, parentValues=parentValues, cpt=randomCPT( random, shape, sparsity ) ) )
+    return net
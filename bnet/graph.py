@@ -0,0 +1,99 @@
+"""
+Graph:
+    Integer indexed structure of a network. Ids are interned to dense
+    indices, parents and children are held as CSR arrays, and the
+    topological order is found once
+"""
+
+import heapq
+
+import numpy
+
+class Graph( object ):
+    """
+    Structure of a network over variables 0..n-1. The parents of variable
+    i are parents[ parentStart[ i ] : parentStart[ i + 1 ] ], its children
+    children[ childStart[ i ] : childStart[ i + 1 ] ], in index order, and
+    order has every parent before its children
+    """
+
+    def __init__( self, ids, parentLists ):
+        """
+        @ids - id of each variable, in index order
+        @parentLists - indices of the parents of each variable
+        """
+        self.ids = list( ids )
+        self.index = dict( [ ( id, i ) for i, id in enumerate( self.ids ) ] )
+        n = len( self.ids )
+
+        counts = numpy.array( map( len, parentLists ), dtype=numpy.int32 )
+        self.parentStart = numpy.zeros( n + 1, dtype=numpy.int32 )
+        numpy.cumsum( counts, out=self.parentStart[ 1: ] )
+        self.parents = numpy.fromiter( [ p for parents in parentLists for p in parents ], dtype=numpy.int32, count=self.parentStart[ -1 ] )
+
+        # The children are the edges sorted by parent; the sort is stable,
+        # so each variable's children stay in index order
+        child = numpy.repeat( numpy.arange( n, dtype=numpy.int32 ), counts )
+        self.children = child[ numpy.argsort( self.parents, kind='mergesort' ) ]
+        self.childStart = numpy.zeros( n + 1, dtype=numpy.int32 )
+        numpy.cumsum( numpy.bincount( self.parents, minlength=n ), out=self.childStart[ 1: ] )
+
+        # Networks are usually built parents first, which makes the index
+        # order topological already
+        if ( self.parents < child ).all():
+            self.order = numpy.arange( n, dtype=numpy.int32 )
+        else:
+            self.order = self.topological()
+
+    def __len__( self ):
+        return len( self.ids )
+
+    def parentsOf( self, i ):
+        return self.parents[ self.parentStart[ i ] : self.parentStart[ i + 1 ] ]
+
+    def childrenOf( self, i ):
+        return self.children[ self.childStart[ i ] : self.childStart[ i + 1 ] ]
+
+    def topological( self ):
+        """Indices with every parent before its children, taking the lowest
+        ready index each time, so an index order that is already
+        topological is kept. Raises ValueError if there is a cycle"""
+        remaining = numpy.diff( self.parentStart ).tolist()
+        start = self.childStart.tolist()
+        children = self.children.tolist()
+        ready = [ i for i, k in enumerate( remaining ) if k == 0 ]
+        order = []
+        while ready:
+            i = heapq.heappop( ready )
+            order.append( i )
+            for c in children[ start[ i ] : start[ i + 1 ] ]:
+                remaining[ c ] -= 1
+                if not remaining[ c ]:
+                    heapq.heappush( ready, c )
+        if len( order ) < len( self.ids ):
+            stuck = [ self.ids[ i ] for i, k in enumerate( remaining ) if k ][ :5 ]
+            raise ValueError( "The network has a cycle through %s"%( ', '.join( map( str, stuck ) ) ) )
+        return numpy.array( order, dtype=numpy.int32 )
+
+    def blanket( self, i ):
+        """Indices of the Markov blanket of a variable: itself, its
+        parents, its children and their other parents, each once"""
+        children = self.childrenOf( i )
+        found = [ i ] + self.parentsOf( i ).tolist() + children.tolist()
+        for c in children:
+            found += self.parentsOf( c ).tolist()
+        seen = set()
+        return [ j for j in found if not ( j in seen or seen.add( j ) ) ]
+
+    def ancestors( self, indices ):
+        """Mask of the given variables and all their ancestors"""
+        mask = numpy.zeros( len( self.ids ), dtype=bool )
+        mask[ list( indices ) ] = True
+        stack = list( indices )
+        while stack:
+            i = stack.pop()
+            parents = self.parentsOf( i )
+            parents = parents[ ~mask[ parents ] ]
+            mask[ parents ] = True
+            stack.extend( parents.tolist() )
+        return mask
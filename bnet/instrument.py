@@ -0,0 +1,99 @@
+"""
+Instrument:
+    Opt in timers and counters, to see where the time of a query goes.
+    Everything is off until enable() is called; call sites on hot paths
+    check the enabled flag before doing any work, so the cost when
+    disabled is one attribute lookup
+"""
+
+import time
+
+enabled = False
+
+# Name -> [ calls, seconds ]
+timers = {}
+
+# Name -> count
+counters = {}
+
+def enable( on=True ):
+    global enabled
+    enabled = on
+
+def disable():
+    enable( False )
+
+def reset():
+    """Forget every timer and counter"""
+    timers.clear()
+    counters.clear()
+
+def count( name, n=1 ):
+    """Add n to a counter"""
+    if enabled:
+        counters[ name ] = counters.get( name, 0 ) + n
+
+def add( name, seconds ):
+    """Add a call taking the given time to a timer"""
+    timer = timers.setdefault( name, [ 0, 0.0 ] )
+    timer[ 0 ] += 1
+    timer[ 1 ] += seconds
+
+class phase( object ):
+    """
+    Times a block under a name, if instrumentation is enabled:
+        with instrument.phase( 'sampling' ):
+            ...
+    Phases may nest; each is charged its whole time
+    """
+
+    def __init__( self, name ):
+        self.name = name
+        self.start = None
+
+    def __enter__( self ):
+        if enabled:
+            self.start = time.time()
+        return self
+
+    def __exit__( self, type, value, traceback ):
+        if self.start is not None:
+            add( self.name, time.time() - self.start )
+            self.start = None
+        return False
+
+def report():
+    """
+    Timers, counters and rates so far, as a dict with
+        'timers' - name -> { 'calls', 'seconds' }
+        'counters' - name -> count
+        'rates' - samples/s and sweeps/s of the samplers, over the time
+            spent in burn in and sampling
+    """
+    sampling = sum( [ timers[ name ][ 1 ] for name in ( 'burn-in', 'sampling' ) if name in timers ] )
+    rates = {}
+    if sampling > 0:
+        for name, rate in ( ( 'sampler steps', 'samples/s' ), ( 'sweeps', 'sweeps/s' ) ):
+            if name in counters:
+                rates[ rate ] = counters[ name ] / sampling
+    return {
+        'enabled' : enabled,
+        'timers' : dict( [ ( name, { 'calls' : calls, 'seconds' : seconds } ) for name, ( calls, seconds ) in timers.items() ] ),
+        'counters' : dict( counters ),
+        'rates' : rates,
+        }
+
+def format( stats=None ):
+    """A report as lines of text"""
+    if stats is None:
+        stats = report()
+    lines = []
+    for name, timer in sorted( stats[ 'timers' ].items(), key=lambda item: -item[1][ 'seconds' ] ):
+        lines.append( "%-20s %10.3fms %8d calls"%( name, timer[ 'seconds' ] * 1000, timer[ 'calls' ] ) )
+    for name, n in sorted( stats[ 'counters' ].items() ):
+        lines.append( "%-20s %10d"%( name, n ) )
+    for name, rate in sorted( stats[ 'rates' ].items() ):
+        lines.append( "%-20s %10.0f"%( name, rate ) )
+    if not lines:
+        lines.append( "No statistics" if stats[ 'enabled' ] else "Statistics are off" )
+    return '\n'.join( lines )
@@ -0,0 +1,215 @@
+"""
+Junction trees:
+    Clique trees compiled once from a network, and calibrated against
+    changing evidence
+"""
+
+import numpy
+
+import instrument
+
+from factors import Factor, productOf
+from algos import interactionGraph, eliminationOrder, eliminate
+
+class JunctionTree( object ):
+    """
+    Clique tree of a triangulation of the moral graph of a network.
+    Messages between cliques are cached; changing the evidence only drops
+    the messages that flow away from the cliques holding the changed
+    variables
+    """
+
+    def __init__( self, net, heuristic='minfill' ):
+        """
+        @net - network to compile; its CPTs are read, never modified
+        @heuristic - elimination ordering heuristic used to triangulate
+        """
+        self.net = net
+        with instrument.phase( 'compile' ):
+            self.triangulate( heuristic )
+            self.assign()
+
+        self.evidence = {}
+        self.locals = {}
+        self.messages = {}
+        self.beliefs = {}
+
+    def triangulate( self, heuristic ):
+        """Build the cliques and the tree from an elimination ordering"""
+        graph = interactionGraph( [ node.parents + ( node.id, ) for node in self.net.variables.values() ] )
+        for id in self.net.variables:
+            graph.setdefault( id, set() )
+        order = eliminationOrder( graph, self.net.variables.keys(), heuristic )
+        position = dict( [ ( var, i ) for i, var in enumerate( order ) ] )
+
+        # Eliminating order[i] creates clique i; its parent in the tree is
+        # the clique of the first variable eliminated after it
+        cliques = []
+        adj = {}
+        roots = []
+        for i, var in enumerate( order ):
+            nbrs = eliminate( graph, var )
+            cliques.append( set( nbrs ) | set( [ var ] ) )
+            adj.setdefault( i, set() )
+            if nbrs:
+                parent = min( [ position[ u ] for u in nbrs ] )
+                adj.setdefault( parent, set() ).add( i )
+                adj[ i ].add( parent )
+            else:
+                roots.append( i )
+
+        # Join the trees of disconnected parts with empty separators
+        for a, b in zip( roots, roots[1:] ):
+            adj[ a ].add( b )
+            adj[ b ].add( a )
+
+        # Merge cliques into a neighbour that contains them
+        merged = {}
+        for a in range( len( cliques ) ):
+            for b in adj[ a ]:
+                if cliques[ a ] <= cliques[ b ]:
+                    for c in adj[ a ]:
+                        if c != b:
+                            adj[ c ].discard( a )
+                            adj[ c ].add( b )
+                            adj[ b ].add( c )
+                    adj[ b ].discard( a )
+                    del adj[ a ]
+                    merged[ a ] = b
+                    break
+
+        def find( a ):
+            while a in merged: a = merged[ a ]
+            return a
+
+        # Number the remaining cliques
+        kept = sorted( adj.keys() )
+        number = dict( [ ( a, i ) for i, a in enumerate( kept ) ] )
+        self.position = position
+        self.cliques = [ tuple( sorted( cliques[ a ], key=position.get ) ) for a in kept ]
+        self.neighbours = [ [ number[ b ] for b in adj[ a ] ] for a in kept ]
+        self.home = dict( [ ( var, number[ find( position[ var ] ) ] ) for var in order ] )
+
+        # Message schedule; leaves to root, then root to leaves
+        self.schedule = []
+        if self.cliques:
+            seen = set( [ 0 ] )
+            frontier = [ 0 ]
+            down = []
+            while frontier:
+                a = frontier.pop()
+                for b in self.neighbours[ a ]:
+                    if b not in seen:
+                        seen.add( b )
+                        frontier.append( b )
+                        down.append( ( a, b ) )
+            self.schedule = [ ( b, a ) for a, b in reversed( down ) ] + down
+
+    def assign( self ):
+        """Multiply each CPT into the potential of a clique holding its family"""
+        self.potentials = []
+        for clique in self.cliques:
+            shape = [ len( self.net.get( var ).values ) for var in clique ]
+            self.potentials.append( Factor( clique, numpy.ones( shape ) ) )
+
+        for node in self.net.variables.values():
+            # The clique made when the first of the family was eliminated
+            # holds the whole family; after merging it is found through the
+            # home clique of that variable
+            i = self.home[ min( node.parents + ( node.id, ), key=self.position.get ) ]
+            potential = self.potentials[ i ] * Factor.fromNode( node )
+            self.potentials[ i ] = Factor( self.cliques[ i ], potential.expand( self.cliques[ i ] ) )
+
+    def setEvidence( self, ctx ):
+        """Bring the evidence in line with the context, invalidating only
+        the cached messages that depend on the changed variables"""
+        with instrument.phase( 'evidence' ):
+            evidence = ctx.getIndices()
+            changed = set( [ k for k in set( evidence ) | set( self.evidence )
+                    if evidence.get( k ) != self.evidence.get( k ) ] )
+            if not changed:
+                return
+            self.evidence = evidence
+            self.beliefs = {}
+            for var in changed:
+                self.invalidate( self.home[ var ] )
+
+    def invalidate( self, clique ):
+        """Drop the local potential of a clique and the messages flowing
+        away from it"""
+        self.locals.pop( clique, None )
+        frontier = [ ( clique, None ) ]
+        while frontier:
+            a, prev = frontier.pop()
+            for b in self.neighbours[ a ]:
+                if b != prev and ( a, b ) in self.messages:
+                    del self.messages[ ( a, b ) ]
+                    frontier.append( ( b, a ) )
+
+    def local( self, i ):
+        """Potential of clique i with the evidence homed there entered"""
+        if i not in self.locals:
+            table = self.potentials[ i ].table
+            for axis, var in enumerate( self.cliques[ i ] ):
+                if var in self.evidence and self.home[ var ] == i:
+                    mask = numpy.zeros( table.shape[ axis ] )
+                    mask[ self.evidence[ var ] ] = 1
+                    shape = [ 1 ] * table.ndim
+                    shape[ axis ] = table.shape[ axis ]
+                    table = table * mask.reshape( shape )
+            self.locals[ i ] = Factor( self.cliques[ i ], table )
+        return self.locals[ i ]
+
+    def message( self, a, b ):
+        """Message from clique a to clique b; all messages into a other
+        than from b must be present"""
+        incoming = [ self.messages[ ( c, a ) ] for c in self.neighbours[ a ] if c != b ]
+        belief = productOf( [ self.local( a ) ] + incoming )
+        rest = [ v for v in self.cliques[ a ] if v not in self.cliques[ b ] ]
+        msg = belief.marginalize( *rest )
+        total = msg.table.sum()
+        if total > 0:
+            msg = Factor( msg.variables, msg.table / total )
+        return msg
+
+    def calibrate( self, ctx=None ):
+        """Pass every missing message, so all clique beliefs are available"""
+        if ctx is not None:
+            self.setEvidence( ctx )
+        with instrument.phase( 'calibrate' ):
+            for a, b in self.schedule:
+                if ( a, b ) not in self.messages:
+                    self.messages[ ( a, b ) ] = self.message( a, b )
+                    instrument.count( 'messages' )
+
+    def belief( self, i ):
+        """Unnormalized posterior over the variables of clique i"""
+        if i not in self.beliefs:
+            if [ c for c in self.neighbours[ i ] if ( c, i ) not in self.messages ]:
+                self.calibrate()
+            incoming = [ self.messages[ ( c, i ) ] for c in self.neighbours[ i ] ]
+            self.beliefs[ i ] = productOf( [ self.local( i ) ] + incoming )
+        return self.beliefs[ i ]
+
+    def query( self, ctx, id ):
+        """Posterior distribution of a variable, as a dict of value to
+        probability"""
+        self.setEvidence( ctx )
+        return self.marginal( id )
+
+    def marginal( self, id ):
+        """Posterior of a variable under the current evidence"""
+        node = self.net.get( id )
+        belief = self.belief( self.home[ id ] )
+        with instrument.phase( 'normalize' ):
+            rest = [ v for v in belief.variables if v != id ]
+            result = belief.marginalize( *rest ).normalize()
+            return dict( zip( node.values, result.table ) )
+
+    def marginals( self, ctx=None ):
+        """Posteriors of every variable, as a dict of id to distribution"""
+        self.calibrate( ctx )
+        return dict( [ ( id, self.marginal( id ) ) for id in self.net.variables ] )
+
+    def __str__( self ):
+        return "[JunctionTree %d cliques, width %d]"%( len( self.cliques ), max( [ 0 ] + map( len, self.cliques ) ) - 1 )
@@ -0,0 +1,281 @@
+"""
+Learn:
+    Estimate the CPTs of a network structure from data. Data is read a
+    chunk of rows at a time and reduced to counts, so the memory used does
+    not grow with the number of rows
+"""
+
+import csv
+
+import numpy
+
+import BNet
+import instrument
+from factors import Factor, productOf
+from jtree import JunctionTree
+from sampling import GibbsSampler
+from rng import streamOf
+
+# Value index of an unobserved value
+MISSING = -1
+
+class ArrayData( object ):
+    """Rows of value indices held in an array, or a memory map of one,
+    served in chunks"""
+
+    def __init__( self, array, columns, chunk=100000 ):
+        """
+        @array - ( rows, columns ) integer array; MISSING where unobserved
+        @columns - id of the variable in each column
+        @chunk - rows per chunk
+        """
+        self.array = array
+        self.columns = list( columns )
+        self.chunk = chunk
+
+    def __iter__( self ):
+        for start in xrange( 0, len( self.array ), self.chunk ):
+            yield numpy.asarray( self.array[ start : start + self.chunk ], dtype=int )
+
+def npyData( fname, columns, chunk=100000 ):
+    """ArrayData over a .npy file of value indices, memory mapped"""
+    return ArrayData( numpy.load( fname, mmap_mode='r' ), columns, chunk )
+
+class CSVData( object ):
+    """
+    Rows of a CSV file whose header names the variables, coded as value
+    indices a chunk at a time. Values are matched by their str(); empty
+    cells, '?' and 'NA' are missing
+    """
+
+    MISSING = ( '', '?', 'NA' )
+
+    def __init__( self, fname, net, chunk=100000 ):
+        self.fname = fname
+        self.net = net
+        self.chunk = chunk
+
+        f = open( fname, 'rb' )
+        try:
+            header = csv.reader( f ).next()
+        finally:
+            f.close()
+        self.columns = [ self.resolve( name.strip() ) for name in header ]
+        self.codes = [ dict( [ ( str( v ), i ) for i, v in enumerate( net.get( id ).values ) ] ) for id in self.columns ]
+
+    def resolve( self, name ):
+        """Id of the variable named in the header; ids may be ints or strings"""
+        if name in self.net.variables:
+            return name
+        try:
+            if int( name ) in self.net.variables:
+                return int( name )
+        except ValueError:
+            pass
+        raise ValueError( "%s: no variable %s"%( self.fname, name ) )
+
+    def __iter__( self ):
+        f = open( self.fname, 'rb' )
+        try:
+            reader = csv.reader( f )
+            reader.next()
+            rows = []
+            for line, row in enumerate( reader, 2 ):
+                if len( row ) != len( self.columns ):
+                    raise ValueError( "%s:%d: expected %d values"%( self.fname, line, len( self.columns ) ) )
+                coded = []
+                for codes, cell in zip( self.codes, row ):
+                    cell = cell.strip()
+                    if cell in self.MISSING:
+                        coded.append( MISSING )
+                    elif cell in codes:
+                        coded.append( codes[ cell ] )
+                    else:
+                        raise ValueError( "%s:%d: unknown value %s"%( self.fname, line, cell ) )
+                rows.append( coded )
+                if len( rows ) == self.chunk:
+                    yield numpy.array( rows, dtype=int )
+                    rows = []
+            if rows:
+                yield numpy.array( rows, dtype=int )
+        finally:
+            f.close()
+
+def align( ids, columns, chunk ):
+    """A chunk with one column per id, in order; variables the data does
+    not have are missing"""
+    col = dict( [ ( id, i ) for i, id in enumerate( columns ) ] )
+    full = numpy.empty( ( len( chunk ), len( ids ) ), dtype=int )
+    for i, id in enumerate( ids ):
+        full[ :, i ] = chunk[ :, col[ id ] ] if id in col else MISSING
+    return full
+
+def countComplete( net, ids, data, counts ):
+    """Add the rows in which a family is fully observed to the counts of
+    that family"""
+    col = dict( [ ( id, i ) for i, id in enumerate( ids ) ] )
+    for id, table in counts.items():
+        family = data[ :, [ col[ v ] for v in net.get( id ).parents + ( id, ) ] ]
+        family = family[ ( family >= 0 ).all( axis=1 ) ]
+        index = numpy.ravel_multi_index( tuple( family.T ), table.shape )
+        table += numpy.bincount( index, minlength=table.size ).reshape( table.shape )
+
+def fromCounts( net, counts, alpha=1.0 ):
+    """
+    New network with the structure of net, and CPTs estimated from counts
+    @alpha - Dirichlet pseudo count added to every entry; rows with no
+        counts at all are uniform
+    """
+    result = BNet.BNet()
+    for id in net.topologicalOrder():
+        node = net.get( id )
+        table = counts[ id ] + alpha
+        total = table.sum( axis=-1 )[..., numpy.newaxis]
+        cpt = numpy.where( total > 0, table / numpy.where( total > 0, total, 1 ), 1.0 / table.shape[ -1 ] )
+        result.add( BNet.BNode( id, node.parents, node.attrs, node.values, parentValues=node.parentValues, cpt=cpt ) )
+    return result
+
+def mle( net, data, alpha=1.0 ):
+    """
+    Estimate the CPTs of a network from data, counting only the rows in
+    which each family is fully observed
+    @data - iterable of chunks, such as ArrayData or CSVData, with a
+        columns attribute
+    @alpha - Dirichlet pseudo count; 0 for maximum likelihood
+    Returns a new network with the structure of net
+    """
+    ids = net.variables.keys()
+    counts = dict( [ ( id, numpy.zeros( net.get( id ).cpt.shape ) ) for id in ids ] )
+    with instrument.phase( 'learn' ):
+        for chunk in data:
+            countComplete( net, ids, align( ids, data.columns, chunk ), counts )
+            instrument.count( 'rows', len( chunk ) )
+    return fromCounts( net, counts, alpha )
+
+def em( net, data, alpha=1.0, iterations=20, tolerance=1e-4, engine='exact', batch=1000, burnIn=20, sweeps=100, seed=None ):
+    """
+    Estimate the CPTs of a network from data with missing values by
+    expectation maximization, starting from the CPTs of net. Families
+    observed in a row are counted directly. The others get their
+    posterior under the row's observed values, found for a batch of
+    distinct rows at a time
+    @data - re-iterable chunks, such as ArrayData or CSVData
+    @alpha - Dirichlet pseudo count
+    @iterations - most passes over the data
+    @tolerance - stop once no CPT entry changes by more than this
+    @engine - 'exact' for a junction tree, 'gibbs' for sampling
+    @batch - most distinct rows whose posteriors are found together
+    @burnIn, @sweeps, @seed - sampler settings for 'gibbs'; one chain
+        runs for each row
+    Returns a new network with the structure of net
+    """
+    if engine not in ( 'exact', 'gibbs' ):
+        raise ValueError( "EM needs the exact or gibbs engine, not %s"%( engine ) )
+    ids = net.variables.keys()
+    stream = streamOf( seed )
+    tree = JunctionTree( net ) if engine == 'exact' else None
+    for iteration in xrange( iterations ):
+        counts = dict( [ ( id, numpy.zeros( net.get( id ).cpt.shape ) ) for id in ids ] )
+        if tree is not None:
+            # Same cliques, new CPTs
+            tree.net = net
+            tree.assign()
+        with instrument.phase( 'learn' ):
+            for chunk in data:
+                full = align( ids, data.columns, chunk )
+                countComplete( net, ids, full, counts )
+                incomplete = full[ ( full < 0 ).any( axis=1 ) ]
+                if len( incomplete ):
+                    patterns, weights = numpy.unique( incomplete, axis=0, return_counts=True )
+                    for start in xrange( 0, len( patterns ), batch ):
+                        rows = slice( start, start + batch )
+                        if tree is not None:
+                            exactFamilies( tree, ids, patterns[ rows ], weights[ rows ], counts )
+                        else:
+                            sampledFamilies( net, ids, patterns[ rows ], weights[ rows ], counts, burnIn, sweeps, stream )
+                instrument.count( 'rows', len( chunk ) )
+
+        learnt = fromCounts( net, counts, alpha )
+        change = max( [ abs( learnt.get( id ).cpt - net.get( id ).cpt ).max() for id in ids ] )
+        net = learnt
+        if change <= tolerance:
+            break
+    return net
+
+def incompleteWeights( net, ids, patterns, weights ):
+    """Weight of every row for each family it leaves incomplete"""
+    col = dict( [ ( id, i ) for i, id in enumerate( ids ) ] )
+    result = {}
+    for id in ids:
+        family = net.get( id ).parents + ( id, )
+        w = weights * ( patterns[ :, [ col[ v ] for v in family ] ] < 0 ).any( axis=1 )
+        if w.any():
+            result[ id ] = w
+    return result
+
+# Axis of the rows in the factors of a batch
+ROW = '#row'
+
+def perRow( factor ):
+    """Scale a factor to sum to 1 for every row, leaving rows with no mass
+    at 0"""
+    axes = tuple( [ i for i, v in enumerate( factor.variables ) if v != ROW ] )
+    total = factor.table.sum( axis=axes, keepdims=True )
+    return Factor( factor.variables, factor.table / numpy.where( total > 0, total, 1 ) )
+
+def exactFamilies( tree, ids, patterns, weights, counts ):
+    """
+    Add the expected counts of the families a batch of rows leaves
+    incomplete, from one pass over a junction tree whose factors carry an
+    extra axis for the rows
+    """
+    col = dict( [ ( id, i ) for i, id in enumerate( ids ) ] )
+    rows = len( patterns )
+
+    # Evidence of every row, as indicators entered where it is homed
+    locals = []
+    for i, clique in enumerate( tree.cliques ):
+        factor = tree.potentials[ i ]
+        for var in clique:
+            observed = patterns[ :, col[ var ] ]
+            if tree.home[ var ] == i and ( observed >= 0 ).any():
+                k = len( tree.net.get( var ).values )
+                indicator = ( observed[ :, numpy.newaxis ] == numpy.arange( k ) ) | ( observed < 0 )[ :, numpy.newaxis ]
+                factor = factor * Factor( ( ROW, var ), indicator )
+        locals.append( factor )
+
+    messages = {}
+    for a, b in tree.schedule:
+        belief = productOf( [ locals[ a ] ] + [ messages[ ( c, a ) ] for c in tree.neighbours[ a ] if c != b ] )
+        rest = [ v for v in belief.variables if v != ROW and v not in tree.cliques[ b ] ]
+        messages[ ( a, b ) ] = perRow( belief.marginalize( *rest ) )
+
+    beliefs = {}
+    for id, w in incompleteWeights( tree.net, ids, patterns, weights ).items():
+        scope = tree.net.get( id ).parents + ( id, )
+        i = tree.home[ min( scope, key=tree.position.get ) ]
+        if i not in beliefs:
+            beliefs[ i ] = productOf( [ locals[ i ] ] + [ messages[ ( c, i ) ] for c in tree.neighbours[ i ] ] )
+        belief = beliefs[ i ]
+        family = perRow( belief.marginalize( *[ v for v in belief.variables if v != ROW and v not in scope ] ) )
+        posterior = family.expand( ( ROW, ) + scope )
+        counts[ id ] += ( w.reshape( ( rows, ) + ( 1, ) * len( scope ) ) * posterior ).sum( axis=0 )
+
+def sampledFamilies( net, ids, patterns, weights, counts, burnIn, sweeps, stream ):
+    """
+    Add the expected counts of the families a batch of rows leaves
+    incomplete, estimated by Gibbs sampling with one chain per row, each
+    clamped to the values observed in its row
+    """
+    sampler = GibbsSampler( net, BNet.Context( net ), len( patterns ), stream )
+    col = dict( [ ( id, i ) for i, id in enumerate( ids ) ] )
+    sampler.clamp( patterns[ :, [ col[ id ] for id in sampler.ids ] ] )
+    sampler.run( burnIn, 0 )
+
+    families = [ ( id, w / float( sweeps ), [ sampler.pos[ v ] for v in net.get( id ).parents + ( id, ) ] )
+            for id, w in incompleteWeights( net, ids, patterns, weights ).items() ]
+    for s in xrange( sweeps ):
+        sampler.sweep()
+        for id, w, positions in families:
+            index = numpy.ravel_multi_index( tuple( sampler.state[ :, positions ].T ), counts[ id ].shape )
+            counts[ id ] += numpy.bincount( index, weights=w, minlength=counts[ id ].size ).reshape( counts[ id ].shape )
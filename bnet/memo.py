@@ -0,0 +1,91 @@
+"""
+Memo:
+    Bounded cache of inference results, keyed by network, evidence, query
+    and engine settings
+"""
+
+import cPickle
+import os
+from collections import OrderedDict
+
+class PosteriorCache( object ):
+    """
+    Least recently used cache of posteriors. Keys combine the fingerprint
+    of the network, the evidence as sorted ( variable, value index )
+    pairs, the query variables and the engine with its parameters, so an
+    entry is only reused for exactly the same question
+    """
+
+    def __init__( self, size=1024, path=None ):
+        """
+        @size - most entries kept; the least recently used go first
+        @path - file the entries are loaded from and saved to, if any
+        """
+        self.size = size
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists( path ):
+            self.load()
+
+    def key( self, net, ctx, query, engine, params ):
+        if not isinstance( query, tuple ):
+            query = ( query, )
+        return ( net.fingerprint(), tuple( sorted( ctx.getIndices().items() ) ),
+                query, engine, tuple( sorted( params.items() ) ) )
+
+    def lookup( self, net, ctx, query, engine, compute, **params ):
+        """
+        Result of compute() for the question, from the cache if it has been
+        asked before
+        @query - query variable, or tuple of them
+        @engine - name of the inference engine
+        @params - engine parameters that change the result
+        """
+        key = self.key( net, ctx, query, engine, params )
+        if key in self.entries:
+            self.hits += 1
+            value = self.entries.pop( key )
+        else:
+            self.misses += 1
+            value = compute()
+        self.entries[ key ] = value
+        while len( self.entries ) > self.size:
+            self.entries.popitem( last=False )
+        return value
+
+    def clear( self ):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats( self ):
+        return { 'hits' : self.hits, 'misses' : self.misses, 'entries' : len( self.entries ), 'size' : self.size }
+
+    def load( self ):
+        """Read the entries of the cache file; a truncated or corrupt file
+        leaves the cache empty, to be written over by save()"""
+        f = open( self.path, 'rb' )
+        try:
+            entries = cPickle.load( f )
+        except ( EOFError, cPickle.UnpicklingError ):
+            return
+        finally:
+            f.close()
+        for key, value in entries:
+            self.entries[ key ] = value
+        while len( self.entries ) > self.size:
+            self.entries.popitem( last=False )
+
+    def save( self ):
+        """Write the entries to the cache file, if there is one"""
+        if not self.path:
+            return
+        tmp = self.path + '.tmp%d'%( os.getpid() )
+        f = open( tmp, 'wb' )
+        try:
+            cPickle.dump( self.entries.items(), f, 2 )
+        finally:
+            f.close()
+        os.rename( tmp, self.path )
@@ -0,0 +1,207 @@
+"""
+MPE:
+    Most probable explanations of evidence, and maximum a posteriori
+    values of chosen variables, by max-product variable elimination in log
+    space with a local search fallback for networks too wide to eliminate
+"""
+
+import time
+
+import numpy
+
+from factors import Factor
+from algos import interactionGraph, eliminationOrder, eliminate
+from sampling import GibbsSampler
+from prune import ancestral
+
+def logFactors( net, evidence ):
+    """Log CPTs of every variable, reduced by the evidence"""
+    factors = []
+    with numpy.errstate( divide='ignore' ):
+        for node in net.variables.values():
+            factor = Factor.fromNode( node, evidence )
+            factors.append( Factor( factor.variables, numpy.log( factor.table ) ) )
+    return factors
+
+def logProduct( factors ):
+    """Product of log factors, as a sum"""
+    variables = []
+    for f in factors:
+        variables += [ v for v in f.variables if v not in variables ]
+    table = numpy.zeros( [ 1 ] * len( variables ) )
+    for f in factors:
+        table = table + f.expand( variables )
+    return Factor( variables, table )
+
+def logSumOut( factor, var ):
+    """Sum a variable out of a log factor"""
+    axis = factor.variables.index( var )
+    top = factor.table.max( axis=axis )
+    shift = numpy.where( numpy.isfinite( top ), top, 0 )
+    with numpy.errstate( divide='ignore' ):
+        table = numpy.log( numpy.exp( factor.table - numpy.expand_dims( shift, axis ) ).sum( axis=axis ) ) + shift
+    return Factor( [ v for v in factor.variables if v != var ], table )
+
+def maxOut( factor, var ):
+    """Max a variable out of a log factor. Returns the factor, and the
+    best value index of var for every value of the rest"""
+    axis = factor.variables.index( var )
+    rest = [ v for v in factor.variables if v != var ]
+    return Factor( rest, factor.table.max( axis=axis ) ), Factor( rest, factor.table.argmax( axis=axis ) )
+
+def width( graph, order, cards ):
+    """Most states of a factor made when eliminating in order"""
+    graph = dict( [ ( var, set( nbrs ) ) for var, nbrs in graph.items() ] )
+    most = 1
+    for var in order:
+        states = cards[ var ]
+        for u in eliminate( graph, var ):
+            states *= cards[ u ]
+        most = max( most, states )
+    return most
+
+def eliminateAll( net, ctx, queries, heuristic, maxStates ):
+    """
+    Sum out the variables that are not queried, then max out the queried
+    ones, keeping their argmax tables for the traceback
+    Returns the assignment of the queried variables and its log
+    probability, or None if some factor would exceed maxStates
+    """
+    evidence = ctx.getIndices()
+    factors = logFactors( net, evidence )
+    hidden = [ id for id in net.variables if id not in evidence and id not in queries ]
+    queries = [ id for id in queries if id not in evidence ]
+
+    # Summed variables go first, so the maximization is over their
+    # marginal
+    graph = interactionGraph( [ f.variables for f in factors ] )
+    for id in hidden + queries:
+        graph.setdefault( id, set() )
+    first = eliminationOrder( graph, hidden, heuristic )
+    rest = dict( [ ( var, set( nbrs ) ) for var, nbrs in graph.items() ] )
+    for var in first:
+        eliminate( rest, var )
+    order = first + eliminationOrder( rest, queries, heuristic )
+
+    cards = dict( [ ( id, len( net.get( id ).values ) ) for id in net.variables ] )
+    if maxStates is not None and width( graph, order, cards ) > maxStates:
+        return None
+
+    tracebacks = []
+    maxed = set( queries )
+    for var in order:
+        bucket = [ f for f in factors if var in f.variables ]
+        factors = [ f for f in factors if var not in f.variables ]
+        product = logProduct( bucket )
+        if var in maxed:
+            product, best = maxOut( product, var )
+            tracebacks.append( ( var, best ) )
+        else:
+            product = logSumOut( product, var )
+        factors.append( product )
+    logp = float( sum( [ f.table.sum() for f in factors ] ) )
+    if logp == -numpy.inf:
+        raise ZeroDivisionError( "The evidence is impossible" )
+
+    # Variables maxed out later are assigned first
+    assignment = {}
+    for var, best in reversed( tracebacks ):
+        assignment[ var ] = int( best.table[ tuple( [ assignment[ v ] for v in best.variables ] ) ] )
+    return assignment, logp
+
+def result( net, ctx, assignment, logp, exact ):
+    values = dict( [ ( id, net.get( id ).values[ v ] ) for id, v in assignment.items() ] )
+    for id, v in ctx.getVariables().items():
+        values[ id ] = v
+    return { 'assignment' : values, 'logp' : logp, 'exact' : exact }
+
+def mpe( net, ctx, heuristic='minfill', maxStates=2**22, **search ):
+    """
+    Most probable assignment of every variable given the evidence
+    @heuristic - elimination ordering heuristic
+    @maxStates - largest factor elimination may build; wider networks go
+        to localSearch, with the remaining keyword arguments
+    Returns a dict with the 'assignment' of id to value, including the
+    evidence, its 'logp', the log of Pr( assignment ), and whether the
+    answer is 'exact'. Raises ZeroDivisionError if elimination finds the
+    evidence impossible
+    """
+    answer = eliminateAll( net, ctx, net.variables.keys(), heuristic, maxStates )
+    if answer is None:
+        return localSearch( net, ctx, **search )
+    return result( net, ctx, answer[ 0 ], answer[ 1 ], True )
+
+def mapQuery( net, ctx, variables, heuristic='minfill', maxStates=2**22, **search ):
+    """
+    Most probable values of some variables given the evidence, with the
+    others summed out
+    @variables - ids of the variables to assign
+    Returns a dict as for mpe, whose 'logp' is the log of
+    Pr( assignment, evidence ) and 'assignment' covers the variables and
+    the evidence. When elimination is too wide this is the restriction of
+    a local search for the MPE, and not exact
+    """
+    # Barren variables sum to 1, so dropping them leaves the joint as it was
+    sub, subctx = ancestral( net, ctx, variables )
+    answer = eliminateAll( sub, subctx, variables, heuristic, maxStates )
+    if answer is None:
+        found = localSearch( net, ctx, **search )
+        keep = set( variables ) | set( ctx.getVariables() )
+        found[ 'assignment' ] = dict( [ ( id, v ) for id, v in found[ 'assignment' ].items() if id in keep ] )
+        return found
+    return result( sub, subctx, answer[ 0 ], answer[ 1 ], True )
+
+def logScore( net, sampler ):
+    """Log Pr of the state of every chain of a sampler"""
+    score = numpy.zeros( sampler.chains )
+    with numpy.errstate( divide='ignore' ):
+        for id in sampler.ids:
+            node = net.get( id )
+            family = [ sampler.pos[ v ] for v in node.parents + ( id, ) ]
+            score += numpy.log( node.cpt[ tuple( sampler.state[ :, family ].T ) ] )
+    return score
+
+def localSearch( net, ctx, restarts=16, sweeps=200, temperature=1.0, cooling=0.95, blocks='family', timeLimit=None, seed=None ):
+    """
+    Anytime approximate MPE by simulated annealing over Gibbs sweeps, from
+    several random starts at once, finishing with greedy sweeps. The best
+    assignment seen is kept, so stopping early still gives an answer
+    @restarts - chains searched side by side
+    @sweeps - most annealing sweeps
+    @temperature, @cooling - starting temperature, and the factor it
+        drops by every sweep
+    @blocks - blocking of the sweeps, as for GibbsSampler
+    @timeLimit - seconds to stop after, if given
+    Returns a dict as for mpe
+    """
+    start = time.time()
+    sampler = GibbsSampler( net, ctx, restarts, seed, blocks )
+
+    def keep( best, bestScore ):
+        score = logScore( net, sampler )
+        c = score.argmax()
+        if score[ c ] > bestScore or best is None:
+            return sampler.state[ c, :-1 ].copy(), score[ c ]
+        return best, bestScore
+
+    # The random starts count as seen, so there is an answer even with no
+    # annealing sweeps
+    best, bestScore = keep( None, -numpy.inf )
+
+    for s in xrange( sweeps ):
+        sampler.sweep( temperature * cooling ** s )
+        best, bestScore = keep( best, bestScore )
+        if timeLimit is not None and time.time() - start > timeLimit:
+            break
+
+    # Climb to a local optimum from the best state seen
+    sampler.state[:, :-1] = best
+    while True:
+        sampler.sweep( 0 )
+        before = bestScore
+        best, bestScore = keep( best, bestScore )
+        if bestScore <= before:
+            break
+
+    assignment = dict( [ ( id, int( best[ i ] ) ) for i, id in enumerate( sampler.ids ) if i not in sampler.evidence ] )
+    return result( net, ctx, assignment, float( bestScore ), False )
@@ -0,0 +1,161 @@
+"""
+Netfile:
+    Compact binary form of parsed networks, loaded by memory mapping the
+    CPT arrays, and used as a cache next to the source file.
+
+    Layout:
+        MAGIC
+        header length, as a little endian uint64
+        header, a pickled dict; see write(). Compact CPTs are pickled
+            in it whole
+        padding to a multiple of 8 bytes
+        every dense CPT, as little endian float64, end to end
+"""
+
+import cPickle
+import hashlib
+import os
+import struct
+
+import numpy
+
+from BNet import BNet, BNode
+from cpts import isCompact
+
+MAGIC = 'BNETC\x00\x02\x00'
+EXTENSION = '.bnc'
+DTYPE = numpy.dtype( '<f8' )
+
+def fingerprint( fname ):
+    """( mtime, size, sha1 ) of a file"""
+    st = os.stat( fname )
+    f = open( fname, 'rb' )
+    try:
+        sha1 = hashlib.sha1()
+        for block in iter( lambda: f.read( 1 << 20 ), '' ):
+            sha1.update( block )
+    finally:
+        f.close()
+    return ( st.st_mtime, st.st_size, sha1.hexdigest() )
+
+def write( fname, batch, source=None ):
+    """
+    Write networks to a file
+    @batch - list of ( net, queries ), as from BNetParser.parseBatch
+    @source - fingerprint of the file the networks were parsed from
+    """
+    nets = []
+    arrays = []
+    offset = 0
+    for net, queries in batch:
+        order = net.topologicalOrder()
+        position = dict( [ ( id, i ) for i, id in enumerate( order ) ] )
+        nodes = []
+        for id in order:
+            node = net.get( id )
+            parents = [ position[ p ] for p in node.parents ]
+            if isCompact( node.cpt ):
+                nodes.append( ( id, node.values, node.attrs, parents, node.cpt.shape, node.cpt ) )
+                continue
+            nodes.append( ( id, node.values, node.attrs, parents, node.cpt.shape, offset ) )
+            arrays.append( node.cpt )
+            offset += node.cpt.size
+        nets.append( ( nodes, queries ) )
+
+    header = cPickle.dumps( { 'source' : source, 'nets' : nets, 'size' : offset }, 2 )
+    start = len( MAGIC ) + 8 + len( header )
+    padding = -start % DTYPE.itemsize
+
+    # Write to a temporary file first, so readers never see half a file
+    tmp = fname + '.tmp%d'%( os.getpid() )
+    f = open( tmp, 'wb' )
+    try:
+        f.write( MAGIC )
+        f.write( struct.pack( '<Q', len( header ) ) )
+        f.write( header )
+        f.write( '\0' * padding )
+        for cpt in arrays:
+            f.write( numpy.ascontiguousarray( cpt, dtype=DTYPE ).tostring() )
+    finally:
+        f.close()
+    os.rename( tmp, fname )
+
+def readHeader( fname ):
+    """The header of a network file, and the offset of the CPT block"""
+    f = open( fname, 'rb' )
+    try:
+        if f.read( len( MAGIC ) ) != MAGIC:
+            raise ValueError( "%s is not a network file"%( fname ) )
+        size = f.read( 8 )
+        if len( size ) < 8:
+            raise ValueError( "%s is truncated"%( fname ) )
+        size, = struct.unpack( '<Q', size )
+        header = cPickle.loads( f.read( size ) )
+    finally:
+        f.close()
+    start = len( MAGIC ) + 8 + size
+    return header, start + ( -start % DTYPE.itemsize )
+
+def read( fname ):
+    """
+    Read networks from a file. The CPTs are copy-on-write views of one
+    memory map of the file, so nothing is copied until written
+    Returns a list of ( net, queries )
+    """
+    header, start = readHeader( fname )
+    if header[ 'size' ]:
+        block = numpy.memmap( fname, dtype=DTYPE, mode='c', offset=start, shape=( header[ 'size' ], ) )
+    else:
+        block = numpy.zeros( 0 )
+
+    batch = []
+    for nodes, queries in header[ 'nets' ]:
+        net = BNet()
+        # The last field is the offset of a dense CPT in the block, or a
+        # compact one
+        for id, values, attrs, parents, shape, cpt in nodes:
+            parents = [ nodes[ p ][ 0 ] for p in parents ]
+            parentValues = [ net.get( p ).values for p in parents ]
+            if not isCompact( cpt ):
+                cpt = block[ cpt : cpt + int( numpy.prod( shape ) ) ].reshape( shape )
+            net.add( BNode( id, parents, attrs, values, parentValues=parentValues, cpt=cpt ) )
+        batch.append( ( net, queries ) )
+    return batch
+
+def save( net, fname ):
+    """Write a single network"""
+    write( fname, [ ( net, [] ) ] )
+
+def load( fname ):
+    """Read the first network of a file"""
+    return read( fname )[ 0 ][ 0 ]
+
+def cachePath( source ):
+    return source + EXTENSION
+
+def loadCached( source, parse ):
+    """
+    Networks of a source file, read from the cache next to it when that is
+    up to date, and otherwise parsed and cached
+    @parse - function from a file name to a list of ( net, queries )
+    """
+    cache = cachePath( source )
+    st = os.stat( source )
+    try:
+        header, _ = readHeader( cache )
+        mtime, size, sha1 = header[ 'source' ]
+        if ( mtime, size ) == ( st.st_mtime, st.st_size ) or \
+                ( size == st.st_size and sha1 == fingerprint( source )[ 2 ] ):
+            return read( cache )
+    except ( IOError, OSError, ValueError, TypeError, EOFError, cPickle.UnpicklingError ):
+        pass
+
+    current = fingerprint( source )
+    batch = parse( source )
+    if batch:
+        try:
+            write( cache, batch, current )
+        except ( IOError, OSError ):
+            # Read only directory; go without the cache
+            pass
+    return batch
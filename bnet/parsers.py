@@ -3,25 +3,109 @@ bnet.parsers:
     Parses various Bayesian Network formats to construct a BNet
 """
 
-import operator
 from exceptions import *
 from BNet import *
-from pyparsing import *
+import instrument
+import cpts
+
+import re
+from cStringIO import StringIO
+
+import numpy
+
+class ParseException( Exception ):
+    """Error in the input, at the given line and column if known"""
+
+    def __init__( self, msg, line=None, col=None ):
+        if line is not None:
+            msg = "%s (line %d, col %d)"%( msg, line, col )
+        Exception.__init__( self, msg )
+        self.line = line
+        self.col = col
+
+def formatOf( fname ):
+    """
+    Format of a network file, 'bif' or 'ravi'; from the extension if it is
+    known, and otherwise from the first word that is not a comment
+    """
+    ext = fname.rsplit( '.', 1 )[-1].lower()
+    if ext in ( 'bif', 'bnif' ):
+        return 'bif'
+    elif ext == 'ravi':
+        return 'ravi'
+
+    f = open( fname, 'r' )
+    try:
+        inComment = False
+        for line in f:
+            if inComment:
+                if '*/' not in line:
+                    continue
+                line = line.split( '*/', 1 )[1]
+                inComment = False
+            line = line.split( '//', 1 )[0]
+            if line.lstrip().startswith( '/*' ):
+                inComment = '*/' not in line
+                line = line.split( '*/', 1 )[-1] if not inComment else ''
+            words = line.split()
+            if words:
+                return 'bif' if words[0] == 'network' else 'ravi'
+    finally:
+        f.close()
+    raise ParseException( "%s holds no network"%( fname ) )
+
+def parserFor( fname ):
+    """Parser for a network file"""
+    return { 'bif' : BNIFParser, 'ravi' : RaviParser }[ formatOf( fname ) ]()
 
 class BNetParser():
     """
     Generic BNetParser
+
+    Tables that read as noisy-MAX, deterministic or context-specific are
+    stored compactly; see cpts.compress. Set compress to False to keep
+    every table dense
     """
+
+    compress = True
+    tolerance = 1e-9
+
+    def compact( self, cpt ):
+        """The table in compact form, if it has one and compress is set"""
+        if not self.compress:
+            return cpt
+        result = cpts.compress( cpt, self.tolerance )
+        if cpts.isCompact( result ):
+            instrument.count( 'compressed cpts' )
+        return result
+
     def parse( self, str ):
         """ Parse a file. Should be overwritten """
         raise NotImplementedError 
 
     def parseFile( self, fname ):
-        f = open( fname, 'r' )
-        str = f.read()
-        f.close()
+        with instrument.phase( 'parse' ):
+            f = open( fname, 'r' )
+            str = f.read()
+            f.close()
+
+            return self.parse( str )
+
+    def parseBatch( self, str ):
+        """
+        Parse a file into a list of ( net, queries ), where queries is a
+        list of ( evidence, [ query variables ] ). Formats without queries
+        give one network with none
+        """
+        return [ ( self.parse( str ), [] ) ]
+
+    def parseBatchFile( self, fname ):
+        with instrument.phase( 'parse' ):
+            f = open( fname, 'r' )
+            str = f.read()
+            f.close()
 
-        return self.parse( str )
+            return self.parseBatch( str )
 
 class RaviParser( BNetParser ):
     """
@@ -41,6 +125,12 @@ class RaviParser( BNetParser ):
     table:
         (parentValues* float)+   // list of parent values followed by the
                                  // probablity values
+
+    A file may hold several networks, each followed by its queries:
+
+    queries:
+        ( "E" (int ("t"|"f"))* // evidence setting
+          ("Q" int)* )*        // variables to query under that evidence
     """
 
     def __init__( self ):
@@ -62,9 +152,59 @@ class RaviParser( BNetParser ):
     def parse( self, str ):
         self.tokenise( str )
         self.idx = 0
+        self.skip()
         n = self.network( )
         return n
 
+    def parseBatch( self, str ):
+        self.tokenise( str )
+        self.idx = 0
+        batch = []
+        self.skip()
+        while self.idx < len( self.tokens ):
+            net = self.network( )
+            batch.append( ( net, self.queries( ) ) )
+            self.skip()
+        return batch
+
+    def skip( self ):
+        """Skip empty lines and comments"""
+        while self.idx < len( self.tokens ):
+            if self.tokens[ self.idx ] in ( '', '\n' ):
+                self.idx += 1
+            elif self.tokens[ self.idx ].startswith( "//" ):
+                self.comment()
+            else:
+                break
+
+    def truth( self ):
+        if self.tokens[ self.idx ] in ( 't', 'f' ):
+            self.idx += 1
+            return self.tokens[ self.idx-1 ] == 't'
+        else:
+            raise ParseException( "Expected 't' or 'f'" ) 
+
+    def queries( self ):
+        """Evidence settings, each with the variables queried under it"""
+        batch = []
+        self.skip()
+        while self.idx < len( self.tokens ) and self.tokens[ self.idx ] in ( 'E', 'Q' ):
+            if self.tokens[ self.idx ] == 'E':
+                self.idx += 1
+                evidence = {}
+                for id, val in self.listOf( lambda: ( self.integer(), self.truth() ) ):
+                    evidence[ id ] = val
+                batch.append( ( evidence, [] ) )
+            else:
+                self.idx += 1
+                if not batch:
+                    batch.append( ( {}, [] ) )
+                batch[-1][1].append( self.integer() )
+            self.comment()
+            self.newline()
+            self.skip()
+        return batch
+
     def bools( self ):
         try: 
             n = int( self.tokens[ self.idx ] )
@@ -142,12 +282,17 @@ class RaviParser( BNetParser ):
             parents = self.listOf( self.integer )
         self.comment()
         self.newline()
-        ptable = dict( self.table( ) )
+
+        # Values are ordered (True, False), so the index of a value is
+        # int( not value )
+        cpt = numpy.zeros( ( 2, ) * len( parents ) + ( 2, ) )
+        for pVals, prs in self.table( ):
+            cpt[ tuple( [ int( not v ) for v in pVals ] ) ] = prs
         self.keyword( '}' )
 
         values = [True, False]
 
-        return BNode( id, parents, (id,), values, ptable )
+        return BNode( id, parents, (id,), values, parentValues=[ values ] * len( parents ), cpt=self.compact( cpt ) )
 
     def network( self ):
         n = self.integer( )
@@ -204,9 +349,9 @@ class BNIFParser( BNetParser ):
     ProbabilityVariablesList() :
        "("  ProbabilityVariableName() ( ProbabilityVariableName()   )* ")"
 
-    ProbabilityVariableName() : 
+    ProbabilityVariableName() : WORD
 
-    ProbabilityContent()
+    ProbabilityContent() :
       "{" ( Property() | ProbabilityDefaultEntry()   | ProbabilityEntry()   |
           ProbabilityTable()  )* "}"
 
@@ -217,101 +362,232 @@ class BNIFParser( BNetParser ):
        "(" ProbabilityVariableValue() ( ProbabilityVariableValue()   )* ")"
 
     ProbabilityDefaultEntry() :
-       FloatingPointList() ";"
+       ( DEFAULT )? FloatingPointList() ";"
 
     ProbabilityTable() :
-       FloatingPointList() ";"
+       TABLE FloatingPointList() ";"
 
     FloatingPointList() :
       FloatingPointToken()  ( FloatingPointToken()  )*
 
-    FloatingPointToken() :  
+    FloatingPointToken() : WORD
+
+    Property() : PROPERTY (~[";"])* ";"
 
-    Property() :  
+    The input is read a line at a time, and each block is turned into a
+    CPT array as soon as it is read.
     """
 
-    def __init__( self ):
-        self.debug = False
-        pass
+    # Single character tokens
+    PUNCTUATION = '{}()[];,|'
+    WORD = re.compile( r'[^\s{}()\[\];,|/]+' )
+
+    def tokens( self, f ):
+        """Generate the ( token, line, col ) of a stream, one line at a time"""
+        inComment = False
+        line = 0
+        for line, text in enumerate( f, 1 ):
+            col = 0
+            while col < len( text ):
+                if inComment:
+                    end = text.find( '*/', col )
+                    if end < 0:
+                        break
+                    inComment = False
+                    col = end + 2
+                elif text[ col ].isspace():
+                    col += 1
+                elif text.startswith( '//', col ):
+                    break
+                elif text.startswith( '/*', col ):
+                    inComment = True
+                    col += 2
+                elif text[ col ] in self.PUNCTUATION:
+                    yield text[ col ], line, col+1
+                    col += 1
+                else:
+                    m = self.WORD.match( text, col )
+                    if not m:
+                        raise ParseException( "Unexpected character '%s'"%( text[ col ] ), line, col+1 )
+                    yield m.group(), line, col+1
+                    col = m.end()
+        yield None, line, 0
 
     def parse( self, inp ):
-        net = BNet()
+        return self.parseStream( StringIO( inp ) )
+
+    def parseFile( self, fname ):
+        with instrument.phase( 'parse' ):
+            f = open( fname, 'r' )
+            try:
+                return self.parseStream( f )
+            finally:
+                f.close()
+
+    def parseBatchFile( self, fname ):
+        """BIF files hold one network and no queries; streamed like
+        parseFile"""
+        return [ ( self.parseFile( fname ), [] ) ]
 
-        NETWORK = Keyword( "network" ).suppress()
-        VARIABLE = Keyword( "variable" ).suppress()
-        PROBABILITY = Keyword( "probability" ).suppress()
-        PROPERTY = Keyword( "property" ).suppress()
-        VARIABLETYPE = Keyword( "type" ).suppress()
-        DISCRETE = Keyword( "discrete" ).suppress()
-        DEFAULTVALUE = Keyword( "default" ).suppress()
-        TABLEVALUES = Keyword( "table" ).suppress()
-
-        LBRAC = Literal( '(' ).suppress()
-        RBRAC = Literal( ')' ).suppress()
-        LCURL = Literal( '{' ).suppress()
-        RCURL = Literal( '}' ).suppress()
-        LSQUA = Literal( '[' ).suppress()
-        RSQUA = Literal( ']' ).suppress()
-        SEMI = Literal( ';' ).suppress()
-        ORSEP = Literal( '|' ).suppress()
-
-        identifier = Word( alphas, alphanums )
-        identifier.setName( 'identifier' )
-
-        property = PROPERTY + OneOrMore( ~( SEMI ) ) + SEMI
-        property.setName( 'property' )
-
-        number = Word( nums )
-        number.setName( 'number' )
-        number.setParseAction( lambda s,l,t: [ int( t[ 0 ] ) ] )
-
-        real = Combine( number + '.' + number )
-        real.setName( 'real' )
-        real.setParseAction( lambda s,l,t: [ float( t[ 0 ] ) ] )
-
-        value = identifier
-        variable_values = Group( delimitedList( value ) )
-        
-        prEntry = LBRAC + variable_values + RBRAC + Group( delimitedList( real ) ) + SEMI
-        prEntry.setName( 'prEntry' )
-        prEntry.setParseAction( lambda s,l,t: [ ( tuple( t[0] ), tuple( t[1] ) ) ] )
-
-        defaultPrEntry = Group( delimitedList( real ) ) + SEMI
-        defaultPrEntry.setName( 'defaultPrEntry' )
-        defaultPrEntry.setParseAction( lambda s,l,t: [ tuple( t[0] ) ] )
-
-        prTable = TABLEVALUES + Group( delimitedList( real ) ) + SEMI
-        prTable.setName( 'prTable' )
-        prTable.setParseAction( lambda s,l,t: [ ((), tuple( t[0] )) ] )
-
-        condVars = LBRAC + Group( identifier + Optional( ORSEP + delimitedList( identifier ) ) ) + RBRAC
-        condVars.setName( 'condVars' )
-
-        probability = PROBABILITY + condVars + LCURL + Group( ZeroOrMore( property ) ) + Group( ZeroOrMore( defaultPrEntry | prEntry | prTable ) ) + RCURL
-        probability.setName( 'probability' )
-        probability.addParseAction( lambda s,l,t: net.get( t[0][0] ).setTable( t[2] ) )
-        probability.addParseAction( lambda s,l,t: ( net.get( t[ 0 ][0] ).setParents( t[0][1:] ) ) if len( t[0] ) > 1 else False )
-
-        variable_discrete = VARIABLETYPE + DISCRETE + LSQUA + number + RSQUA + LCURL + variable_values + RCURL + SEMI
-        variable_discrete.setName( 'variable_discrete' )
-        variable_discrete.setParseAction( lambda s,l,t : [ t[ 1 ] ] )
-
-        variable = VARIABLE + identifier + LCURL + ZeroOrMore( property | variable_discrete ) + RCURL
-        variable.setName( 'variable' )
-        variable.addParseAction( lambda s,l,t : net.add( BNode( t[ 0 ], values = map( str, t[1] ) )) ) 
-        variable.addParseAction( lambda s,l,t : [] ) 
-
-        network = NETWORK + identifier + LCURL + Group( ZeroOrMore( property ) ) + RCURL
-        network.setName( 'name' )
-        toplevel = network + ZeroOrMore( variable | probability )
-        toplevel.setName( 'toplevel' )
-
-        if self.debug:
-            for elem in [ value, variable_values, prEntry, defaultPrEntry, prTable, condVars,
-                    probability, variable_discrete, variable, network, toplevel ]:
-                elem.setDebug()
-
-        toplevel.parseString( inp )
-        
+    def parseStream( self, f ):
+        """Parse a network from a file object in a single pass"""
+        self.stream = self.tokens( f )
+        self.advance()
+
+        net = BNet()
+        self.network( )
+        while self.tok is not None:
+            if self.tok == 'variable':
+                net.add( self.variable() )
+            elif self.tok == 'probability':
+                self.probability( net )
+            else:
+                self.error( "Expected 'variable' or 'probability'" )
         return net
 
+    def advance( self ):
+        self.tok, self.line, self.col = self.stream.next()
+
+    def error( self, msg ):
+        if self.tok is None:
+            msg += ", found end of input"
+        else:
+            msg += ", found '%s'"%( self.tok )
+        raise ParseException( msg, self.line, self.col )
+
+    def keyword( self, k ):
+        if self.tok != k:
+            self.error( "Expected '%s'"%( k ) )
+        self.advance()
+
+    def word( self ):
+        if self.tok is None or self.tok in self.PUNCTUATION:
+            self.error( "Expected a name" )
+        tok = self.tok
+        self.advance()
+        return tok
+
+    def real( self ):
+        try:
+            r = float( self.tok )
+        except ( TypeError, ValueError ):
+            self.error( "Expected a number" )
+        self.advance()
+        return r
+
+    def listOf( self, expr, end ):
+        """Items up to the end token, optionally separated by commas"""
+        items = [ expr() ]
+        while self.tok != end:
+            if self.tok == ',':
+                self.advance()
+            items.append( expr() )
+        return items
+
+    def property( self ):
+        self.keyword( 'property' )
+        while self.tok != ';':
+            if self.tok is None:
+                self.error( "Expected ';'" )
+            self.advance()
+        self.advance()
+
+    def network( self ):
+        self.keyword( 'network' )
+        if self.tok != '{':
+            self.word()
+        self.keyword( '{' )
+        while self.tok == 'property':
+            self.property()
+        self.keyword( '}' )
+
+    def variable( self ):
+        self.keyword( 'variable' )
+        id = self.word()
+        values = None
+        self.keyword( '{' )
+        while self.tok != '}':
+            if self.tok == 'property':
+                self.property()
+                continue
+            self.keyword( 'type' )
+            self.keyword( 'discrete' )
+            self.keyword( '[' )
+            line, col = self.line, self.col
+            n = int( self.real() )
+            self.keyword( ']' )
+            self.keyword( '{' )
+            values = self.listOf( self.word, '}' )
+            self.keyword( '}' )
+            self.keyword( ';' )
+            if len( values ) != n:
+                raise ParseException( "%s declares %d values, but lists %d"%( id, n, len( values ) ), line, col )
+        self.keyword( '}' )
+        if values is None:
+            self.error( "Expected a type for %s"%( id ) )
+        return BNode( id, values=values )
+
+    def probability( self, net ):
+        self.keyword( 'probability' )
+        self.keyword( '(' )
+        line, col = self.line, self.col
+        names = [ self.word() ]
+        if self.tok == '|':
+            self.advance()
+        if self.tok != ')':
+            names += self.listOf( self.word, ')' )
+        self.keyword( ')' )
+
+        try:
+            net.setParents( names[0], names[1:] )
+        except KeyError, e:
+            raise ParseException( "Undeclared variable %s"%( e ), line, col )
+        node = net.get( names[0] )
+        cpt = numpy.zeros( node.shape() )
+        rows = []
+
+        self.keyword( '{' )
+        while self.tok != '}':
+            line, col = self.line, self.col
+            if self.tok == 'property':
+                self.property()
+                continue
+            elif self.tok == '(':
+                self.advance()
+                key = self.listOf( self.word, ')' )
+                self.advance()
+                if len( key ) != len( node.parents ):
+                    raise ParseException( "Expected values for %d parents"%( len( node.parents ) ), line, col )
+                try:
+                    key = node.rowIndex( key )
+                except KeyError, e:
+                    raise ParseException( "Unknown value %s"%( e ), line, col )
+            elif self.tok == 'table':
+                self.advance()
+                key = 'table'
+            else:
+                if self.tok == 'default':
+                    self.advance()
+                key = None
+            prs = self.listOf( self.real, ';' )
+            self.advance()
+
+            if key == 'table':
+                if len( prs ) != cpt.size:
+                    raise ParseException( "Expected %d probabilities"%( cpt.size ), line, col )
+                # Whole table, with the variable varying slowest
+                prs = numpy.reshape( prs, ( len( node.values ), ) + cpt.shape[:-1] )
+                cpt[...] = numpy.rollaxis( prs, 0, prs.ndim )
+            else:
+                if len( prs ) != len( node.values ):
+                    raise ParseException( "Expected %d probabilities"%( len( node.values ) ), line, col )
+                if key is None:
+                    # Default entry; fills every row not given explicitly
+                    cpt[...] = prs
+                else:
+                    rows.append( ( key, prs ) )
+        self.advance()
+
+        for key, prs in rows:
+            cpt[ key ] = prs
+        node.setCPT( self.compact( cpt ) )
@@ -0,0 +1,129 @@
+"""
+Prune:
+    Cut a network down to the part that matters to a query, before
+    inference
+"""
+
+import numpy
+
+import BNet
+import instrument
+
+def ancestors( net, ids ):
+    """The given variables and all their ancestors"""
+    graph = net.structure()
+    mask = graph.ancestors( [ graph.index[ id ] for id in ids ] )
+    return set( [ graph.ids[ i ] for i in mask.nonzero()[ 0 ].tolist() ] )
+
+def ancestral( net, ctx, ids ):
+    """
+    Network of the given variables, the evidence and all their ancestors,
+    sharing nodes with net. Unlike prune, the joint probability of any
+    assignment to these variables and the evidence is unchanged
+    Returns the network and a context on it with the evidence
+    """
+    evidence = ctx.getVariables()
+    keep = ancestors( net, list( ids ) + evidence.keys() )
+    sub = BNet.BNet()
+    for id in net.topologicalOrder():
+        if id in keep:
+            sub.add( net.get( id ) )
+    subctx = BNet.Context( sub )
+    for id, value in evidence.items():
+        subctx.setVariable( id, value )
+    return sub, subctx
+
+def relevant( net, ctx, query ):
+    """
+    Variables needed to answer a query under the evidence of a context.
+    Barren variables, which are ancestors of neither the query nor the
+    evidence, are left out. So is everything cut off from the query by
+    the evidence once evidence variables lose their outgoing edges, in
+    the moral graph of what remains
+    @query - variable, or list of them
+    """
+    if not isinstance( query, ( list, tuple, set ) ):
+        query = [ query ]
+    evidence = ctx.getVariables()
+    graph = net.structure()
+    index = graph.index
+    keep = graph.ancestors( [ index[ id ] for id in list( query ) + evidence.keys() ] )
+    observed = numpy.zeros( len( graph ), dtype=bool )
+    observed[ [ index[ id ] for id in evidence ] ] = True
+
+    found = numpy.zeros( len( graph ), dtype=bool )
+    stack = [ index[ q ] for q in query if q not in evidence ]
+    found[ stack ] = True
+    while stack:
+        var = stack.pop()
+        # Moral graph of the kept variables: barren children are gone, and
+        # do not join their parents
+        children = [ c for c in graph.childrenOf( var ).tolist() if keep[ c ] ]
+        near = graph.parentsOf( var ).tolist() + children
+        for c in children:
+            near += graph.parentsOf( c ).tolist()
+        children = set( children )
+        for u in near:
+            # Evidence is reached as a child, and never passed through
+            if found[ u ] or not keep[ u ] or ( observed[ u ] and u not in children ):
+                continue
+            found[ u ] = True
+            if not observed[ u ]:
+                stack.append( u )
+    return set( [ graph.ids[ i ] for i in found.nonzero()[ 0 ].tolist() ] )
+
+def prune( net, ctx, query ):
+    """
+    Smallest network giving the same posterior of a query: only the
+    relevant variables, with the evidence on the parents of each absorbed
+    into its CPT. Nodes that need no change are shared with net, and the
+    CPTs of the others are views of the originals
+    @query - variable, or list of them
+    Returns the network and a context on it with the evidence that is
+    left
+    """
+    with instrument.phase( 'prune' ):
+        if not isinstance( query, ( list, tuple, set ) ):
+            query = [ query ]
+        evidence = ctx.getVariables()
+        indices = ctx.getIndices()
+        found = relevant( net, ctx, query )
+
+        nodes = {}
+        for id in found:
+            node = net.get( id )
+            if not [ p for p in node.parents if p in evidence ]:
+                nodes[ id ] = node
+                continue
+            rows = tuple( [ indices[ p ] if p in evidence else slice( None ) for p in node.parents ] )
+            parents = [ ( p, values ) for p, values in zip( node.parents, node.parentValues ) if p not in evidence ]
+            nodes[ id ] = BNet.BNode( id, [ p for p, _ in parents ], node.attrs, node.values,
+                    parentValues=[ values for _, values in parents ], cpt=node.cpt[ rows ] )
+
+        # Queried evidence not otherwise needed is answered by a point mass
+        for id in query:
+            if id in evidence and id not in found:
+                node = net.get( id )
+                cpt = [ float( i == indices[ id ] ) for i in range( len( node.values ) ) ]
+                nodes[ id ] = BNet.BNode( id, (), node.attrs, node.values, cpt=cpt )
+
+        # Add parents before children
+        sub = BNet.BNet()
+        for id in nodes:
+            stack = [ ( id, False ) ]
+            while stack:
+                var, expanded = stack.pop()
+                if var in sub.variables:
+                    continue
+                if expanded:
+                    sub.add( nodes[ var ] )
+                else:
+                    stack.append( ( var, True ) )
+                    stack.extend( [ ( p, False ) for p in nodes[ var ].parents if p not in sub.variables ] )
+
+        subctx = BNet.Context( sub )
+        for id in nodes:
+            if id in evidence:
+                subctx.setVariable( id, evidence[ id ] )
+        instrument.count( 'pruned variables', len( net.variables ) - len( sub.variables ) )
+    return sub, subctx
@@ -0,0 +1,111 @@
+"""
+Rng:
+    Seedable random number streams for the samplers, drawing uniform
+    variates from numpy in blocks rather than one Python call at a time
+"""
+
+import numpy
+
+class RandomStream( object ):
+    """
+    Stream of uniform variates on [0, 1) from a RandomState of its own,
+    drawn ahead in blocks. Streams with the same seed give the same
+    numbers for the same calls, and spawn() gives independent children
+    for chains or worker processes
+    """
+
+    def __init__( self, seed=None, block=4096 ):
+        """
+        @seed - int seed; None seeds from the operating system
+        @block - uniforms drawn ahead at a time
+        """
+        self.random = numpy.random.RandomState( seed )
+        self.block = block
+        self.buffer = numpy.empty( 0 )
+        self.at = 0
+
+    def refill( self, n=0 ):
+        """Draw a new block, keeping the unused rest of the old one, with
+        room for at least n uniforms"""
+        rest = self.buffer[ self.at: ]
+        fresh = self.random.random_sample( max( self.block, n - len( rest ) ) )
+        self.buffer = numpy.concatenate( ( rest, fresh ) ) if len( rest ) else fresh
+        self.at = 0
+
+    def uniform( self ):
+        if self.at == len( self.buffer ):
+            self.refill()
+        u = self.buffer[ self.at ]
+        self.at += 1
+        return u
+
+    def random_sample( self, size=None ):
+        """Uniforms as an array of the given shape, or one if None"""
+        if size is None:
+            return self.uniform()
+        n = int( numpy.prod( size ) )
+        if self.at + n > len( self.buffer ):
+            self.refill( n )
+        u = self.buffer[ self.at : self.at + n ].reshape( size )
+        self.at += n
+        return u
+
+    def randint( self, high, size=None ):
+        """Integers in [0, high), one or an array of the given shape"""
+        if size is None:
+            return int( self.uniform() * high )
+        return ( self.random_sample( size ) * high ).astype( int )
+
+    def choice( self, items ):
+        """An item of a sequence, chosen uniformly"""
+        return items[ int( self.uniform() * len( items ) ) ]
+
+    def select( self, cdf ):
+        """Index drawn from a cumulative, possibly unnormalized,
+        distribution"""
+        i = numpy.searchsorted( cdf, self.uniform() * cdf[ -1 ], side='right' )
+        return min( i, len( cdf ) - 1 )
+
+    def spawn( self, n ):
+        """n child streams, seeded from this one"""
+        return [ RandomStream( int( seed ), self.block ) for seed in self.random.randint( 2**31 - 1, size=n ) ]
+
+def streamOf( seed ):
+    """A RandomStream from a seed, or the stream itself if given one"""
+    if isinstance( seed, RandomStream ):
+        return seed
+    return RandomStream( seed )
+
+class Alias( object ):
+    """
+    Walker's alias table for drawing repeatedly from a fixed distribution
+    with one uniform and one comparison per draw
+    """
+
+    def __init__( self, probabilities ):
+        p = numpy.asarray( probabilities, dtype=float )
+        k = len( p )
+        scaled = p * k / p.sum()
+        self.prob = numpy.ones( k )
+        self.alias = numpy.arange( k )
+
+        small = [ i for i in range( k ) if scaled[ i ] < 1 ]
+        large = [ i for i in range( k ) if scaled[ i ] >= 1 ]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.prob[ s ] = scaled[ s ]
+            self.alias[ s ] = l
+            scaled[ l ] -= 1 - scaled[ s ]
+            if scaled[ l ] < 1:
+                small.append( l )
+            else:
+                large.append( l )
+
+    def sample( self, stream, size=None ):
+        """Indices drawn from the distribution, one or an array of the
+        given shape"""
+        u = stream.random_sample( size ) * len( self.prob )
+        i = numpy.asarray( u, dtype=int )
+        result = numpy.where( u - i < self.prob[ i ], i, self.alias[ i ] )
+        return int( result ) if size is None else result
@@ -0,0 +1,546 @@
+"""
+Sampling:
+    Gibbs sampling over integer coded states, with the Markov blanket
+    conditionals of every variable, or block of variables, precomputed
+    from the CPT arrays
+"""
+
+import itertools
+import time
+
+import numpy
+
+import BNet
+import instrument
+from rng import streamOf
+from cpts import isCompact
+from algos import interactionGraph, eliminationOrder, eliminate
+
+def partition( net, variables, method='family', maxStates=64 ):
+    """
+    Split variables into blocks to be sampled jointly, each with at most
+    maxStates joint values ( a variable with more is a block of its own )
+    @method - 'family' grows a block from each variable through its
+        parents and their parents while they fit, children first;
+        'clique' fills blocks from the cliques of a triangulation of the
+        moral graph, largest first
+    Returns a list of lists of ids
+    """
+    free = set( variables )
+    if method == 'family':
+        groups = [ [ id ] for id in reversed( net.topologicalOrder() ) ]
+        expand = lambda id: net.get( id ).parents
+    elif method == 'clique':
+        graph = interactionGraph( [ [ v for v in node.parents + ( node.id, ) if v in free ] for node in net.variables.values() ] )
+        for id in free:
+            graph.setdefault( id, set() )
+        groups = []
+        for var in eliminationOrder( graph, free ):
+            groups.append( [ var ] + list( eliminate( graph, var ) ) )
+        groups.sort( key=len, reverse=True )
+        expand = lambda id: ()
+    else:
+        raise ValueError( "Unknown blocking %s"%( method ) )
+
+    blocks = []
+    assigned = set()
+    for group in groups:
+        block = []
+        states = 1
+        queue = list( group )
+        while queue:
+            id = queue.pop( 0 )
+            if id in free and id not in assigned:
+                k = len( net.get( id ).values )
+                if states * k <= maxStates or not block:
+                    block.append( id )
+                    assigned.add( id )
+                    states *= k
+                    queue.extend( expand( id ) )
+        if block:
+            blocks.append( block )
+    return blocks
+
+class GibbsSampler( object ):
+    """
+    Gibbs sampler that keeps the state of one or more chains as an integer
+    array, and updates a variable, or a block of variables, in all chains
+    at once.
+
+    All CPTs are laid end to end in one flat array. For every block the
+    sampler precomputes the positions and strides needed to find, from the
+    state, the entries of the CPTs of its variables and of their children
+    (its Markov blanket) for every joint value of the block, so a
+    conditional is one gather and one product. Compact CPTs with more than
+    expandLimit entries are left out of the array, and looked up through
+    their own indexing. Sampling strongly coupled variables together lets
+    the chains move where single variable updates are stuck.
+
+    The 'counts' estimator counts the values the chains take. The
+    'rao-blackwell' estimator adds up, at every block update, the
+    conditional the block is drawn from, spread onto the values of its
+    variables. That is the expected count given the rest of the state,
+    and it has much lower variance for the same sweeps.
+    """
+
+    def __init__( self, net, ctx, chains=1, seed=None, blocks=None, maxStates=64, estimator='counts' ):
+        """
+        @net - network to sample; read only
+        @ctx - context holding the evidence
+        @chains - number of chains run side by side
+        @seed - seed, or rng.RandomStream, the chains draw from
+        @blocks - None to update one variable at a time; 'family' or
+            'clique' to sample blocks made by partition(); or a list of
+            lists of ids, with any variable left out in a block of its own
+        @maxStates - most joint values of a block made by partition()
+        @estimator - 'counts' or 'rao-blackwell'
+        """
+        if estimator not in ( 'counts', 'rao-blackwell' ):
+            raise ValueError( "Unknown estimator %s"%( estimator ) )
+        self.estimator = estimator
+        self.net = net
+        self.ids = list( net.ids )
+        self.pos = dict( [ ( id, i ) for i, id in enumerate( self.ids ) ] )
+        self.cards = numpy.array( [ len( net.get( id ).values ) for id in self.ids ] )
+        self.chains = chains
+        self.random = streamOf( seed )
+
+        with instrument.phase( 'evidence' ):
+            self.evidence = dict( [ ( self.pos[ k ], v ) for k, v in ctx.getIndices().items() ] )
+            self.free = [ i for i in range( len( self.ids ) ) if i not in self.evidence ]
+
+        if blocks is None:
+            blocks = []
+        elif isinstance( blocks, basestring ):
+            blocks = partition( net, [ self.ids[ i ] for i in self.free ], blocks, maxStates )
+        self.blocks = [ [ self.pos[ id ] for id in block if self.pos[ id ] not in self.evidence ] for block in blocks ]
+        self.blocks = [ block for block in self.blocks if block ]
+        blocked = set( itertools.chain( *self.blocks ) )
+        self.blocks += [ [ i ] for i in self.free if i not in blocked ]
+
+        with instrument.phase( 'compile' ):
+            self.compile()
+        self.clamped = None
+        self.reset()
+
+    # Entries of the largest compact CPT expanded into the flat array
+    expandLimit = 1 << 16
+
+    def compile( self ):
+        """Precompute the Markov blanket lookups of every block"""
+        n = len( self.ids )
+        cpts = [ self.net.get( id ).cpt for id in self.ids ]
+        compact = [ isCompact( cpt ) and cpt.size > self.expandLimit for cpt in cpts ]
+        flat = [ numpy.zeros( 0 ) if c else numpy.asarray( cpt ).ravel() for cpt, c in zip( cpts, compact ) ]
+        offsets = numpy.cumsum( [ 0 ] + [ len( f ) for f in flat ] )
+        self.table = numpy.concatenate( flat )
+
+        # Strides of the parents and the value in each flattened CPT
+        strides = []
+        for cpt in cpts:
+            strides.append( list( numpy.cumprod( ( cpt.shape + ( 1, ) )[ :0:-1 ] )[ ::-1 ] ) )
+
+        # Column n of the state is always 0, and pads the lookups
+        self.lookups = []
+        for block in self.blocks:
+            members = dict( [ ( i, b ) for b, i in enumerate( block ) ] )
+
+            # Every joint value of the block, one row each
+            joint = numpy.array( list( itertools.product( *[ range( self.cards[ i ] ) for i in block ] ) ), dtype=int )
+
+            # One term for the CPT of each variable of the block, and of
+            # each of their children
+            owners = []
+            for i in block:
+                for c in [ i ] + map( self.pos.get, self.net.getChildren( self.ids[ i ] ) ):
+                    if c not in owners:
+                        owners.append( c )
+            terms = []
+            lookups = []
+            for c in owners:
+                scope = map( self.pos.get, self.net.get( self.ids[ c ] ).parents ) + [ c ]
+                if compact[ c ]:
+                    # Value indices of the scope, in every chain and for
+                    # every joint value of the block
+                    lookups.append( ( cpts[ c ], [ ( j, members.get( j ) ) for j in scope ] ) )
+                    continue
+                positions = [ n if j in members else j for j in scope ]
+                offset = numpy.zeros( len( joint ), dtype=int )
+                for j, stride in zip( scope, strides[ c ] ):
+                    if j in members:
+                        offset += joint[ :, members[ j ] ] * stride
+                terms.append( ( positions, strides[ c ], offsets[ c ], offset ) )
+
+            width = max( [ len( t[0] ) for t in terms ] + [ 1 ] )
+            positions = numpy.array( [ list( t[0] ) + [ n ] * ( width - len( t[0] ) ) for t in terms ], dtype=int ).reshape( -1, width )
+            steps = numpy.array( [ list( t[1] ) + [ 0 ] * ( width - len( t[1] ) ) for t in terms ], dtype=int ).reshape( -1, width )
+            base = numpy.array( [ t[2] for t in terms ], dtype=int )
+            values = numpy.array( [ t[3] for t in terms ], dtype=int ).reshape( -1, len( joint ) )
+            self.lookups.append( ( block, joint, positions, steps, base, values, lookups ) )
+
+        # CPT entries read by a sweep of one chain
+        self.reads = sum( [ lookup[ 5 ].size + len( lookup[ 6 ] ) * len( lookup[ 1 ] ) for lookup in self.lookups ] )
+
+        # Offsets of each variable's values in the statistics
+        self.statOffsets = numpy.cumsum( [ 0 ] + list( self.cards ) )[:-1]
+        self.evidenceColumns = sorted( self.evidence )
+
+    def reset( self ):
+        """Start the chains from random values, and clear the statistics"""
+        self.state = numpy.zeros( ( self.chains, len( self.ids ) + 1 ), dtype=int )
+        for i in self.free:
+            self.state[ :, i ] = self.random.randint( self.cards[ i ], size=self.chains )
+        for i, v in self.evidence.items():
+            self.state[ :, i ] = v
+        if self.clamped is not None:
+            self.state[ self.clamped ] = self.clampValues[ self.clamped ]
+        self.counts = numpy.zeros( self.cards.sum() )
+        self.sweeps = 0
+        self.steps = 0
+        self.elapsed = 0.0
+
+    def clamp( self, values ):
+        """
+        Fix variables to values that differ from chain to chain, as for
+        chains each sampling under evidence of their own. Only for a
+        sampler that updates one variable at a time
+        @values - ( chains, variables ) array of value indices, columns in
+            the order of self.ids, negative where a variable is free
+        """
+        if [ block for block in self.blocks if len( block ) > 1 ]:
+            raise ValueError( "Clamping needs a sampler without blocks" )
+        values = numpy.asarray( values, dtype=int )
+        self.clampValues = numpy.zeros( self.state.shape, dtype=int )
+        self.clampValues[ :, :-1 ] = values
+        self.clamped = self.clampValues >= 0
+        self.clamped[ :, -1 ] = False
+        self.state[ self.clamped ] = self.clampValues[ self.clamped ]
+
+    def conditional( self, b ):
+        """Unnormalized Pr( block b | blanket ) in every chain, as a
+        ( chains, joint values ) array"""
+        block, joint, positions, steps, base, values, lookups = self.lookups[ b ]
+        rows = ( self.state[ :, positions ] * steps ).sum( axis=2 ) + base
+        p = self.table[ rows[ :, :, numpy.newaxis ] + values ].prod( axis=1 )
+        for cpt, scope in lookups:
+            p *= cpt[ tuple( [ self.state[ :, j, numpy.newaxis ] if m is None else joint[ :, m ] for j, m in scope ] ) ]
+        return p
+
+    def sweep( self, temperature=1.0, record=False ):
+        """
+        Resample every block once, in every chain
+        @temperature - sample from the conditionals raised to the power
+            1 / temperature, as in simulated annealing; at 0 every block
+            takes its most probable value
+        @record - add the conditionals to the statistics, for the
+            'rao-blackwell' estimator
+        """
+        uniforms = self.random.random_sample( ( len( self.lookups ), self.chains ) )
+        for b, u in enumerate( uniforms ):
+            p = self.conditional( b )
+            if record:
+                self.record( b, p )
+            if temperature == 0:
+                p = ( p == p.max( axis=1 )[ :, numpy.newaxis ] ).astype( float )
+            elif temperature != 1:
+                with numpy.errstate( divide='ignore' ):
+                    p = numpy.log( p ) / temperature
+                top = p.max( axis=1 )[ :, numpy.newaxis ]
+                p = numpy.exp( p - numpy.where( numpy.isfinite( top ), top, 0 ) )
+            cdf = p.cumsum( axis=1 )
+            choice = ( cdf < ( u * cdf[ :, -1 ] )[ :, numpy.newaxis ] ).sum( axis=1 )
+            block, joint = self.lookups[ b ][ :2 ]
+            if self.clamped is not None:
+                i = block[ 0 ]
+                self.state[ :, i ] = numpy.where( self.clamped[ :, i ], self.clampValues[ :, i ], choice )
+            elif len( block ) == 1:
+                self.state[ :, block[ 0 ] ] = choice
+            else:
+                self.state[ :, block ] = joint[ choice ]
+
+    def record( self, b, p ):
+        """Add the conditionals p of block b, normalized in every chain, to
+        the statistics of its variables"""
+        block, joint = self.lookups[ b ][ :2 ]
+        total = p.sum( axis=1 )[ :, numpy.newaxis ]
+        p = p / numpy.where( total > 0, total, 1 )
+        if self.clamped is not None:
+            i = block[ 0 ]
+            p = numpy.where( self.clamped[ :, i, numpy.newaxis ], numpy.arange( self.cards[ i ] ) == self.clampValues[ :, i, numpy.newaxis ], p )
+        p = p.sum( axis=0 )
+        for m, i in enumerate( block ):
+            start = self.statOffsets[ i ]
+            if len( block ) == 1:
+                self.counts[ start : start + self.cards[ i ] ] += p
+            else:
+                self.counts[ start : start + self.cards[ i ] ] += numpy.bincount( joint[ :, m ], p, self.cards[ i ] )
+
+    def run( self, burnIn=100, sweeps=1000 ):
+        """
+        Run burnIn sweeps, then sweeps more while counting the values taken
+        by every variable. Returns the marginals estimated so far
+        """
+        start = time.time()
+        with instrument.phase( 'burn-in' ):
+            for s in xrange( burnIn ):
+                self.sweep()
+        with instrument.phase( 'sampling' ):
+            record = self.estimator == 'rao-blackwell'
+            for s in xrange( sweeps ):
+                self.sweep( record=record )
+                self.count()
+        self.elapsed += time.time() - start
+        self.steps += ( burnIn + sweeps ) * len( self.free ) * self.chains
+        if instrument.enabled:
+            instrument.count( 'sampler steps', ( burnIn + sweeps ) * len( self.free ) * self.chains )
+            instrument.count( 'sweeps', ( burnIn + sweeps ) * self.chains )
+            instrument.count( 'cpt lookups', ( burnIn + sweeps ) * self.reads * self.chains )
+        with instrument.phase( 'normalize' ):
+            return self.marginals()
+
+    def count( self ):
+        """Add the current state of every chain to the statistics; for the
+        'rao-blackwell' estimator, only that of the evidence, as the sweep
+        has recorded the rest"""
+        index = self.state[ :, :-1 ] + self.statOffsets
+        if self.estimator == 'rao-blackwell':
+            index = index[ :, self.evidenceColumns ]
+        self.counts += numpy.bincount( index.ravel(), minlength=self.counts.size )
+        self.sweeps += 1
+
+    def rate( self ):
+        """Variable updates per second so far, over all chains"""
+        return self.steps / self.elapsed if self.elapsed else 0.0
+
+    def marginals( self ):
+        """Estimated posterior of every variable, as a dict of id to
+        distribution"""
+        result = {}
+        for i, id in enumerate( self.ids ):
+            counts = self.counts[ self.statOffsets[ i ] : self.statOffsets[ i ] + self.cards[ i ] ]
+            total = counts.sum()
+            if total > 0:
+                counts = counts / total
+            result[ id ] = dict( zip( self.net.get( id ).values, counts ) )
+        return result
+
+def throughput( net, ctx, steps=10000, chains=1 ):
+    """
+    Compare the variable updates per second of algos.gibbsSample with
+    those of GibbsSampler, over about the given number of updates
+    """
+    import algos
+
+    start = time.time()
+    algos.gibbsSample( net, ctx, burnIn=0, samples=steps )
+    reference = steps / ( time.time() - start )
+
+    sampler = GibbsSampler( net, ctx, chains )
+    sweeps = max( 1, steps / max( 1, len( sampler.free ) * chains ) )
+    sampler.run( 0, sweeps )
+
+    return { 'gibbsSample' : reference, 'GibbsSampler' : sampler.rate() }
+
+class WarmChains( object ):
+    """
+    Gibbs chains over a whole network, with the statistics gathered under
+    the evidence they were made for. They are kept on a Context, and a
+    context made from another shares them until its evidence differs;
+    then it starts chains of its own from their state, which is already
+    near equilibrium when the evidence changed little
+    """
+
+    def __init__( self, net, ctx, chains=1, seed=None, blocks=None, start=None, estimator='counts' ):
+        """
+        @start - WarmChains on the same network to take the state, and
+            a child of the random stream, from; burn in from random values
+            if None
+        """
+        self.evidence = ctx.getIndices()
+        self.settings = ( chains, blocks, estimator )
+        if start is not None:
+            seed = start.sampler.random.spawn( 1 )[ 0 ]
+        self.sampler = GibbsSampler( net, ctx, chains, seed, blocks, estimator=estimator )
+        self.resumed = start is not None
+        self.burnt = False
+        if start is not None:
+            free = self.sampler.free
+            old = start.sampler.state
+            self.sampler.state[ :, free ] = old[ numpy.arange( chains ) % len( old ) ][ :, free ]
+
+    def marginals( self, burnIn=100, sweeps=1000, settle=10 ):
+        """
+        Marginals of every variable, once at least sweeps sweeps have been
+        counted under this evidence. Chains that were resumed run settle
+        sweeps before counting instead of burnIn
+        """
+        if not self.burnt:
+            self.sampler.run( settle if self.resumed else burnIn, 0 )
+            self.burnt = True
+        if self.sampler.sweeps < sweeps:
+            self.sampler.run( 0, sweeps - self.sampler.sweeps )
+        return self.sampler.marginals()
+
+    def refine( self, sweeps ):
+        """Count sweeps more sweeps"""
+        self.burnt = True
+        return self.sampler.run( 0, sweeps )
+
+def warmChains( net, ctx, chains=1, seed=None, blocks=None, estimator='counts' ):
+    """
+    The WarmChains of a context for its current evidence. They are the
+    context's own, or those of the nearest context it was made from, if
+    they fit its evidence; otherwise new ones, started from those, are
+    kept on the context
+    """
+    found = ctx
+    while found is not None and found.chains is None:
+        found = found.parent
+    start = found.chains if found is not None else None
+    if start is not None and start.sampler.net is not net:
+        start = None
+    if start is None or start.evidence != ctx.getIndices() or start.settings != ( chains, blocks, estimator ):
+        start = WarmChains( net, ctx, chains, seed, blocks, start, estimator )
+    ctx.chains = start
+    return start
+
+def warmGibbs( net, ctx, burnIn=100, sweeps=1000, settle=10, chains=1, seed=None, blocks=None, estimator='counts' ):
+    """
+    Gibbs marginals of every variable under the evidence of a context,
+    from the chains kept on it; see warmChains. Asking again under the
+    same evidence samples nothing more
+    """
+    return warmChains( net, ctx, chains, seed, blocks, estimator ).marginals( burnIn, sweeps, settle )
+
+# Per process state of the parallel chains; set by initWorker
+worker = {}
+
+def initWorker( net, evidence, blocks=None, estimator='counts' ):
+    """Set up a pool process with the network and evidence it samples,
+    and the blocking and estimator of its sampler"""
+    ctx = BNet.Context( net )
+    for k, v in evidence.items():
+        ctx.setVariable( k, v )
+    worker.clear()
+    worker[ 'net' ] = net
+    worker[ 'ctx' ] = ctx
+    worker[ 'blocks' ] = blocks
+    worker[ 'estimator' ] = estimator
+
+def runChain( task ):
+    """
+    Advance one chain in a pool process. The chain's state and random
+    stream travel with the task, so any process can continue any chain.
+    Returns the new state, random stream and value counts
+    """
+    state, stream, burnIn, sweeps = task
+    if 'sampler' not in worker:
+        worker[ 'sampler' ] = GibbsSampler( worker[ 'net' ], worker[ 'ctx' ], blocks=worker[ 'blocks' ], estimator=worker[ 'estimator' ] )
+    sampler = worker[ 'sampler' ]
+    sampler.random = stream
+    if state is None:
+        sampler.reset()
+    else:
+        sampler.state = state
+    sampler.counts[:] = 0
+    sampler.run( burnIn, sweeps )
+    return sampler.state, sampler.random, sampler.counts.copy()
+
+def diagnostics( batches, batch ):
+    """
+    Convergence diagnostics from per batch value frequencies
+    @batches - ( chains, batches, values ) array of the fraction of
+        sweeps in each batch in which each value was taken
+    @batch - sweeps per batch
+    Returns the estimates, the Gelman-Rubin R-hat, the batch means
+    standard error and the effective sample size of every value
+    """
+    chains, nb, _ = batches.shape
+    n = nb * batch
+    means = batches.mean( axis=1 )
+    p = means.mean( axis=0 )
+
+    # Gelman-Rubin, treating each value as an indicator variable
+    W = ( means * ( 1 - means ) ).mean( axis=0 ) * n / max( n - 1, 1 )
+    B = means.var( axis=0, ddof=1 ) if chains > 1 else numpy.zeros( p.shape )
+    V = W * ( n - 1 ) / n + B
+    rhat = numpy.sqrt( V / numpy.where( W > 0, W, 1 ) )
+    rhat[ W == 0 ] = 1.0
+
+    # Batch means over all chains
+    pooled = batches.reshape( chains * nb, -1 )
+    if chains * nb > 1:
+        se = numpy.sqrt( pooled.var( axis=0, ddof=1 ) / ( chains * nb ) )
+    else:
+        se = numpy.ones( p.shape )
+    ess = numpy.where( se > 0, p * ( 1 - p ) / numpy.where( se > 0, se, 1 ) ** 2, chains * n )
+    ess = numpy.minimum( ess, chains * n )
+    return p, rhat, se, ess
+
+def parallelGibbs( net, ctx, query=None, chains=4, processes=None, burnIn=100, sweeps=1000, batch=50, tolerance=None, seed=None, blocks=None, estimator='counts' ):
+    """
+    Run independent, differently seeded Gibbs chains in a process pool,
+    and merge their statistics.
+    @query - variables to report diagnostics for; all free ones if None
+    @chains - number of chains
+    @processes - pool size; cpu count if None, and no pool if 1
+    @sweeps - sweeps per chain after burn in; the most run if a
+        tolerance is given
+    @batch - sweeps a chain runs between merges
+    @tolerance - if given, stop as soon as the standard error of every
+        value of every query variable is at most this
+    @blocks, @estimator - blocking and estimator of the samplers, as for
+        GibbsSampler
+    Returns a dict with the 'marginals', and the 'rhat', 'stderr' and
+    'ess' of each query variable, the 'sweeps' run per chain and whether
+    the tolerance was 'converged' to
+    """
+    import multiprocessing
+
+    evidence = ctx.getVariables()
+    if query is None:
+        query = [ id for id in net.variables if id not in evidence ]
+    tasks = [ ( None, stream, burnIn, batch ) for stream in streamOf( seed ).spawn( chains ) ]
+
+    if processes == 1:
+        initWorker( net, evidence, blocks, estimator )
+        pool = None
+        mapper = map
+    else:
+        pool = multiprocessing.Pool( processes, initWorker, ( net, evidence, blocks, estimator ) )
+        mapper = pool.map
+
+    # The samplers in the workers lay out their statistics in the same
+    # order, which travels with the pickled network
+    ids = net.ids
+    cards = [ len( net.get( id ).values ) for id in ids ]
+    offsets = dict( zip( ids, numpy.cumsum( [ 0 ] + cards ) ) )
+
+    batches = [ [] for c in range( chains ) ]
+    converged = False
+    try:
+        while True:
+            results = mapper( runChain, tasks )
+            for c, ( state, stream, counts ) in enumerate( results ):
+                batches[ c ].append( counts / batch )
+                tasks[ c ] = ( state, stream, 0, batch )
+
+            done = len( batches[ 0 ] ) * batch
+            p, rhat, se, ess = diagnostics( numpy.array( batches ), batch )
+            if tolerance is not None and len( batches[ 0 ] ) > 1:
+                converged = max( [ se[ offsets[ q ] : offsets[ q ] + len( net.get( q ).values ) ].max() for q in query ] ) <= tolerance
+            if converged or done >= sweeps:
+                break
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    result = { 'marginals' : {}, 'rhat' : {}, 'stderr' : {}, 'ess' : {}, 'sweeps' : done, 'converged' : converged }
+    for id in ids:
+        span = slice( offsets[ id ], offsets[ id ] + len( net.get( id ).values ) )
+        result[ 'marginals' ][ id ] = dict( zip( net.get( id ).values, p[ span ] ) )
+        if id in query:
+            result[ 'rhat' ][ id ] = rhat[ span ].max()
+            result[ 'stderr' ][ id ] = se[ span ].max()
+            result[ 'ess' ][ id ] = ess[ span ].min()
+    return result
@@ -0,0 +1,388 @@
+"""
+Server:
+    Query daemon that keeps parsed networks in memory and answers queries
+    sent as JSON lines over a Unix domain socket or a localhost TCP port
+
+    Every request is one JSON object on a line, answered by one line:
+        { "id" : 7, "network" : "alarm.bif", "evidence" : { "BP" : "LOW" },
+          "query" : [ "HYPOVOLEMIA" ], "engine" : "gibbs",
+          "options" : { "sweeps" : 2000, "seed" : 1 } }
+        { "id" : 7, "result" : { "HYPOVOLEMIA" : { "TRUE" : 0.3, ... } },
+          "time" : 0.012 }
+    "id" is echoed back, "network" may be left out when only one is
+    served, and engines are those of BatchRunner and "mpe" and "map",
+    whose result is the dict mpe.mpe returns. Failures are answered with
+    { "id" : 7, "error" : "..." }. { "op" : "networks" } lists the networks
+    and { "op" : "stats" } gives the request counters and, if enabled, the
+    instrument timers
+"""
+
+import json
+import os
+import signal
+import socket
+import SocketServer
+import threading
+import time
+
+import BNet
+import instrument
+
+ENGINES = ( 'exact', 'gibbs', 'lw', 'mpe', 'map' )
+
+# Per process networks of the sampling pool; set by initWorker
+served = {}
+
+def initWorker( networks ):
+    """Set up a pool process with the networks it answers queries on"""
+    served.clear()
+    served.update( networks )
+
+def answer( net, ctx, variables, engine, options ):
+    """Result of a query on a network, for any engine but 'exact'"""
+    from prune import prune
+    if engine == 'gibbs':
+        from sampling import GibbsSampler
+        sub, subctx = prune( net, ctx, variables )
+        marginals = GibbsSampler( sub, subctx, options[ 'chains' ], options[ 'seed' ], options[ 'blocks' ],
+                estimator=options[ 'estimator' ] ).run( options[ 'burnIn' ], options[ 'sweeps' ] )
+        return dict( [ ( id, marginals[ id ] ) for id in variables ] )
+    elif engine == 'lw':
+        from forward import ForwardSampler
+        sub, subctx = prune( net, ctx, variables )
+        marginals = ForwardSampler( sub, subctx, options[ 'seed' ] ).marginals( options[ 'samples' ] )
+        return dict( [ ( id, marginals[ id ] ) for id in variables ] )
+    elif engine == 'mpe':
+        import mpe
+        return mpe.mpe( net, ctx, seed=options[ 'seed' ] )
+    elif engine == 'map':
+        import mpe
+        return mpe.mapQuery( net, ctx, variables, seed=options[ 'seed' ] )
+    raise ValueError( "Unknown engine %s"%( engine ) )
+
+def runQuery( task ):
+    """Answer a query in a pool process. The evidence travels as value
+    indices, which pickle whatever the value types"""
+    name, indices, variables, engine, options = task
+    net = served[ name ]
+    ctx = BNet.Context( net )
+    for id, i in indices:
+        ctx.setVariable( id, net.get( id ).values[ i ] )
+    return answer( net, ctx, variables, engine, options )
+
+class Pending( object ):
+    """A computation in flight, and the threads waiting for it"""
+
+    def __init__( self ):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class Coalescer( object ):
+    """
+    Runs a computation once for any number of threads asking the same
+    question at the same time; the ones that arrive while it runs wait
+    for its result instead of starting their own
+    """
+
+    def __init__( self ):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.coalesced = 0
+
+    def run( self, key, compute ):
+        with self.lock:
+            pending = self.pending.get( key )
+            owner = pending is None
+            if owner:
+                pending = self.pending[ key ] = Pending()
+            else:
+                self.coalesced += 1
+
+        if owner:
+            try:
+                pending.result = compute()
+            except Exception, e:
+                pending.error = e
+            finally:
+                with self.lock:
+                    del self.pending[ key ]
+                pending.done.set()
+        else:
+            pending.done.wait()
+
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+class QueryServer( object ):
+    """
+    Answers queries on a set of networks for many clients at once. Each
+    connection gets a thread. Exact queries run in that thread on one
+    junction tree per network, compiled on first use and reused under a
+    lock. Sampling, MPE and MAP queries, which are CPU bound, go to a pool
+    of worker processes holding their own copies of the networks
+    """
+
+    # Options that count something, and need at least one
+    POSITIVE = ( 'sweeps', 'chains', 'samples' )
+
+    DEFAULTS = { 'burnIn' : 100, 'sweeps' : 1000, 'chains' : 1, 'seed' : None, 'blocks' : 'family', 'estimator' : 'counts', 'samples' : 100000 }
+
+    def __init__( self, networks, workers=None, **defaults ):
+        """
+        @networks - dict of name to network
+        @workers - size of the process pool; cpu count if None, and no
+            pool if 0, so every query runs in its connection's thread
+        @defaults - engine options used where a request gives none, among
+            burnIn, sweeps, chains, seed, blocks, estimator and samples
+        """
+        for k in defaults:
+            if k not in self.DEFAULTS:
+                raise ValueError( "Unknown option %s"%( k ) )
+        self.networks = networks
+        self.defaults = dict( self.DEFAULTS )
+        self.defaults.update( defaults )
+        self.trees = {}
+        self.locks = dict( [ ( name, threading.Lock() ) for name in networks ] )
+        self.coalescer = Coalescer()
+        # Connection threads share the counts
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+        self.pool = None
+        if workers != 0:
+            import multiprocessing
+            self.pool = multiprocessing.Pool( workers, initWorker, ( networks, ) )
+
+    def close( self ):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def resolve( self, net, token ):
+        """Id of a variable named in a request; ids may be ints or strings,
+        and JSON object keys are always strings"""
+        if token in net.variables:
+            return token
+        try:
+            if int( token ) in net.variables:
+                return int( token )
+        except ( TypeError, ValueError ):
+            pass
+        raise KeyError( token )
+
+    def parseValue( self, net, id, token ):
+        """Value of a variable named in a request, matched as is or by its
+        str()"""
+        for value in net.get( id ).values:
+            if value == token and type( value ) == type( token ) or str( value ) == str( token ):
+                return value
+        raise ValueError( "%s is not a value of %s"%( token, id ) )
+
+    def network( self, request ):
+        name = request.get( 'network' )
+        if name is None and len( self.networks ) == 1:
+            name = self.networks.keys()[ 0 ]
+        if name not in self.networks:
+            raise ValueError( "No network %s"%( name ) )
+        return name, self.networks[ name ]
+
+    def exact( self, name, ctx, variables ):
+        with self.locks[ name ]:
+            tree = self.trees.get( name )
+            if tree is None:
+                from jtree import JunctionTree
+                tree = self.trees[ name ] = JunctionTree( self.networks[ name ] )
+            tree.calibrate( ctx )
+            return dict( [ ( id, tree.marginal( id ) ) for id in variables ] )
+
+    def query( self, request ):
+        """Result of a query request"""
+        name, net = self.network( request )
+        engine = request.get( 'engine', 'exact' )
+        if engine not in ENGINES:
+            raise ValueError( "Unknown engine %s"%( engine ) )
+        options = dict( self.defaults )
+        for k, v in request.get( 'options', {} ).items():
+            if k not in self.DEFAULTS:
+                raise ValueError( "Unknown option %s"%( k ) )
+            if not isinstance( v, ( int, basestring, type( None ) ) ):
+                raise ValueError( "Option %s must be a number or a string"%( k ) )
+            # JSON true and false arrive as bools, which are ints too
+            counted = isinstance( v, int ) and not isinstance( v, bool )
+            if k in self.POSITIVE and not ( counted and v >= 1 ):
+                raise ValueError( "Option %s must be a positive integer"%( k ) )
+            if k == 'burnIn' and not ( counted and v >= 0 ):
+                raise ValueError( "Option burnIn must be a non-negative integer" )
+            options[ str( k ) ] = v
+
+        ctx = BNet.Context( net )
+        for k, v in request.get( 'evidence', {} ).items():
+            id = self.resolve( net, k )
+            ctx.setVariable( id, self.parseValue( net, id, v ) )
+        variables = request.get( 'query', [] )
+        if not isinstance( variables, list ):
+            variables = [ variables ]
+        variables = [ self.resolve( net, v ) for v in variables ]
+        if engine != 'mpe' and not variables:
+            raise ValueError( "No query variables" )
+
+        indices = tuple( sorted( ctx.getIndices().items() ) )
+        key = ( name, indices, tuple( variables ), engine, tuple( sorted( options.items() ) ) )
+        if engine == 'exact':
+            compute = lambda: self.exact( name, ctx, variables )
+        elif self.pool is not None:
+            compute = lambda: self.pool.apply_async( runQuery, ( ( name, indices, variables, engine, options ), ) ).get()
+        else:
+            compute = lambda: answer( net, ctx, variables, engine, options )
+        return self.coalescer.run( key, compute )
+
+    def handle( self, line ):
+        """Answer one request line with one response line"""
+        with self.lock:
+            self.requests += 1
+        start = time.time()
+        id = None
+        try:
+            request = json.loads( line )
+            if not isinstance( request, dict ):
+                raise ValueError( "A request must be a JSON object" )
+            id = request.get( 'id' )
+            op = request.get( 'op', 'query' )
+            if op == 'query':
+                response = { 'result' : self.query( request ) }
+            elif op == 'networks':
+                response = { 'result' : sorted( self.networks ) }
+            elif op == 'stats':
+                response = { 'result' : self.stats() }
+            else:
+                raise ValueError( "Unknown op %s"%( op ) )
+        except KeyError, e:
+            response = { 'error' : "No variable %s"%( e.args[ 0 ] ) }
+        except ZeroDivisionError:
+            response = { 'error' : "The evidence is impossible" }
+        except ValueError, e:
+            response = { 'error' : str( e ) }
+        except Exception, e:
+            # Keep serving the connection whatever went wrong
+            response = { 'error' : "%s: %s"%( type( e ).__name__, e ) }
+        if 'error' in response:
+            with self.lock:
+                self.errors += 1
+        response[ 'id' ] = id
+        response[ 'time' ] = time.time() - start
+        return json.dumps( response )
+
+    def stats( self ):
+        with self.lock:
+            result = { 'requests' : self.requests, 'errors' : self.errors }
+        result[ 'coalesced' ] = self.coalescer.coalesced
+        if instrument.enabled:
+            result[ 'instrument' ] = instrument.report()
+        return result
+
+    def serve( self, address ):
+        """
+        Serve until interrupted or terminated
+        @address - path of a Unix domain socket, or [host:]port, the host
+            being localhost if left out
+        """
+        server = listen( address, self )
+        signal.signal( signal.SIGTERM, stop )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if isinstance( server.server_address, basestring ):
+                os.unlink( server.server_address )
+            self.close()
+
+def stop( signum, frame ):
+    """Leave serve() through its clean up"""
+    raise SystemExit( 0 )
+
+class Handler( SocketServer.StreamRequestHandler ):
+    """Answers the request lines of one connection in order"""
+
+    def setup( self ):
+        SocketServer.StreamRequestHandler.setup( self )
+        if self.server.address_family == socket.AF_INET:
+            self.request.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+
+    def handle( self ):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            self.wfile.write( self.server.queries.handle( line ) + '\n' )
+            self.wfile.flush()
+
+class ThreadedTCPServer( SocketServer.ThreadingMixIn, SocketServer.TCPServer ):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class ThreadedUnixServer( SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer ):
+    daemon_threads = True
+
+def parseAddress( address ):
+    """( host, port ) of a [host:]port address, or the socket path"""
+    host, _, port = address.rpartition( ':' )
+    if port.isdigit():
+        return ( host or 'localhost', int( port ) )
+    return address
+
+def listen( address, queries ):
+    """Bound threaded socket server passing requests to a QueryServer"""
+    address = parseAddress( address )
+    if isinstance( address, tuple ):
+        server = ThreadedTCPServer( address, Handler )
+    else:
+        if os.path.exists( address ):
+            os.unlink( address )
+        server = ThreadedUnixServer( address, Handler )
+    server.queries = queries
+    return server
+
+class Client( object ):
+    """Connection to a QueryServer, sending one request at a time"""
+
+    def __init__( self, address ):
+        address = parseAddress( address )
+        if isinstance( address, tuple ):
+            self.sock = socket.create_connection( address )
+            self.sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+        else:
+            self.sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+            self.sock.connect( address )
+        self.rfile = self.sock.makefile( 'rb' )
+        self.count = 0
+
+    def request( self, request ):
+        """Send a request dict and return the response dict"""
+        self.sock.sendall( json.dumps( request ) + '\n' )
+        line = self.rfile.readline()
+        if not line:
+            raise IOError( "Connection closed by the server" )
+        return json.loads( line )
+
+    def query( self, query, evidence={}, engine='exact', network=None, **options ):
+        """Result of a query; raises ValueError with the server's message
+        if it fails"""
+        self.count += 1
+        request = { 'id' : self.count, 'query' : query, 'evidence' : evidence, 'engine' : engine, 'options' : options }
+        if network is not None:
+            request[ 'network' ] = network
+        response = self.request( request )
+        if 'error' in response:
+            raise ValueError( response[ 'error' ] )
+        return response[ 'result' ]
+
+    def close( self ):
+        self.rfile.close()
+        self.sock.close()
@@ -0,0 +1,61 @@
+"""
+Writers:
+    Write networks in the formats read by bnet.parsers, a line at a time
+"""
+
+import itertools
+
+def writeRavi( net, f, queries=() ):
+    """
+    Write a network in Ravi format. Variables are numbered 1..n in
+    topological order, as the format needs parents before children
+    @net - network of binary variables; the first value of each is 'true'
+    @queries - list of ( evidence, [ query variables ] ) to write after it
+    """
+    order = net.topologicalOrder()
+    number = dict( [ ( id, i ) for i, id in enumerate( order, 1 ) ] )
+    for id in order:
+        if len( net.get( id ).values ) != 2:
+            raise ValueError( "Ravi format needs binary variables; %s has %d values"%( id, len( net.get( id ).values ) ) )
+
+    f.write( "%d\n"%( len( order ) ) )
+    for id in order:
+        node = net.get( id )
+        f.write( "{\n" )
+        f.write( ' '.join( [ str( number[ p ] ) for p in node.parents ] ) + "\n" )
+        # A parent's first value is written as 1, its second as 0
+        for row in itertools.product( ( 1, 0 ), repeat=len( node.parents ) ):
+            pr = node.cpt[ tuple( [ 1 - bit for bit in row ] ) ][ 0 ]
+            f.write( ' '.join( map( str, row ) + [ repr( float( pr ) ) ] ) + "\n" )
+        f.write( "}\n" )
+
+    for evidence, variables in queries:
+        f.write( "E" )
+        for id, value in evidence.items():
+            f.write( " %d %s"%( number[ id ], 't' if net.get( id ).index[ value ] == 0 else 'f' ) )
+        f.write( "\n" )
+        for id in variables:
+            f.write( "Q %d\n"%( number[ id ] ) )
+
+def writeBIF( net, f, name='Unknown' ):
+    """
+    Write a network in BIF format. Ids and values are written with str(),
+    so they should be words
+    """
+    f.write( "network %s {\n}\n"%( name ) )
+    for id in net.topologicalOrder():
+        node = net.get( id )
+        f.write( "variable %s {\n"%( id ) )
+        f.write( "  type discrete [ %d ] { %s };\n"%( len( node.values ), ', '.join( map( str, node.values ) ) ) )
+        f.write( "}\n" )
+
+    for id in net.topologicalOrder():
+        node = net.get( id )
+        if node.parents:
+            f.write( "probability ( %s | %s ) {\n"%( id, ', '.join( map( str, node.parents ) ) ) )
+            for key in itertools.product( *node.parentValues ):
+                f.write( "  (%s) %s;\n"%( ', '.join( map( str, key ) ), ', '.join( map( repr, map( float, node.row( key ) ) ) ) ) )
+        else:
+            f.write( "probability ( %s ) {\n"%( id ) )
+            f.write( "  table %s;\n"%( ', '.join( map( repr, map( float, node.cpt ) ) ) ) )
+        f.write( "}\n" )
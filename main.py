@@ -1,30 +1,156 @@
 """
-Libbnet 
+Libbnet
 """
 
-from bnet.parsers import RaviParser, BNIFParser
-from bnet.BNet import *
-from shell import NetShell
+import time
+START = time.time()
 
 import sys
 
 def main():
-    if len( sys.argv ) != 2:
-        print "Usage: %s <file>"%( sys.argv[ 0 ] )
+    import optparse
+
+    usage = "Usage: %prog [options] <file>\n       %prog --batch [options] <file>...\n       %prog --learn <data.csv> [options] <file>\n       %prog --generate <data> [options] <file>\n       %prog --serve <address> [options] <file>..."
+    opts = optparse.OptionParser( usage )
+    opts.add_option( "-b", "--batch", action="store_true", default=False,
+            help="answer the queries in the files, and print the results as JSON lines" )
+    opts.add_option( "-e", "--engine", default="exact", choices=[ "exact", "gibbs", "lw" ],
+            help="inference engine for batch queries: exact, gibbs or lw (likelihood weighting) [%default]" )
+    opts.add_option( "--burn-in", type="int", default=100, dest="burnIn", help="Gibbs burn in sweeps [%default]" )
+    opts.add_option( "--sweeps", type="int", default=1000, help="Gibbs sweeps [%default]" )
+    opts.add_option( "--settle", type="int", default=10,
+            help="Gibbs sweeps the shell runs in place of the burn in when it resumes chains after the evidence changed [%default]" )
+    opts.add_option( "--samples", type="int", default=100000, help="samples for lw and --generate [%default]" )
+    opts.add_option( "--chains", type="int", default=1, help="Gibbs chains [%default]" )
+    opts.add_option( "--seed", type="int", default=None, help="Gibbs random seed" )
+    opts.add_option( "--blocks", default="family", choices=[ "none", "family", "clique" ],
+            help="sample blocks of variables jointly: family or clique, or none to update one at a time [%default]" )
+    opts.add_option( "--estimator", default="counts", choices=[ "counts", "rao-blackwell" ],
+            help="Gibbs marginals from counts of the values taken, or from the conditionals they are drawn from [%default]" )
+    opts.add_option( "--no-cache", action="store_false", default=True, dest="cache",
+            help="always parse, and do not write the .bnc cache next to the file" )
+    opts.add_option( "--posteriors", default=None, metavar="FILE",
+            help="keep the shell's cache of query results in FILE between sessions" )
+    opts.add_option( "--timing", action="store_true", default=False,
+            help="print startup and load times to stderr" )
+    opts.add_option( "-l", "--learn", default=None, metavar="CSV",
+            help="estimate the CPTs of the network from the data in CSV, and print it as BIF" )
+    opts.add_option( "-g", "--generate", default=None, metavar="FILE",
+            help="write samples of the network to FILE, as .npy or CSV" )
+    opts.add_option( "--alpha", type="float", default=1.0, help="Dirichlet pseudo count for --learn [%default]" )
+    opts.add_option( "--em", type="int", default=0, metavar="N",
+            help="run up to N rounds of EM with the engine, for data with missing values" )
+    opts.add_option( "--serve", default=None, metavar="ADDRESS",
+            help="answer JSON line queries on the networks over a Unix socket path or [host:]port" )
+    opts.add_option( "--workers", type="int", default=None,
+            help="processes answering sampling queries for --serve; 0 for none [cpu count]" )
+    opts.add_option( "--stats", action="store_true", default=False,
+            help="collect inference timers and counters; printed to stderr after a batch, and by %stats in the shell" )
+    options, args = opts.parse_args()
+    if options.blocks == "none":
+        options.blocks = None
+
+    if not args or ( len( args ) != 1 and not options.batch and not options.serve ):
+        opts.print_usage()
         sys.exit( 1 )
 
-    filename = sys.argv[ 1 ]
+    timer = Timer( options.timing )
+    timer.report( "startup", START )
+
+    if options.stats:
+        from bnet import instrument
+        instrument.enable()
+
+    if options.batch:
+        from bnet.batch import BatchRunner
+        runner = BatchRunner( options.engine, sys.stdout, options.burnIn, options.sweeps, options.chains, options.seed, options.blocks, options.samples, options.estimator )
+        for filename in args:
+            start = time.time()
+            batch = load( filename, options.cache )
+            timer.report( "load %s"%( filename ), start )
+            for i, ( n, queries ) in enumerate( batch ):
+                runner.run( n, queries, "%s:%d"%( filename, i ) )
+        timer.report( "total", START )
+        if options.stats:
+            sys.stderr.write( instrument.format() + "\n" )
+        return
+
+    if options.serve:
+        from bnet.server import QueryServer
+        networks = {}
+        for filename in args:
+            start = time.time()
+            batch = load( filename, options.cache )
+            timer.report( "load %s"%( filename ), start )
+            for i, ( n, queries ) in enumerate( batch ):
+                networks[ filename if len( batch ) == 1 else "%s:%d"%( filename, i ) ] = n
+        server = QueryServer( networks, options.workers, burnIn=options.burnIn, sweeps=options.sweeps,
+                chains=options.chains, seed=options.seed, blocks=options.blocks, estimator=options.estimator, samples=options.samples )
+        timer.report( "ready", START )
+        server.serve( options.serve )
+        return
+
+    start = time.time()
+    batch = load( args[ 0 ], options.cache )
+    timer.report( "load %s"%( args[ 0 ] ), start )
+
+    if options.generate:
+        from bnet.forward import ForwardSampler
+        start = time.time()
+        ForwardSampler( batch[ 0 ][ 0 ], seed=options.seed ).write( options.generate, options.samples )
+        timer.report( "generate %s"%( options.generate ), start )
+        return
 
-    n = None
-    for parser in [ RaviParser, BNIFParser ]:
+    if options.learn:
+        from bnet import learn, writers
+        start = time.time()
         try:
-            p = parser()
-            n = p.parseFile( filename )
-        except Exception:
-            continue
-    if n:
-        shell = NetShell( n )
-        shell.run()
+            data = learn.CSVData( options.learn, batch[ 0 ][ 0 ] )
+            if options.em:
+                net = learn.em( batch[ 0 ][ 0 ], data, options.alpha, options.em, engine=options.engine, seed=options.seed )
+            else:
+                net = learn.mle( batch[ 0 ][ 0 ], data, options.alpha )
+        except ValueError, e:
+            sys.stderr.write( "Error: %s\n"%( e ) )
+            sys.exit( 1 )
+        timer.report( "learn %s"%( options.learn ), start )
+        writers.writeBIF( net, sys.stdout )
+        return
 
-if __name__ == "__main__": main()
+    timer.report( "ready", START )
 
+    from shell import NetShell
+    from bnet.memo import PosteriorCache
+    shell = NetShell( batch[ 0 ][ 0 ], PosteriorCache( path=options.posteriors ), options.burnIn, options.sweeps, options.blocks, options.samples,
+            options.settle, options.chains, options.seed, options.estimator )
+    shell.run()
+
+class Timer:
+    """Prints elapsed times to stderr, if enabled"""
+
+    def __init__( self, enabled ):
+        self.enabled = enabled
+
+    def report( self, what, start ):
+        if self.enabled:
+            sys.stderr.write( "%s: %.1fms\n"%( what, ( time.time() - start ) * 1000 ) )
+
+def load( filename, cache=True ):
+    """Parse a file into a list of ( net, queries ), with the one parser
+    for its format, and through the binary cache if asked to"""
+    if cache:
+        from bnet import netfile
+        return netfile.loadCached( filename, lambda f: load( f, False ) )
+
+    from bnet import parsers
+    return parsers.parserFor( filename ).parseBatchFile( filename )
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception, e:
+        from bnet.parsers import ParseException
+        if not isinstance( e, ( ParseException, IOError ) ):
+            raise
+        sys.stderr.write( "Error: %s\n"%( e ) )
+        sys.exit( 1 )
@@ -2,21 +2,83 @@
 Libbnet shell
 """
 
-from bnet.parsers import RaviParser, BNIFParser
 from bnet.BNet import *
+from bnet.memo import PosteriorCache
+from bnet import instrument
 
 import sys
-import readline
 
 class NetShell():
     """
     Shell to interact with a Bayesian network
     """
 
-    def __init__( self, net ):
+    def __init__( self, net, cache=None, burnIn=100, sweeps=1000, blocks='family', samples=100000, settle=10, chains=1, seed=None, estimator='counts' ):
+        """
+        @cache - PosteriorCache for query results; a fresh one if None
+        @burnIn, @sweeps, @blocks, @chains, @seed, @estimator - settings
+            of the Gibbs engine, whose chains are kept on each context
+        @settle - sweeps run by chains resumed after the evidence changed,
+            in place of the burn in
+        @samples - samples drawn by the likelihood weighting engine
+        """
         self.net = net
         self.running = False
         self.context = []
+        self.cache = cache if cache is not None else PosteriorCache()
+        self.burnIn = burnIn
+        self.sweeps = sweeps
+        self.blocks = blocks
+        self.samples = samples
+        self.settle = settle
+        self.chains = chains
+        self.seed = seed
+        self.estimator = estimator
+        self.tree = None
+
+    def resolve( self, token ):
+        """Id of the variable named by token; ids may be ints or strings"""
+        if token in self.net.variables:
+            return token
+        try:
+            if int( token ) in self.net.variables:
+                return int( token )
+        except ValueError:
+            pass
+        raise KeyError( token )
+
+    def parseValue( self, id, token ):
+        """Value of a variable named by token"""
+        for value in self.net.get( id ).values:
+            if str( value ) == token:
+                return value
+        raise ValueError( token )
+
+    def query( self, id, engine ):
+        """Posterior of a variable in the current context, as a dict of
+        value to probability"""
+        ctx = self.getContext()
+        if engine == "exact":
+            def compute():
+                if self.tree is None:
+                    from bnet.jtree import JunctionTree
+                    self.tree = JunctionTree( self.net )
+                return self.tree.query( ctx, id )
+            return self.cache.lookup( self.net, ctx, id, engine, compute )
+        elif engine == "gibbs":
+            # The chains on the context answer for its evidence, and are
+            # resumed when it changes, so they take the place of the cache
+            from bnet.sampling import warmGibbs
+            return warmGibbs( self.net, ctx, self.burnIn, self.sweeps, self.settle, self.chains, self.seed, self.blocks, self.estimator )[ id ]
+        elif engine == "lw":
+            def compute():
+                from bnet.forward import ForwardSampler
+                from bnet.prune import prune
+                net, sub = prune( self.net, ctx, id )
+                return ForwardSampler( net, sub ).marginals( self.samples )[ id ]
+            return self.cache.lookup( self.net, ctx, id, engine, compute, samples=self.samples )
+        else:
+            raise ValueError( engine )
 
     def getContext( self ):
         if self.context:
@@ -25,6 +87,9 @@ class NetShell():
             return None
 
     def run( self ):
+        # Line editing, only needed once the shell is interactive
+        import readline
+
         self.running = True
         self.context = [ Context( self.net ) ]
         while self.running:
@@ -35,22 +100,102 @@ class NetShell():
 
             except EOFError:
                 break
+        self.cache.save()
 
     def shellFunc( self, cmd ):
         args = cmd.split()
+        if not args:
+            return
         if args[0] == "vars":
             if len( args ) > 1:
-                id = args[1]
-                print str( self.net.variables[ id ] )
+                try:
+                    print str( self.net.get( self.resolve( args[1] ) ) )
+                except KeyError:
+                    print "Error: No variable %s"%( args[1] )
             else:
                 print self.net.variables.keys()
         elif args[0] == "set": 
+            if len( args ) == 3:
+                try:
+                    id = self.resolve( args[1] )
+                    self.getContext().setVariable( id, self.parseValue( id, args[2] ) )
+                except KeyError:
+                    print "Error: No variable %s"%( args[1] )
+                except ValueError:
+                    print "Error: %s is not a value of %s"%( args[2], args[1] )
+            else:
+                print "Node id and value required"
+        elif args[0] == "unset":
             if len( args ) == 2:
-                id = int( args[1] )
-                val = (args[2] == 'True')
-                print str( self.net.variables[ id ] )
+                try:
+                    self.getContext().unsetVariable( self.resolve( args[1] ) )
+                except KeyError:
+                    print "Error: No variable %s"%( args[1] )
+            else:
+                print "Usage: %unset <id>"
+        elif args[0] == "ctx":
+            print self.getContext()
+        elif args[0] == "query":
+            if len( args ) in ( 2, 3 ):
+                engine = args[2] if len( args ) == 3 else "exact"
+                try:
+                    dist = self.query( self.resolve( args[1] ), engine )
+                    for value in self.net.get( self.resolve( args[1] ) ).values:
+                        print "%s\t%f"%( value, dist[ value ] )
+                except KeyError:
+                    print "Error: No variable %s"%( args[1] )
+                except ValueError:
+                    print "Error: Unknown engine %s"%( engine )
+                except ZeroDivisionError:
+                    print "Error: The evidence is impossible"
+            else:
+                print "Usage: %query <id> [exact|gibbs|lw]"
+        elif args[0] == "refine":
+            try:
+                sweeps = int( args[1] ) if len( args ) > 1 else self.sweeps
+            except ValueError:
+                print "Usage: %refine [<sweeps>]"
+                return
+            from bnet.sampling import warmChains
+            chains = warmChains( self.net, self.getContext(), self.chains, self.seed, self.blocks, self.estimator )
+            chains.marginals( self.burnIn, 0, self.settle )
+            chains.refine( sweeps )
+            print "%d sweeps under this evidence"%( chains.sampler.sweeps )
+        elif args[0] in ( "mpe", "map" ):
+            if args[0] == "map" and len( args ) < 2:
+                print "Usage: %map <id> [<id>...]"
+                return
+            from bnet import mpe
+            try:
+                if args[0] == "mpe":
+                    found = mpe.mpe( self.net, self.getContext() )
+                else:
+                    found = mpe.mapQuery( self.net, self.getContext(), [ self.resolve( a ) for a in args[1:] ] )
+                for id in sorted( found[ 'assignment' ] ):
+                    print "%s\t%s"%( id, found[ 'assignment' ][ id ] )
+                print "log p\t%f%s"%( found[ 'logp' ], "" if found[ 'exact' ] else " (local search)" )
+            except KeyError, e:
+                print "Error: No variable %s"%( e.args[0] )
+            except ZeroDivisionError:
+                print "Error: The evidence is impossible"
+        elif args[0] == "cache":
+            if len( args ) == 2 and args[1] == "clear":
+                self.cache.clear()
+            elif len( args ) == 2 and args[1] == "save":
+                self.cache.save()
+            else:
+                print self.cache.stats()
+        elif args[0] == "stats":
+            if len( args ) == 1:
+                print instrument.format()
+            elif args[1] == "on":
+                instrument.enable()
+            elif args[1] == "off":
+                instrument.disable()
+            elif args[1] == "reset":
+                instrument.reset()
             else:
-                print "Node id and valure required"
+                print "Usage: %stats [on|off|reset]"
         elif args[0] == "push":
             self.context.append( Context( self.net, self.getContext() ) )
         elif args[0] == "pop":
@@ -0,0 +1,58 @@
+"""
+Brute force inference by enumerating the joint distribution, for checking
+the inference engines on small networks
+"""
+
+import numpy
+
+from bnet.BNet import Context
+
+def joint( net ):
+    """Joint distribution as an array with one axis per variable, in the
+    order of net.ids"""
+    pos = dict( [ ( id, i ) for i, id in enumerate( net.ids ) ] )
+    cards = [ len( net.get( id ).values ) for id in net.ids ]
+    table = numpy.ones( cards )
+    for id in net.ids:
+        node = net.get( id )
+        axes = [ pos[ p ] for p in node.parents ] + [ pos[ id ] ]
+        order = numpy.argsort( axes )
+        shape = [ 1 ] * len( cards )
+        for a in axes:
+            shape[ a ] = cards[ a ]
+        table = table * numpy.asarray( node.cpt, dtype=float ).transpose( order ).reshape( shape )
+    return table
+
+def restrict( net, table, evidence ):
+    """The joint with every entry disagreeing with the evidence zeroed;
+    evidence is a dict of id to value"""
+    table = table.copy()
+    for id, value in evidence.items():
+        axis = net.ids.index( id )
+        mask = numpy.zeros( table.shape[ axis ] )
+        mask[ net.get( id ).index[ value ] ] = 1
+        shape = [ 1 ] * table.ndim
+        shape[ axis ] = len( mask )
+        table *= mask.reshape( shape )
+    return table
+
+def posterior( net, evidence, id ):
+    """Pr( id | evidence ) as a dict of value to probability"""
+    table = restrict( net, joint( net ), evidence )
+    axis = net.ids.index( id )
+    p = table.sum( axis=tuple( [ a for a in range( table.ndim ) if a != axis ] ) )
+    return dict( zip( net.get( id ).values, p / p.sum() ) )
+
+def context( net, evidence ):
+    ctx = Context( net )
+    for id, value in evidence.items():
+        ctx.setVariable( id, value )
+    return ctx
+
+def someEvidence( net, random, k ):
+    """Values for k variables drawn from those with positive probability
+    jointly, so the evidence is possible"""
+    table = joint( net ).ravel()
+    state = numpy.unravel_index( random.choice( len( table ), p=table / table.sum() ), [ len( net.get( id ).values ) for id in net.ids ] )
+    chosen = random.choice( len( net.ids ), k, replace=False )
+    return dict( [ ( net.ids[ i ], net.get( net.ids[ i ] ).values[ state[ i ] ] ) for i in chosen ] )
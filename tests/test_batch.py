@@ -0,0 +1,57 @@
+"""
+Batch answers, with bad queries among good ones
+"""
+
+from cStringIO import StringIO
+import json
+import unittest
+
+from bnet.BNet import BNet, BNode
+from bnet.batch import BatchRunner
+
+from tests.brute import posterior
+
+class BatchRunnerTest( unittest.TestCase ):
+
+    def net( self ):
+        # b is never False
+        net = BNet()
+        net.add( BNode( 'a', (), values=( 'T', 'F' ), cpt=[ 0.3, 0.7 ] ) )
+        net.add( BNode( 'b', ( 'a', ), values=( 'T', 'F' ), cpt=[ [ 1.0, 0.0 ], [ 1.0, 0.0 ] ] ) )
+        net.add( BNode( 'c', ( 'a', ), values=( 'T', 'F' ), cpt=[ [ 0.9, 0.1 ], [ 0.2, 0.8 ] ] ) )
+        return net
+
+    def answer( self, engine ):
+        net = self.net()
+        queries = [
+            ( { 'c' : 'T' }, [ 'a' ] ),
+            ( { 'c' : 'maybe' }, [ 'a' ] ),
+            ( { 'd' : 'T' }, [ 'a' ] ),
+            ( { 'c' : 'T' }, [ 'a', 'd' ] ),
+            ( { 'b' : 'F' }, [ 'a' ] ),
+            ( {}, [ 'c' ] ),
+            ]
+        out = StringIO()
+        BatchRunner( engine, out, seed=1 ).run( net, queries, 'test' )
+        return net, [ json.loads( line ) for line in out.getvalue().splitlines() ][ 1: ]
+
+    def testBadQueries( self ):
+        net, lines = self.answer( 'exact' )
+        self.assertEqual( [ ( line[ 'query' ], 'error' in line ) for line in lines ],
+                [ ( 'a', False ), ( 'a', True ), ( 'a', True ), ( 'a', False ), ( 'd', True ), ( 'a', True ), ( 'c', False ) ] )
+        self.assertEqual( lines[ 1 ][ 'error' ], "maybe is not a value of c" )
+        self.assertEqual( lines[ 2 ][ 'error' ], "No variable d" )
+        self.assertEqual( lines[ 4 ][ 'error' ], "No variable d" )
+        self.assertEqual( lines[ 5 ][ 'error' ], "The evidence is impossible" )
+        expected = posterior( net, {}, 'c' )
+        for v, p in lines[ 6 ][ 'distribution' ].items():
+            self.assertAlmostEqual( p, expected[ v ], 12 )
+
+    def testSampledEngines( self ):
+        for engine in ( 'gibbs', 'lw' ):
+            net, lines = self.answer( engine )
+            self.assertEqual( lines[ 1 ][ 'error' ], "maybe is not a value of c" )
+            self.assertTrue( 'distribution' in lines[ -1 ], engine )
+
+if __name__ == '__main__':
+    unittest.main()
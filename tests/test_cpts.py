@@ -0,0 +1,108 @@
+"""
+Compact CPTs expand to the tables they stand for
+"""
+
+import itertools
+import unittest
+
+import numpy
+
+from bnet.cpts import NoisyMax, Deterministic, TreeCPT, compress, isCompact
+
+class CPTTest( unittest.TestCase ):
+
+    def assertTable( self, cpt, table ):
+        self.assertEqual( cpt.shape, table.shape )
+        self.assertTrue( numpy.allclose( cpt.dense(), table, rtol=0, atol=1e-12 ), ( cpt, cpt.dense(), table ) )
+
+    def noisyOrTable( self, probabilities, leak ):
+        """Noisy-OR by its definition, with value 1 as on"""
+        table = numpy.zeros( ( 2, ) * len( probabilities ) + ( 2, ) )
+        for parents in itertools.product( ( 0, 1 ), repeat=len( probabilities ) ):
+            off = 1 - leak
+            for p, v in zip( probabilities, parents ):
+                if v:
+                    off *= 1 - p
+            table[ parents ] = ( off, 1 - off )
+        return table
+
+    def testNoisyOr( self ):
+        probabilities, leak = [ 0.8, 0.3, 0.55 ], 0.05
+        table = self.noisyOrTable( probabilities, leak )
+        self.assertTable( NoisyMax.noisyOr( probabilities, leak, on=1 ), table )
+        self.assertTable( NoisyMax.noisyOr( probabilities, leak, on=0 ), table[ ::-1, ::-1, ::-1, ::-1 ] )
+        self.assertTable( NoisyMax.detect( table ), table )
+
+    def testNoisyMax( self ):
+        # Three values of X and of each parent; value 0 of each parent is off
+        random = numpy.random.RandomState( 2 )
+        leak = numpy.array( [ 0.7, 0.9, 1.0 ] )
+        cdfs = []
+        for i in range( 2 ):
+            c = numpy.ones( ( 3, 3 ) )
+            c[ 1: ] = numpy.sort( random.uniform( 0.2, 1, size=( 2, 3 ) ), axis=1 )
+            c[ 1:, -1 ] = 1
+            cdfs.append( c )
+        cpt = NoisyMax( leak, cdfs )
+        table = numpy.zeros( ( 3, 3, 3 ) )
+        for a, b in itertools.product( range( 3 ), repeat=2 ):
+            cdf = leak * cdfs[ 0 ][ a ] * cdfs[ 1 ][ b ]
+            table[ a, b ] = numpy.diff( numpy.concatenate( ( [ 0 ], cdf ) ) )
+        self.assertTable( cpt, table )
+        self.assertTable( NoisyMax.detect( table ), table )
+
+    def testDeterministic( self ):
+        f = lambda a, b: ( a + 2 * b ) % 3
+        cpt = Deterministic.fromFunction( ( 3, 4 ), 3, f )
+        table = numpy.zeros( ( 3, 4, 3 ) )
+        for a, b in itertools.product( range( 3 ), range( 4 ) ):
+            table[ a, b, f( a, b ) ] = 1
+        self.assertTable( cpt, table )
+        self.assertTable( Deterministic.detect( table ), table )
+
+    def testTree( self ):
+        # X depends on B only when A is 1, and on nothing else
+        low, high, other = [ 0.1, 0.9 ], [ 0.6, 0.4 ], [ 0.25, 0.75 ]
+        cpt = TreeCPT.fromNested( ( 0, [ low, ( 1, [ high, other, low ] ) ] ), ( 2, 3, 4, 2 ) )
+        table = numpy.zeros( ( 2, 3, 4, 2 ) )
+        table[ 0 ] = low
+        table[ 1, 0 ] = high
+        table[ 1, 1 ] = other
+        table[ 1, 2 ] = low
+        self.assertTable( cpt, table )
+        found = TreeCPT.detect( table )
+        self.assertTable( found, table )
+        self.assertEqual( len( found.leaves ), 4 )
+
+    def testDetectRejects( self ):
+        table = numpy.random.RandomState( 3 ).dirichlet( [ 1, 1, 1 ], size=( 4, 4 ) )
+        self.assertEqual( Deterministic.detect( table ), None )
+        self.assertEqual( NoisyMax.detect( table ), None )
+        self.assertEqual( TreeCPT.detect( table, maxLeaves=8 ), None )
+
+    def testCompress( self ):
+        f = lambda a, b, c: ( a + b + c ) % 2
+        table = Deterministic.fromFunction( ( 4, 4, 4 ), 2, f ).dense()
+        cpt = compress( table )
+        self.assertTrue( isinstance( cpt, Deterministic ) )
+        self.assertTable( cpt, table )
+
+        table = self.noisyOrTable( [ 0.3 ] * 6, 0.01 )
+        cpt = compress( table )
+        self.assertTrue( isCompact( cpt ) )
+        self.assertTable( cpt, table )
+
+    def testCompressKeepsDense( self ):
+        random = numpy.random.RandomState( 4 )
+        for shape in ( ( 4, 4, 3 ), ( 3, 5, 2, 2 ), ( 8, 8, 4 ) ):
+            table = random.dirichlet( numpy.ones( shape[ -1 ] ), size=shape[ :-1 ] )
+            kept = compress( table )
+            self.assertFalse( isCompact( kept ) )
+            self.assertTrue( ( kept == table ).all() )
+
+        # Too small to be worth compressing, though it is deterministic
+        table = numpy.eye( 2 )[ numpy.array( [ [ 0, 1 ], [ 1, 0 ] ] ) ]
+        self.assertFalse( isCompact( compress( table ) ) )
+
+if __name__ == '__main__':
+    unittest.main()
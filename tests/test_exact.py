@@ -0,0 +1,44 @@
+"""
+Variable elimination against brute force enumeration
+"""
+
+import unittest
+
+import numpy
+
+from bnet.BNet import BNet, BNode
+from bnet.generate import randomNet
+from bnet import algos
+
+from tests.brute import posterior, context, someEvidence
+
+class ExactQueryTest( unittest.TestCase ):
+
+    def assertMatches( self, net, evidence ):
+        ctx = context( net, evidence )
+        for id in net.ids:
+            found = algos.exactQuery( net, ctx, id )
+            expected = posterior( net, evidence, id )
+            for v in net.get( id ).values:
+                self.assertAlmostEqual( found[ v ], expected[ v ], 12, ( id, evidence ) )
+
+    def testPrior( self ):
+        for seed in range( 10 ):
+            self.assertMatches( randomNet( 8, maxParents=3, arity=( 2, 3 ), seed=seed ), {} )
+
+    def testEvidence( self ):
+        random = numpy.random.RandomState( 1 )
+        for seed in range( 10 ):
+            net = randomNet( 8, maxParents=3, arity=( 2, 3 ), sparsity=0.2, seed=seed )
+            for k in ( 1, 3 ):
+                self.assertMatches( net, someEvidence( net, random, k ) )
+
+    def testImpossibleEvidence( self ):
+        # b is never False, whatever a is
+        net = BNet()
+        net.add( BNode( 'a', (), values=( True, False ), cpt=[ 0.3, 0.7 ] ) )
+        net.add( BNode( 'b', ( 'a', ), values=( True, False ), cpt=[ [ 1.0, 0.0 ], [ 1.0, 0.0 ] ] ) )
+        self.assertRaises( ZeroDivisionError, algos.exactQuery, net, context( net, { 'b' : False } ), 'a' )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""
+Junction tree marginals, and reuse of cached messages across evidence
+"""
+
+import unittest
+
+import numpy
+
+from bnet.generate import randomNet
+from bnet.jtree import JunctionTree
+
+from tests.brute import posterior, context, someEvidence
+
+class JunctionTreeTest( unittest.TestCase ):
+
+    def assertSame( self, found, expected, what ):
+        for id in expected:
+            for v in expected[ id ]:
+                self.assertAlmostEqual( found[ id ][ v ], expected[ id ][ v ], 12, ( what, id ) )
+
+    def testMarginals( self ):
+        random = numpy.random.RandomState( 2 )
+        for seed in range( 8 ):
+            net = randomNet( 9, maxParents=3, arity=( 2, 3 ), sparsity=0.2, seed=seed )
+            tree = JunctionTree( net )
+            for evidence in ( {}, someEvidence( net, random, 2 ) ):
+                expected = dict( [ ( id, posterior( net, evidence, id ) ) for id in net.ids ] )
+                self.assertSame( tree.marginals( context( net, evidence ) ), expected, evidence )
+
+    def testChangedEvidence( self ):
+        random = numpy.random.RandomState( 3 )
+        net = randomNet( 12, maxParents=3, window=4, seed=5 )
+        tree = JunctionTree( net )
+        tree.marginals( context( net, {} ) )
+        for step in range( 10 ):
+            # Evidence on one to three variables, or none, in turn
+            evidence = someEvidence( net, random, 1 + step % 3 ) if step % 4 else {}
+            ctx = context( net, evidence )
+            tree.setEvidence( ctx )
+            warm = tree.marginals()
+            self.assertSame( warm, JunctionTree( net ).marginals( ctx ), evidence )
+            self.assertSame( warm, dict( [ ( id, posterior( net, evidence, id ) ) for id in net.ids ] ), evidence )
+
+    def testInvalidatesOnlyChangedMessages( self ):
+        net = randomNet( 12, maxParents=2, window=3, seed=7 )
+        tree = JunctionTree( net )
+        tree.calibrate( context( net, {} ) )
+        before = dict( tree.messages )
+        tree.setEvidence( context( net, { 12 : True } ) )
+        self.assertTrue( 0 < len( tree.messages ) < len( before ) )
+        for key, message in tree.messages.items():
+            self.assertTrue( message is before[ key ] )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Counting data into CPTs, from arrays, .npy files and CSV files
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from bnet.BNet import BNet, BNode
+from bnet.learn import ArrayData, CSVData, npyData, mle, MISSING
+
+# Rows of ( A, B, C ) value indices for A -> B, A -> C <- B
+ROWS = [
+    ( 0, 0, 1 ),
+    ( 0, 1, 0 ),
+    ( 0, 1, 1 ),
+    ( 1, 2, 0 ),
+    ( 1, 2, 0 ),
+    ( 1, 0, 1 ),
+    ( 0, 1, 1 ),
+    ( 1, MISSING, 1 ),
+    ( MISSING, 2, 0 ),
+]
+
+class LearnTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.net = BNet()
+        self.net.add( BNode( 'A', (), values=( 'lo', 'hi' ), cpt=numpy.array( [ 0.5, 0.5 ] ) ) )
+        self.net.add( BNode( 'B', ( 'A', ), values=( 'r', 'g', 'b' ), cpt=numpy.ones( ( 2, 3 ) ) / 3 ) )
+        self.net.add( BNode( 'C', ( 'A', 'B' ), values=( 0, 1 ), cpt=numpy.ones( ( 2, 3, 2 ) ) / 2 ) )
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.dir )
+
+    def testCounts( self ):
+        learned = mle( self.net, ArrayData( numpy.array( ROWS ), [ 'A', 'B', 'C' ] ), alpha=0 )
+
+        # A is observed in 8 rows, 4 of them lo
+        self.assertTrue( numpy.allclose( learned.get( 'A' ).cpt, [ 4. / 8, 4. / 8 ] ) )
+        # Rows with A and B: lo -> r, g, g, g; hi -> b, b, r
+        self.assertTrue( numpy.allclose( learned.get( 'B' ).cpt, [ [ 1. / 4, 3. / 4, 0 ], [ 1. / 3, 0, 2. / 3 ] ] ) )
+        # Families of C seen: ( lo, r ): 1; ( lo, g ): 0, 1, 1; ( hi, r ): 1;
+        # ( hi, b ): 0, 0; the rest are never seen and stay uniform
+        expected = numpy.array( [ [ [ 0, 1 ], [ 1. / 3, 2. / 3 ], [ 0.5, 0.5 ] ],
+                                  [ [ 0, 1 ], [ 0.5, 0.5 ], [ 1, 0 ] ] ] )
+        self.assertTrue( numpy.allclose( learned.get( 'C' ).cpt, expected ) )
+
+        # A pseudo count of one is added to every entry
+        learned = mle( self.net, ArrayData( numpy.array( ROWS ), [ 'A', 'B', 'C' ] ), alpha=1 )
+        self.assertTrue( numpy.allclose( learned.get( 'B' ).cpt[ 0 ], [ 2. / 7, 4. / 7, 1. / 7 ] ) )
+
+    def testColumnsInAnyOrder( self ):
+        rows = numpy.array( ROWS )
+        expected = mle( self.net, ArrayData( rows, [ 'A', 'B', 'C' ] ) )
+        found = mle( self.net, ArrayData( rows[ :, [ 2, 0, 1 ] ], [ 'C', 'A', 'B' ] ) )
+        for id in 'ABC':
+            self.assertTrue( ( found.get( id ).cpt == expected.get( id ).cpt ).all() )
+
+    def write( self, rows ):
+        """The rows as a CSV file and as a .npy file"""
+        csvName = os.path.join( self.dir, 'data.csv' )
+        f = open( csvName, 'w' )
+        f.write( 'C,A,B\n' )
+        for a, b, c in rows:
+            cells = [ self.net.get( id ).values[ v ] if v != MISSING else '?' for id, v in ( ( 'C', c ), ( 'A', a ), ( 'B', b ) ) ]
+            f.write( ','.join( map( str, cells ) ) + '\n' )
+        f.close()
+        npyName = os.path.join( self.dir, 'data.npy' )
+        numpy.save( npyName, numpy.array( rows ) )
+        return csvName, npyName
+
+    def testChunks( self ):
+        random = numpy.random.RandomState( 6 )
+        rows = numpy.column_stack( [ random.randint( 0, 2, 500 ), random.randint( 0, 3, 500 ), random.randint( 0, 2, 500 ) ] )
+        rows[ random.rand( *rows.shape ) < 0.1 ] = MISSING
+        csvName, npyName = self.write( rows )
+
+        expected = mle( self.net, ArrayData( rows, [ 'A', 'B', 'C' ], chunk=len( rows ) ), alpha=0 )
+        for chunk in ( 1, 7, 64, 499, 500, 10000 ):
+            for data in ( CSVData( csvName, self.net, chunk ), npyData( npyName, [ 'A', 'B', 'C' ], chunk ) ):
+                found = mle( self.net, data, alpha=0 )
+                for id in 'ABC':
+                    self.assertTrue( ( found.get( id ).cpt == expected.get( id ).cpt ).all(), ( chunk, data, id ) )
+
+    def testCSVErrors( self ):
+        csvName = os.path.join( self.dir, 'bad.csv' )
+        open( csvName, 'w' ).write( 'A,B,C\nlo,r,0\nlo,purple,1\n' )
+        self.assertRaises( ValueError, mle, self.net, CSVData( csvName, self.net ) )
+        open( csvName, 'w' ).write( 'A,D\nlo,r\n' )
+        self.assertRaises( ValueError, CSVData, csvName, self.net )
+
+if __name__ == '__main__':
+    unittest.main()
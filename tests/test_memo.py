@@ -0,0 +1,98 @@
+"""
+The posterior cache: keys, least recently used eviction and its file
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from bnet.generate import randomNet
+from bnet.memo import PosteriorCache
+
+from tests.brute import context
+
+class MemoTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.net = randomNet( 5, seed=1 )
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.dir )
+
+    def ask( self, cache, query, evidence={}, engine='exact', net=None, **params ):
+        """Look a question up, returning the result and whether it was
+        computed"""
+        computed = []
+        def compute():
+            computed.append( query )
+            return ( query, sorted( evidence.items() ), engine, sorted( params.items() ) )
+        net = net or self.net
+        result = cache.lookup( net, context( net, evidence ), query, engine, compute, **params )
+        return result, bool( computed )
+
+    def testKey( self ):
+        cache = PosteriorCache()
+        self.assertEqual( self.ask( cache, 1 )[ 1 ], True )
+        self.assertEqual( self.ask( cache, 1 ), ( ( 1, [], 'exact', [] ), False ) )
+        self.assertEqual( self.ask( cache, ( 1, ) )[ 1 ], False )
+
+        # Every part of the question counts
+        self.assertEqual( self.ask( cache, 2 )[ 1 ], True )
+        self.assertEqual( self.ask( cache, 1, { 3 : True } )[ 1 ], True )
+        self.assertEqual( self.ask( cache, 1, { 3 : False } )[ 1 ], True )
+        self.assertEqual( self.ask( cache, 1, engine='gibbs', sweeps=10 )[ 1 ], True )
+        self.assertEqual( self.ask( cache, 1, engine='gibbs', sweeps=20 )[ 1 ], True )
+        self.assertEqual( self.ask( cache, 1, engine='gibbs', sweeps=20 )[ 1 ], False )
+        self.assertEqual( self.ask( cache, 1, net=randomNet( 5, seed=2 ) )[ 1 ], True )
+
+        # Evidence given in any order is the same evidence
+        self.assertEqual( self.ask( cache, 1, { 3 : True, 4 : False } )[ 1 ], True )
+        self.assertEqual( self.ask( cache, 1, { 4 : False, 3 : True } )[ 1 ], False )
+        self.assertEqual( cache.stats()[ 'hits' ], 4 )
+
+    def testEviction( self ):
+        cache = PosteriorCache( size=3 )
+        for query in ( 1, 2, 3 ):
+            self.ask( cache, query )
+        # Using 1 leaves 2 the least recently used
+        self.assertEqual( self.ask( cache, 1 )[ 1 ], False )
+        self.ask( cache, 4 )
+        self.assertEqual( len( cache.entries ), 3 )
+        self.assertEqual( self.ask( cache, 3 )[ 1 ], False )
+        self.assertEqual( self.ask( cache, 1 )[ 1 ], False )
+        self.assertEqual( self.ask( cache, 4 )[ 1 ], False )
+        self.assertEqual( self.ask( cache, 2 )[ 1 ], True )
+        self.assertEqual( self.ask( cache, 3 )[ 1 ], True )
+
+    def testSaveAndLoad( self ):
+        path = os.path.join( self.dir, 'cache' )
+        cache = PosteriorCache( path=path )
+        for query in ( 1, 2, 3 ):
+            self.ask( cache, query )
+        cache.save()
+
+        self.assertEqual( self.ask( PosteriorCache( path=path ), 2 )[ 1 ], False )
+        # A smaller cache keeps the most recently used
+        small = PosteriorCache( size=2, path=path )
+        self.assertEqual( [ self.ask( small, query )[ 1 ] for query in ( 3, 2, 1 ) ], [ False, False, True ] )
+
+    def testBrokenFile( self ):
+        path = os.path.join( self.dir, 'cache' )
+        cache = PosteriorCache( path=path )
+        for query in ( 1, 2 ):
+            self.ask( cache, query )
+        cache.save()
+        data = open( path, 'rb' ).read()
+
+        for broken in ( data[ :len( data ) / 2 ], '', 'not a pickle' ):
+            open( path, 'wb' ).write( broken )
+            cache = PosteriorCache( path=path )
+            self.assertEqual( len( cache.entries ), 0 )
+            self.assertEqual( self.ask( cache, 1 )[ 1 ], True )
+            cache.save()
+            self.assertEqual( len( PosteriorCache( path=path ).entries ), 1 )
+
+if __name__ == '__main__':
+    unittest.main()
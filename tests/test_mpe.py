@@ -0,0 +1,66 @@
+"""
+MPE and MAP queries against brute force maximization
+"""
+
+import unittest
+
+import numpy
+
+from bnet.generate import randomNet
+from bnet import mpe
+
+from tests.brute import joint, restrict, context, someEvidence
+
+def logJoint( net, assignment ):
+    """log Pr of a full assignment of id to value"""
+    return sum( [ numpy.log( net.get( id ).row( [ assignment[ p ] for p in net.get( id ).parents ] )[ net.get( id ).index[ assignment[ id ] ] ] )
+            for id in net.ids ] )
+
+class MPETest( unittest.TestCase ):
+
+    def nets( self ):
+        random = numpy.random.RandomState( 4 )
+        for seed in range( 8 ):
+            net = randomNet( 8, maxParents=3, arity=( 2, 3 ), seed=seed )
+            for evidence in ( {}, someEvidence( net, random, 2 ) ):
+                yield net, evidence
+
+    def testMPE( self ):
+        for net, evidence in self.nets():
+            table = restrict( net, joint( net ), evidence )
+            found = mpe.mpe( net, context( net, evidence ) )
+            self.assertTrue( found[ 'exact' ] )
+            self.assertAlmostEqual( found[ 'logp' ], numpy.log( table.max() ), 10 )
+            self.assertAlmostEqual( logJoint( net, found[ 'assignment' ] ), numpy.log( table.max() ), 10 )
+            for id, value in evidence.items():
+                self.assertEqual( found[ 'assignment' ][ id ], value )
+
+    def testMAP( self ):
+        for net, evidence in self.nets():
+            table = restrict( net, joint( net ), evidence )
+            variables = [ id for id in net.ids[ :3 ] if id not in evidence ]
+            axes = [ net.ids.index( id ) for id in variables ]
+            summed = table.sum( axis=tuple( [ a for a in range( table.ndim ) if a not in axes ] ) )
+            found = mpe.mapQuery( net, context( net, evidence ), variables )
+            self.assertTrue( found[ 'exact' ] )
+            self.assertAlmostEqual( found[ 'logp' ], numpy.log( summed.max() ), 10 )
+            index = tuple( [ net.get( id ).index[ found[ 'assignment' ][ id ] ] for id in variables ] )
+            self.assertAlmostEqual( summed[ index ], summed.max(), 12 )
+            self.assertEqual( set( found[ 'assignment' ] ), set( variables ) | set( evidence ) )
+
+    def testFallback( self ):
+        net = randomNet( 8, maxParents=3, seed=1 )
+        ctx = context( net, {} )
+        found = mpe.mpe( net, ctx, maxStates=1, seed=1 )
+        self.assertFalse( found[ 'exact' ] )
+        self.assertEqual( set( found[ 'assignment' ] ), set( net.ids ) )
+        self.assertAlmostEqual( found[ 'logp' ], logJoint( net, found[ 'assignment' ] ), 10 )
+        self.assertFalse( mpe.mapQuery( net, ctx, [ 1, 2 ], maxStates=1, seed=1 )[ 'exact' ] )
+
+    def testNoSweeps( self ):
+        net = randomNet( 8, maxParents=3, seed=2 )
+        found = mpe.localSearch( net, context( net, {} ), sweeps=0, seed=1 )
+        self.assertAlmostEqual( found[ 'logp' ], logJoint( net, found[ 'assignment' ] ), 10 )
+
+if __name__ == '__main__':
+    unittest.main()
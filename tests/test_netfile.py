@@ -0,0 +1,118 @@
+"""
+Networks written to the binary network file read back the same, and the
+cache next to a source file is rebuilt when the source changes
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from bnet import netfile
+from bnet.BNet import BNode
+from bnet.cpts import Deterministic, NoisyMax, isCompact
+from bnet.generate import randomNet
+from bnet.parsers import BNIFParser
+from bnet.writers import writeBIF
+
+from tests import test_writers
+
+class NetfileTest( unittest.TestCase ):
+
+    assertSameNet = test_writers.RoundTripTest.assertSameNet.im_func
+
+    def setUp( self ):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.dir )
+
+    def compactNet( self, seed ):
+        """A random network with a deterministic and a noisy-OR table too"""
+        net = randomNet( 30, maxParents=3, arity=( 2, 4 ), seed=seed )
+        a, b = net.ids[ :2 ]
+        cards = ( len( net.get( a ).values ), len( net.get( b ).values ) )
+        net.add( BNode( 'f', ( a, b ), values=( 0, 1, 2 ), parentValues=[ net.get( a ).values, net.get( b ).values ],
+                        cpt=Deterministic.fromFunction( cards, 3, lambda x, y: ( x + y ) % 3 ) ) )
+        net.add( BNode( 'or', ( 'f', ), values=( False, True ), parentValues=[ ( 0, 1, 2 ) ],
+                        cpt=NoisyMax( [ 0.9, 1.0 ], [ [ [ 1, 1 ], [ 0.5, 1 ], [ 0.2, 1 ] ] ] ) ) )
+        return net
+
+    def testRoundTrip( self ):
+        fname = os.path.join( self.dir, 'nets.bnc' )
+        first, second = self.compactNet( 1 ), randomNet( 50, maxParents=4, seed=2 )
+        queries = [ ( { first.ids[ 0 ] : first.get( first.ids[ 0 ] ).values[ 1 ] }, [ 'f', 'or' ] ) ]
+        netfile.write( fname, [ ( first, queries ), ( second, [] ) ] )
+
+        ( a, q ), ( b, r ) = netfile.read( fname )
+        self.assertSameNet( first, a )
+        self.assertSameNet( second, b )
+        self.assertEqual( q, queries )
+        self.assertEqual( r, [] )
+        self.assertTrue( isCompact( a.get( 'f' ).cpt ) )
+        self.assertTrue( isCompact( a.get( 'or' ).cpt ) )
+        self.assertEqual( a.topologicalOrder()[ -2: ], [ 'f', 'or' ] )
+
+        netfile.save( second, fname )
+        self.assertSameNet( second, netfile.load( fname ) )
+
+    def testNotANetfile( self ):
+        fname = os.path.join( self.dir, 'text.bnc' )
+        open( fname, 'w' ).write( 'network x {}\n' )
+        self.assertRaises( ValueError, netfile.read, fname )
+
+    def testCache( self ):
+        source = os.path.join( self.dir, 'net.bif' )
+        parsed = []
+
+        def parse( fname ):
+            parsed.append( fname )
+            return BNIFParser().parseBatchFile( fname )
+
+        def writeSource( net, mtime ):
+            f = open( source, 'w' )
+            writeBIF( net, f )
+            f.close()
+            os.utime( source, ( mtime, mtime ) )
+
+        old = randomNet( 20, maxParents=3, seed=3 )
+        writeSource( old, 1000000000 )
+        ( net, _ ), = netfile.loadCached( source, parse )
+        self.assertEqual( len( parsed ), 1 )
+        self.assertTrue( os.path.exists( netfile.cachePath( source ) ) )
+
+        # Up to date: read from the cache without parsing
+        ( net, _ ), = netfile.loadCached( source, parse )
+        self.assertEqual( len( parsed ), 1 )
+        self.assertTrue( isinstance( net.get( net.ids[ 0 ] ).cpt, numpy.memmap ) or
+                         isinstance( net.get( net.ids[ 0 ] ).cpt.base, numpy.memmap ) )
+        self.assertSameNet( old, net, str )
+
+        # Only touched: the size and hash still match, so the cache is kept
+        os.utime( source, ( 1000000100, 1000000100 ) )
+        netfile.loadCached( source, parse )
+        self.assertEqual( len( parsed ), 1 )
+
+        # Changed: parsed again and the cache rewritten
+        new = randomNet( 20, maxParents=3, seed=4 )
+        writeSource( new, 1000000200 )
+        ( net, _ ), = netfile.loadCached( source, parse )
+        self.assertEqual( len( parsed ), 2 )
+        self.assertSameNet( new, net, str )
+        ( net, _ ), = netfile.loadCached( source, parse )
+        self.assertEqual( len( parsed ), 2 )
+        self.assertSameNet( new, net, str )
+
+    def testBrokenCache( self ):
+        source = os.path.join( self.dir, 'net.bif' )
+        f = open( source, 'w' )
+        writeBIF( randomNet( 10, seed=5 ), f )
+        f.close()
+        open( netfile.cachePath( source ), 'wb' ).write( netfile.MAGIC + '\xff' * 4 )
+        ( net, _ ), = netfile.loadCached( source, BNIFParser().parseBatchFile )
+        self.assertEqual( len( net.variables ), 10 )
+
+if __name__ == '__main__':
+    unittest.main()
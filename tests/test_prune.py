@@ -0,0 +1,59 @@
+"""
+Pruning keeps the posterior of the query
+"""
+
+import unittest
+
+import numpy
+
+from bnet.BNet import BNet, BNode
+from bnet.generate import randomNet
+from bnet.prune import prune, relevant
+
+from tests.brute import posterior, context, someEvidence
+
+class PruneTest( unittest.TestCase ):
+
+    def assertKeepsPosterior( self, net, evidence, query ):
+        sub, subctx = prune( net, context( net, evidence ), query )
+        expected = posterior( net, evidence, query )
+        found = posterior( sub, subctx.getVariables(), query )
+        for v in expected:
+            self.assertAlmostEqual( found[ v ], expected[ v ], 12, ( query, evidence ) )
+        return sub
+
+    def testRandom( self ):
+        random = numpy.random.RandomState( 5 )
+        for seed in range( 10 ):
+            net = randomNet( 9, maxParents=3, arity=( 2, 3 ), seed=seed )
+            for k in ( 0, 1, 3 ):
+                evidence = someEvidence( net, random, k ) if k else {}
+                for query in net.ids:
+                    self.assertKeepsPosterior( net, evidence, query )
+
+    def chain( self ):
+        """A -> B, A -> C <- D, D -> E"""
+        net = BNet()
+        random = numpy.random.RandomState( 1 )
+        for id, parents in [ ( 'A', () ), ( 'B', ( 'A', ) ), ( 'D', () ), ( 'C', ( 'A', 'D' ) ), ( 'E', ( 'D', ) ) ]:
+            cpt = random.dirichlet( [ 1, 1 ], size=( 2, ) * len( parents ) or None ).reshape( ( 2, ) * len( parents ) + ( 2, ) )
+            net.add( BNode( id, parents, values=( 0, 1 ), cpt=cpt ) )
+        return net
+
+    def testBarrenChild( self ):
+        # C is barren, so D and E are d-separated from B
+        net = self.chain()
+        self.assertEqual( relevant( net, context( net, { 'E' : 1 } ), 'B' ), set( [ 'A', 'B' ] ) )
+        sub = self.assertKeepsPosterior( net, { 'E' : 1 }, 'B' )
+        self.assertEqual( set( sub.ids ), set( [ 'A', 'B' ] ) )
+
+    def testObservedDescendant( self ):
+        # Evidence on C joins A and D, and brings in E's evidence
+        net = self.chain()
+        for evidence in ( { 'C' : 0 }, { 'C' : 1, 'E' : 0 } ):
+            sub = self.assertKeepsPosterior( net, evidence, 'B' )
+            self.assertTrue( 'D' in sub.ids )
+        self.assertEqual( relevant( net, context( net, { 'C' : 0 } ), 'B' ), set( [ 'A', 'B', 'C', 'D' ] ) )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Queries and errors over a socket to a QueryServer
+"""
+
+import threading
+import unittest
+
+from bnet.generate import randomNet
+from bnet.server import QueryServer, listen, Client
+
+from tests.brute import posterior
+
+class ServerTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.net = randomNet( 6, maxParents=2, seed=1 )
+        self.queries = QueryServer( { 'n' : self.net }, workers=0 )
+        # Port 0 takes any free port
+        self.server = listen( 'localhost:0', self.queries )
+        self.thread = threading.Thread( target=self.server.serve_forever )
+        self.thread.daemon = True
+        self.thread.start()
+        self.address = 'localhost:%d'%( self.server.server_address[ 1 ] )
+
+    def tearDown( self ):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.queries.close()
+
+    def testRoundTrip( self ):
+        client = Client( self.address )
+        try:
+            result = client.query( [ 4 ], { 1 : True } )
+            expected = posterior( self.net, { 1 : True }, 4 )
+            self.assertEqual( result.keys(), [ '4' ] )
+            for v, p in expected.items():
+                self.assertAlmostEqual( result[ '4' ][ str( v ) ], p, 12 )
+
+            response = client.request( { 'id' : 7, 'query' : [ 99 ] } )
+            self.assertEqual( response[ 'id' ], 7 )
+            self.assertEqual( response[ 'error' ], "No variable 99" )
+            self.assertRaises( ValueError, client.query, [ 4 ], engine='gibbs', sweeps=True )
+
+            stats = client.request( { 'op' : 'stats' } )[ 'result' ]
+            self.assertEqual( ( stats[ 'requests' ], stats[ 'errors' ] ), ( 4, 2 ) )
+        finally:
+            client.close()
+
+    def testConcurrentCounts( self ):
+        def ask( n ):
+            client = Client( self.address )
+            try:
+                for i in range( n ):
+                    client.request( { 'query' : [ 2 ] } )
+                    client.request( { 'query' : [ 'nothing' ] } )
+            finally:
+                client.close()
+
+        threads = [ threading.Thread( target=ask, args=( 25, ) ) for i in range( 8 ) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = self.queries.stats()
+        self.assertEqual( ( stats[ 'requests' ], stats[ 'errors' ] ), ( 400, 200 ) )
+
+if __name__ == '__main__':
+    unittest.main()
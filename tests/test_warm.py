@@ -0,0 +1,80 @@
+"""
+Gibbs chains kept on a context between queries
+"""
+
+import unittest
+
+from bnet.BNet import Context
+from bnet.generate import randomNet
+from bnet.sampling import warmGibbs, warmChains
+
+from tests.brute import posterior, context
+
+class WarmTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.net = randomNet( 8, maxParents=2, seed=3 )
+
+    def testContinues( self ):
+        ctx = context( self.net, { 8 : True } )
+        warmGibbs( self.net, ctx, 50, 200, seed=1 )
+        chains = ctx.chains
+        self.assertEqual( chains.sampler.sweeps, 200 )
+
+        # Asking for more sweeps counts only the ones missing, on the
+        # same chains, which ends where one run of them all would
+        more = warmGibbs( self.net, ctx, 50, 500, seed=1 )
+        self.assertTrue( ctx.chains is chains )
+        self.assertEqual( chains.sampler.sweeps, 500 )
+        self.assertEqual( more, warmGibbs( self.net, context( self.net, { 8 : True } ), 50, 500, seed=1 ) )
+
+        # Asking again samples nothing more
+        state = chains.sampler.state.copy()
+        self.assertEqual( warmGibbs( self.net, ctx, 50, 500, seed=1 ), more )
+        self.assertEqual( chains.sampler.sweeps, 500 )
+        self.assertTrue( ( chains.sampler.state == state ).all() )
+
+    def testSharedWithChild( self ):
+        ctx = context( self.net, { 8 : True } )
+        warmGibbs( self.net, ctx, 50, 200, seed=1 )
+        child = Context( self.net, ctx )
+        self.assertTrue( warmChains( self.net, child, seed=1 ) is ctx.chains )
+        child.setVariable( 2, False )
+        self.assertFalse( warmChains( self.net, child, seed=1 ) is ctx.chains )
+        self.assertEqual( ctx.chains.evidence, ctx.getIndices() )
+
+    def testEvidenceChangeDropsChains( self ):
+        ctx = context( self.net, { 8 : True } )
+        warmGibbs( self.net, ctx, 50, 300, seed=1 )
+        old = ctx.chains
+        last = old.sampler.state.copy()
+
+        ctx.setVariable( 3, False )
+        new = warmChains( self.net, ctx, seed=1 )
+        self.assertFalse( new is old )
+        self.assertTrue( ctx.chains is new )
+        self.assertTrue( new.resumed )
+        self.assertEqual( new.evidence, ctx.getIndices() )
+        # The new chains start where the old ones stopped
+        free = new.sampler.free
+        self.assertTrue( ( new.sampler.state[ :, free ] == last[ :, free ] ).all() )
+
+        # and count again from nothing under the new evidence
+        result = warmGibbs( self.net, ctx, 50, 300, seed=1 )
+        self.assertTrue( ctx.chains is new )
+        self.assertEqual( new.sampler.sweeps, 300 )
+        self.assertEqual( result[ 3 ], { False : 1.0, True : 0.0 } )
+        self.assertEqual( old.sampler.sweeps, 300 )
+
+    def testAccuracy( self ):
+        ctx = context( self.net, { 8 : True } )
+        warmGibbs( self.net, ctx, 100, 2000, seed=2 )
+        ctx.setVariable( 1, False )
+        found = warmGibbs( self.net, ctx, 100, 20000, seed=2 )
+        for id in self.net.ids:
+            expected = posterior( self.net, { 8 : True, 1 : False }, id )
+            for v, p in expected.items():
+                self.assertAlmostEqual( found[ id ][ v ], p, 1, ( id, v ) )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Round trips of networks through bnet.writers and bnet.parsers
+
+Run from the top of the tree with
+    python -m unittest discover -s tests -t .
+"""
+
+from cStringIO import StringIO
+import unittest
+
+import numpy
+
+from bnet.generate import randomNet
+from bnet.parsers import RaviParser, BNIFParser
+from bnet.writers import writeRavi, writeBIF
+
+class RoundTripTest( unittest.TestCase ):
+
+    def assertSameNet( self, a, b, key=lambda id: id ):
+        """Same variables, parents, value order and CPTs, with the ids of a
+        mapped to those of b by key"""
+        self.assertEqual( len( a.variables ), len( b.variables ) )
+        for id in a.variables:
+            x = a.get( id )
+            y = b.get( key( id ) )
+            self.assertEqual( map( str, x.values ), map( str, y.values ), id )
+            self.assertEqual( [ str( key( p ) ) for p in x.parents ], map( str, y.parents ), id )
+            self.assertEqual( numpy.shape( x.cpt ), numpy.shape( y.cpt ), id )
+            self.assertTrue( numpy.allclose( numpy.asarray( x.cpt ), numpy.asarray( y.cpt ), rtol=0, atol=1e-15 ), id )
+
+    def ravi( self, net, queries=() ):
+        f = StringIO()
+        writeRavi( net, f, queries )
+        return RaviParser().parseBatch( f.getvalue() )
+
+    def bif( self, net ):
+        f = StringIO()
+        writeBIF( net, f )
+        return BNIFParser().parse( f.getvalue() )
+
+    def testRandomRavi( self ):
+        net = randomNet( 300, maxParents=4, sparsity=0.3, seed=3 )
+        ( back, queries ), = self.ravi( net, [ ( { 1 : True, 300 : False }, [ 2, 3 ] ) ] )
+        # Ravi numbers variables in topological order, which randomNet's
+        # ids already are
+        self.assertSameNet( net, back )
+        self.assertEqual( queries, [ ( { 1 : True, 300 : False }, [ 2, 3 ] ) ] )
+
+    def testRandomBIF( self ):
+        for seed, arity in ( ( 3, 2 ), ( 4, ( 2, 5 ) ) ):
+            net = randomNet( 300, maxParents=3, arity=arity, sparsity=0.3, seed=seed )
+            self.assertSameNet( net, self.bif( net ), str )
+
+    def testAlarm( self ):
+        net = BNIFParser().parseFile( 'samples/alarm.bif' )
+        self.assertSameNet( net, self.bif( net ) )
+
+    def testSampleRavi( self ):
+        net = RaviParser().parseFile( 'samples/1.ravi' )
+        ( back, queries ), = self.ravi( net )
+        self.assertSameNet( net, back )
+
+if __name__ == '__main__':
+    unittest.main()